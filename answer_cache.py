@@ -0,0 +1,114 @@
+"""
+Semantic Answer Cache.
+
+Answers to standalone questions are stored per knowledge base together with
+the query embedding and a fingerprint of the sources they were generated
+from (RAGAgent skips the cache once a conversation has an earlier question,
+since a follow-up's answer depends on it). A new question reuses a cached answer when its embedding is within the
+similarity threshold of a cached query AND retrieval for it still returns the
+same sources, so an answer is never served from evidence that has changed.
+Entries expire after a TTL, the least recently used ones are evicted beyond
+a per-KB limit, and the whole KB is invalidated when its index changes.
+"""
+import hashlib
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from config import ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL_HOURS, ANSWER_CACHE_MAX_ENTRIES
+from database import get_connection, get_read_connection, init_db
+
+
+def source_fingerprint(sources: List[Dict]) -> str:
+    """Hash of the retrieved passages (order-independent)."""
+    digests = sorted(hashlib.md5(s.get("content", "").encode("utf-8")).hexdigest() for s in sources)
+    return hashlib.md5("\n".join(digests).encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+        ttl_hours: float = ANSWER_CACHE_TTL_HOURS,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES
+    ):
+        init_db()
+        self.threshold = threshold
+        self.ttl = ttl_hours * 3600
+        self.max_entries = max_entries
+
+    def lookup(self, kb_name: str, embedding: List[float]) -> Optional[Dict[str, Any]]:
+        """最相似且超过阈值的缓存条目（未过期），没有则返回 None
+
+        返回 {"id", "query", "answer", "sources", "source_fingerprint", "similarity"}，
+        调用方还需确认当前检索结果的 source_fingerprint 一致后再调用 record_hit。
+        """
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, query, embedding, answer, sources, source_fingerprint FROM answer_cache
+                WHERE kb_name = ? AND created_at >= ?
+            ''', (kb_name, time.time() - self.ttl))
+            rows = cursor.fetchall()
+        if not rows:
+            return None
+
+        query_vec = np.asarray(embedding, dtype=np.float32)
+        vectors = [np.frombuffer(row['embedding'], dtype=np.float32) for row in rows]
+        # Embedding 模型更换后维度不同的旧条目无法比较，跳过
+        rows = [row for row, vec in zip(rows, vectors) if vec.shape == query_vec.shape]
+        if not rows:
+            return None
+        matrix = np.stack([vec for vec in vectors if vec.shape == query_vec.shape])
+        norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query_vec) or 1.0)
+        similarities = matrix @ query_vec / np.where(norms == 0, 1.0, norms)
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+
+        row = rows[best]
+        return {
+            "id": row['id'],
+            "query": row['query'],
+            "answer": row['answer'],
+            "sources": json.loads(row['sources'] or "[]"),
+            "source_fingerprint": row['source_fingerprint'],
+            "similarity": float(similarities[best]),
+        }
+
+    def record_hit(self, entry_id: int) -> None:
+        with get_connection() as conn:
+            conn.execute(
+                'UPDATE answer_cache SET last_hit_at = ?, hit_count = hit_count + 1 WHERE id = ?',
+                (time.time(), entry_id)
+            )
+
+    def store(self, kb_name: str, query: str, embedding: List[float], answer: str, sources: List[Dict]) -> None:
+        """写入一条回答，并清理过期条目、按最近使用时间淘汰超出上限的条目"""
+        now = time.time()
+        blob = np.asarray(embedding, dtype=np.float32).tobytes()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO answer_cache (kb_name, query, embedding, answer, sources, source_fingerprint, created_at, last_hit_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                kb_name, query, blob, answer,
+                json.dumps(sources, ensure_ascii=False, default=str),
+                source_fingerprint(sources), now, now
+            ))
+            cursor.execute('DELETE FROM answer_cache WHERE kb_name = ? AND created_at < ?', (kb_name, now - self.ttl))
+            cursor.execute('''
+                DELETE FROM answer_cache WHERE kb_name = ? AND id NOT IN (
+                    SELECT id FROM answer_cache WHERE kb_name = ? ORDER BY last_hit_at DESC LIMIT ?
+                )
+            ''', (kb_name, kb_name, self.max_entries))
+
+    def invalidate(self, kb_name: str) -> int:
+        """清空某个知识库的问答缓存（知识库索引变化时调用），返回删除数量"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM answer_cache WHERE kb_name = ?', (kb_name,))
+            return cursor.rowcount
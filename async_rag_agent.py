@@ -0,0 +1,340 @@
+import asyncio
+import time
+from typing import List, Dict, Optional, Tuple, Any, AsyncIterator
+
+from config import (
+    OPENAI_API_KEY,
+    OPENAI_API_BASE,
+    MODEL_NAME,
+    TOP_K,
+    EXERCISE_TOP_K,
+    COLLECTION_NAME,
+    ASYNC_LLM_CONCURRENCY,
+    QUIZ_QUESTIONS_PER_CALL,
+    QUIZ_CONTEXT_LENGTH,
+    CHAT_CONTEXT_TOKENS,
+    CONTEXT_NEIGHBOR_WINDOW,
+    get_async_openai_client,
+)
+from rag_agent import RAGAgent
+from latex_normalizer import LatexNormalizer
+from answer_cache import source_fingerprint
+
+
+class AsyncRAGAgent(RAGAgent):
+    """基于 AsyncOpenAI 的 RAGAgent，供单进程高并发服务使用
+
+    提示词构建、结果解析、LaTeX 修复等逻辑全部复用 RAGAgent，这里只把网络调用换成协程：
+    LLM 请求并发数受 ASYNC_LLM_CONCURRENCY 限制，Embedding 请求由 VectorStore.aget_embedding 限流。
+    同一个实例只能在一个事件循环中使用。
+    """
+
+    def __init__(
+        self,
+        model: str = MODEL_NAME,
+        kb_name: str = COLLECTION_NAME,
+        max_concurrency: int = ASYNC_LLM_CONCURRENCY
+    ):
+        super().__init__(model=model, kb_name=kb_name)
+        self.max_concurrency = max_concurrency
+        # 异步客户端与信号量在首次调用时创建，绑定到调用方的事件循环
+        self.async_client = None
+        self._llm_semaphore = None
+
+    def _ensure_async_client(self):
+        if self.async_client is None:
+            self.async_client = get_async_openai_client(api_key=OPENAI_API_KEY, base_url=OPENAI_API_BASE)
+            self._llm_semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def _acomplete(self, **kwargs) -> str:
+        """在信号量保护下调用 chat.completions.create，返回回复文本"""
+        self._ensure_async_client()
+        async with self._llm_semaphore:
+            response = await self.async_client.chat.completions.create(**kwargs)
+        return response.choices[0].message.content
+
+    async def _astream_tokens(self, model: str, messages: List[Dict], temperature: float = 0.3, max_tokens: int = 1500) -> AsyncIterator[str]:
+        """_stream_tokens 的异步版本，整个流式过程占用一个并发名额"""
+        self._ensure_async_client()
+        async with self._llm_semaphore:
+            stream = await self.async_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True
+            )
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta is not None:
+                    yield delta
+
+    async def aretrieve_context(self, query: str, top_k: int = TOP_K, token_budget: Optional[int] = CHAT_CONTEXT_TOKENS, neighbor_window: int = CONTEXT_NEIGHBOR_WINDOW) -> Tuple[str, List[Dict]]:
+        """retrieve_context 的异步版本"""
+        if not query:
+            return "", []
+
+        results = await self.vector_store.asearch(query, top_k=top_k)
+        if neighbor_window > 0:
+            # 相邻块可能需要读取 Chroma，放到线程池中执行
+            return await asyncio.to_thread(self._format_search_results, results, token_budget, neighbor_window)
+        return self._format_search_results(results, token_budget)
+
+    async def agenerate_response(
+        self,
+        query: str,
+        context: str,
+        chat_history: Optional[List[Dict]] = None,
+        image_data: Optional[str] = None,
+        is_quiz: bool = False,
+        skip_retrieval: bool = False
+    ) -> str:
+        """generate_response 的异步版本"""
+        messages, current_model = self._build_messages(
+            query, context, chat_history, image_data=image_data, is_quiz=is_quiz, skip_retrieval=skip_retrieval
+        )
+        temp_value = 0.7 if is_quiz else 0.3
+
+        try:
+            response_text = await self._acomplete(
+                model=current_model,
+                messages=messages,
+                temperature=temp_value,
+                max_tokens=1500
+            )
+            return self.fix_latex_format(response_text)
+        except Exception as e:
+            return f"生成回答时出错: {str(e)}"
+
+    async def agenerate_response_stream(
+        self,
+        query: str,
+        context: str,
+        chat_history: Optional[List[Dict]] = None,
+        image_data: Optional[str] = None,
+        is_quiz: bool = False,
+        skip_retrieval: bool = False,
+        stats: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[str]:
+        """generate_response_stream 的异步版本，产出已修复 LaTeX 格式的文本片段"""
+        messages, current_model = self._build_messages(
+            query, context, chat_history, image_data=image_data, is_quiz=is_quiz, skip_retrieval=skip_retrieval
+        )
+        temp_value = 0.7 if is_quiz else 0.3
+        if stats is None:
+            stats = {}
+
+        start = time.perf_counter()
+        ttft = None
+        chars = 0
+        normalizer = LatexNormalizer()
+        try:
+            async for token in self._astream_tokens(current_model, messages, temperature=temp_value):
+                piece = normalizer.feed(token)
+                if not piece:
+                    continue
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                chars += len(piece)
+                yield piece
+            tail = normalizer.flush()
+            if tail:
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                chars += len(tail)
+                yield tail
+        except Exception as e:
+            stats["error"] = str(e)
+            yield f"生成回答时出错: {str(e)}"
+        finally:
+            stats["ttft"] = ttft
+            stats["total_latency"] = time.perf_counter() - start
+            stats["chars"] = chars
+
+    async def achat_turn(
+        self,
+        query: str,
+        chat_history: Optional[List[Dict]] = None,
+        top_k: int = TOP_K,
+        image_data: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """chat_turn 的异步版本，stream 为异步迭代器"""
+        skip_retrieval = self.is_choice_answer(query)
+        cache_key = None
+        if skip_retrieval:
+            context, sources = "", []
+        elif self._cacheable(image_data, chat_history):
+            context, sources, embedding, hit = await self._aretrieve_with_cache(query, top_k)
+            if hit:
+                stats = {"cache_hit": True, "similarity": hit["similarity"], "ttft": 0.0, "total_latency": 0.0, "chars": len(hit["answer"])}
+                return {
+                    "context": context,
+                    "sources": sources,
+                    "stream": self._aremember_stream(self._aiter_once(hit["answer"]), chat_history, query),
+                    "stats": stats,
+                }
+            cache_key = (embedding, sources)
+        else:
+            context, sources = await self.aretrieve_context(query, top_k=top_k)
+
+        stats: Dict[str, Any] = {}
+        stream = self.agenerate_response_stream(
+            query, context, chat_history, image_data=image_data, skip_retrieval=skip_retrieval, stats=stats
+        )
+        return {
+            "context": context,
+            "sources": sources,
+            "stream": self._aremember_stream(stream, chat_history, query, cache_key=cache_key, stats=stats),
+            "stats": stats,
+        }
+
+    async def _aiter_once(self, text: str) -> AsyncIterator[str]:
+        yield text
+
+    async def _aremember_stream(
+        self,
+        stream: AsyncIterator[str],
+        chat_history: Optional[List[Dict]],
+        query: str,
+        cache_key: Optional[Tuple[List[float], List[Dict]]] = None,
+        stats: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[str]:
+        """_remember_stream 的异步版本"""
+        pieces = []
+        async for piece in stream:
+            pieces.append(piece)
+            yield piece
+        answer = "".join(pieces)
+        self.memory.remember_turn(chat_history, query, answer)
+        if cache_key is not None and not (stats or {}).get("error"):
+            await asyncio.to_thread(self._store_answer, query, cache_key, answer)
+
+    async def _aretrieve_with_cache(self, query: str, top_k: int = TOP_K) -> Tuple[str, List[Dict], List[float], Optional[Dict]]:
+        """_retrieve_with_cache 的异步版本"""
+        embedding = await self.vector_store.aget_embedding(query)
+        results = await self.vector_store.asearch(query, top_k=top_k, embedding=embedding)
+        context, sources = await asyncio.to_thread(
+            self._format_search_results, results, CHAT_CONTEXT_TOKENS, CONTEXT_NEIGHBOR_WINDOW
+        )
+        hit = None
+        try:
+            entry = await asyncio.to_thread(self.answer_cache.lookup, self.kb_name, embedding)
+            if entry and sources and entry["source_fingerprint"] == source_fingerprint(sources):
+                await asyncio.to_thread(self.answer_cache.record_hit, entry["id"])
+                hit = entry
+        except Exception as e:
+            print(f"查询问答缓存失败: {e}")
+        return context, sources, embedding, hit
+
+    async def aanswer_question(self, query: str, chat_history: Optional[List[Dict]] = None, top_k: int = TOP_K, image_data: Optional[str] = None) -> str:
+        """answer_question 的异步版本"""
+        if self.is_choice_answer(query):
+            answer = await self.agenerate_response(query, "", chat_history, skip_retrieval=True, image_data=image_data)
+        else:
+            cache_key = None
+            if self._cacheable(image_data, chat_history):
+                context, sources, embedding, hit = await self._aretrieve_with_cache(query, top_k)
+                if hit:
+                    self.memory.remember_turn(chat_history, query, hit["answer"])
+                    return hit["answer"]
+                cache_key = (embedding, sources)
+            else:
+                context, _ = await self.aretrieve_context(query, top_k=top_k)
+            if not context and not image_data:
+                return "无相关资料。"
+            answer = await self.agenerate_response(query, context, chat_history, image_data=image_data)
+            if cache_key is not None and not answer.startswith("生成回答时出错"):
+                await asyncio.to_thread(self._store_answer, query, cache_key, answer)
+
+        self.memory.remember_turn(chat_history, query, answer)
+        return answer
+
+    async def agenerate_quiz(self, topic: str, q_type: str, question_format: str = "multiple_choice", num_options: int = 4, num_blanks: int = 3, randomize_context: bool = False, pool_size: int = EXERCISE_TOP_K) -> Dict[str, Any]:
+        """generate_quiz 的异步版本"""
+        if randomize_context:
+            context, docs = await self.aretrieve_context(topic, top_k=pool_size, token_budget=None, neighbor_window=0)
+            if docs:
+                context = self._sample_quiz_context(docs)
+        else:
+            context, _ = await self.aretrieve_context(topic, token_budget=QUIZ_CONTEXT_LENGTH)
+
+        return await self._agenerate_quiz_from_context(context, q_type, question_format, num_options, num_blanks)
+
+    async def _agenerate_quiz_from_context(self, context: str, q_type: str, question_format: str = "multiple_choice", num_options: int = 4, num_blanks: int = 3) -> Dict[str, Any]:
+        messages = self._build_quiz_messages(context, q_type, question_format, num_options, num_blanks)
+
+        try:
+            content = await self._acomplete(
+                model=self.model,
+                messages=messages,
+                temperature=0.9,
+                response_format={ "type": "json_object" }
+            )
+            return self._parse_quiz_response(content, question_format)
+        except Exception as e:
+            print(f"出题失败: {e}")
+            return {}
+
+    async def _agenerate_quiz_group(self, context: str, k: int, q_type: str, question_format: str = "multiple_choice", num_options: int = 4, num_blanks: int = 3) -> List[Dict[str, Any]]:
+        """_generate_quiz_group 的异步版本，缺失的题目并发补生成"""
+        if k <= 1:
+            quiz = await self._agenerate_quiz_from_context(context, q_type, question_format, num_options, num_blanks)
+            return [quiz] if quiz else []
+
+        messages = self._build_quiz_group_messages(context, k, q_type, question_format, num_options, num_blanks)
+        questions = []
+        try:
+            content = await self._acomplete(
+                model=self.model,
+                messages=messages,
+                temperature=0.9,
+                response_format={ "type": "json_object" }
+            )
+            questions = self._parse_quiz_group_response(content, k, question_format, num_options, num_blanks)
+        except Exception as e:
+            print(f"批量出题失败: {e}")
+
+        missing = k - len(questions)
+        if missing:
+            print(f"批量出题返回 {len(questions)}/{k} 道合格题目，补生成 {missing} 道")
+            retried = await asyncio.gather(
+                *[self._agenerate_quiz_from_context(context, q_type, question_format, num_options, num_blanks) for _ in range(missing)]
+            )
+            questions.extend(q for q in retried if q)
+        return questions
+
+    async def agenerate_quiz_batch(self, count: int, topic: str, q_type: str, question_format: str = "multiple_choice", num_options: int = 4, num_blanks: int = 3, pool_size: int = EXERCISE_TOP_K, questions_per_call: Optional[int] = None) -> List[Dict[str, Any]]:
+        """generate_quiz_batch 的异步版本：候选池只检索一次，所有请求同时发起，并发数由信号量限制"""
+        print(f"开始异步生成 {count} 道题目...")
+        if count <= 0:
+            return []
+
+        k = max(1, min(questions_per_call or QUIZ_QUESTIONS_PER_CALL, count))
+        _, docs = await self.aretrieve_context(topic, top_k=pool_size, token_budget=None, neighbor_window=0)
+        group_sizes = [min(k, count - i) for i in range(0, count, k)]
+        contexts = self._partition_quiz_contexts(docs, len(group_sizes), sample_size=8 * k, token_budget=QUIZ_CONTEXT_LENGTH * k)
+        results = await asyncio.gather(
+            *[
+                self._agenerate_quiz_group(context, size, q_type, question_format, num_options, num_blanks)
+                for context, size in zip(contexts, group_sizes)
+            ],
+            return_exceptions=True
+        )
+
+        questions = []
+        for group in results:
+            if isinstance(group, Exception):
+                print(f"异步任务出错: {group}")
+            else:
+                questions.extend(group)
+        return questions
+
+    async def agenerate_outline(self, progress_callback=None) -> str:
+        """generate_outline 的异步版本"""
+        from outline_engine import OutlineEngine
+        try:
+            return await OutlineEngine(self, progress_callback=progress_callback).agenerate()
+        except Exception as e:
+            return f"生成大纲失败: {e}"
@@ -0,0 +1,415 @@
+"""
+性能基准脚本（quiz 需要已配置好的 API 与已建立索引的知识库，mistakes 与 images --ocr 需要已配置好的 API，latex 与 db 可离线运行）
+
+用法:
+    python benchmark.py quiz --kb 我的知识库 --count 20 --k 1 5 10
+    python benchmark.py latex --size 2000 --rounds 5
+    python benchmark.py mistakes --images samples/*.jpg --texts samples/questions.txt
+    python benchmark.py images samples/*.jpg --max-side 1600 1280 --ocr
+    python benchmark.py db --rows 5000 --writers 2 --readers 4 --seconds 10
+"""
+import argparse
+import base64
+import difflib
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+
+from config import COLLECTION_NAME, EXERCISE_TOP_K
+
+
+def bench_quiz(args):
+    """对比不同的每次请求题数 K：延迟、请求次数与每题 token 用量"""
+    from rag_agent import RAGAgent
+
+    agent = RAGAgent(kb_name=args.kb)
+    print(f"知识库: {args.kb}，题目数: {args.count}，格式: {args.format}")
+    print(f"{'K':>4} {'题数':>6} {'请求数':>6} {'补生成':>6} {'总耗时(s)':>10} {'每题耗时(s)':>12} {'每题输入token':>14} {'每题输出token':>14}")
+
+    for k in args.k:
+        stats = {}
+        start = time.perf_counter()
+        questions = agent.generate_quiz_batch(
+            count=args.count,
+            topic=args.topic,
+            q_type="偏概念",
+            question_format=args.format,
+            pool_size=args.pool_size,
+            questions_per_call=k,
+            stats=stats
+        )
+        elapsed = time.perf_counter() - start
+        n = max(len(questions), 1)
+        print(
+            f"{k:>4} {len(questions):>6} {stats.get('calls', 0):>6} {stats.get('retried', 0):>6} "
+            f"{elapsed:>10.2f} {elapsed / n:>12.2f} "
+            f"{stats.get('prompt_tokens', 0) / n:>14.1f} {stats.get('completion_tokens', 0) / n:>14.1f}"
+        )
+
+
+def legacy_fix_latex_format(text: str) -> str:
+    """原 RAGAgent.fix_latex_format 的实现，作为 latex_normalizer 的对照基准"""
+    def replace_code_block(match):
+        code_content = match.group(1)
+        if any(cmd in code_content for cmd in ['\\sum', '\\frac', '\\int', '\\sqrt', '\\left', '\\right', '=', '^', '_']):
+            cleaned = code_content.strip()
+            if '\n' in cleaned:
+                return f"$${cleaned}$$"
+            else:
+                return f"${cleaned}$"
+        return match.group(0)
+
+    text = re.sub(r'```(?:latex|math)?\n?(.*?)```', replace_code_block, text, flags=re.DOTALL)
+
+    def replace_inline_code(match):
+        code_content = match.group(1)
+        if any(cmd in code_content for cmd in ['\\sum', '\\frac', '\\int', '\\sqrt', '\\left', '\\right', '=', '^', '_']):
+            return f"${code_content}$"
+        return match.group(0)
+
+    text = re.sub(r'`([^`]+)`', replace_inline_code, text)
+
+    lines = text.split('\n')
+    fixed_lines = []
+    for line in lines:
+        if re.match(r'^[A-D][\.\)]\s*', line):
+            option_match = re.match(r'^([A-D][\.\)])\s*(.+)', line)
+            if option_match:
+                prefix = option_match.group(1)
+                content = option_match.group(2)
+                if '\\' in content and '$' not in content:
+                    line = f"{prefix} ${content}$"
+                elif '\\' in content:
+                    parts = re.split(r'(\$[^$]+\$)', content)
+                    fixed_parts = []
+                    for part in parts:
+                        if part.startswith('$') and part.endswith('$'):
+                            fixed_parts.append(part)
+                        elif '\\' in part:
+                            fixed_parts.append(f"${part}$")
+                        else:
+                            fixed_parts.append(part)
+                    line = f"{prefix} {''.join(fixed_parts)}"
+        fixed_lines.append(line)
+
+    return '\n'.join(fixed_lines)
+
+
+# 人工整理的典型回答片段
+LATEX_GOLDEN_CASES = [
+    "",
+    "错位排列的数量为 ```D(n) = n! \\sum_{k=0}^{n} \\frac{(-1)^k}{k!}``` 。",
+    "```latex\n\\int_0^1 x^2 dx = \\frac{1}{3}\n```",
+    "```math\na^2 + b^2 = c^2\nc = \\sqrt{a^2+b^2}\n```",
+    "```python\nprint('hello')\n```",
+    "行内公式 `x^2` 与代码 `print` 以及 `a = b`。",
+    "题目：什么是错位排列的数量？\nA. 错误排列的数量为 $D(n) = n! \\sum_{k=0}^{n} \\frac{(-1)^k}{k!}$\nB. D(n) = n! \\sum_{k=0}^{n} \\frac{(-1)^k}{k}\nC) $D(n)$ 等于 \\sum_{k=0}^{n} \\frac{(-1)^k}{k!}\nD. 其他答案",
+    "A.\\int\nB)   \nC.\nD",
+    "未闭合的代码块 ```\\frac{1}{2} 以及 `未闭合的行内代码",
+    "````x=1```` 和 ``y=2`` 以及 ```a``` `x=1`",
+    "\n\nA. \\left( x \\right)\n\n",
+]
+
+
+def _random_latex_corpus(count: int, seed: int = 0) -> list:
+    """由典型片段随机拼接的语料，覆盖代码块/行内代码/选项行交错的各种边界情况"""
+    atoms = [
+        'A. ', 'B) ', 'C.', 'D. ', 'E. ', 'A.\\int', '\\sum', '\\frac{1}{2}', '\\sqrt{x}', '$x$', '$$y$$',
+        '```', '```latex\n', '```math', '`', 'x=1', '^', '_', '\n', '\n\n', '中文说明', '公式', 'foo ', 'bar',
+        'A', 'B', '. ', ' ', '$', '(', ')', 'latex', 'math',
+    ]
+    rng = random.Random(seed)
+    return ["".join(rng.choice(atoms) for _ in range(rng.randint(0, 40))) for _ in range(count)]
+
+
+def _random_chunks(text: str, rng: random.Random) -> list:
+    chunks = []
+    i = 0
+    while i < len(text):
+        size = rng.randint(1, 8)
+        chunks.append(text[i:i + size])
+        i += size
+    return chunks
+
+
+def bench_latex(args):
+    """LaTeX 格式修复：先在语料上校验新实现与原实现输出一致，再对比吞吐量"""
+    from latex_normalizer import LatexNormalizer, normalize_latex
+
+    corpus = LATEX_GOLDEN_CASES + _random_latex_corpus(args.size, seed=args.seed)
+    rng = random.Random(args.seed)
+    mismatches = 0
+    for text in corpus:
+        expected = legacy_fix_latex_format(text)
+        normalizer = LatexNormalizer()
+        streamed = "".join(normalizer.feed(chunk) for chunk in _random_chunks(text, rng)) + normalizer.flush()
+        for actual in (normalize_latex(text), streamed):
+            if actual != expected:
+                mismatches += 1
+                if mismatches <= 5:
+                    print(f"不一致: {text!r}\n  原实现: {expected!r}\n  新实现: {actual!r}")
+    print(f"一致性校验: {len(corpus)} 段文本（整段 + 随机切分流式），不一致 {mismatches} 处")
+
+    # 吞吐量：拼成若干篇较长的回答，流式按约 4 字符一个 token 输入
+    documents = ["\n".join(corpus[i:i + 50]) for i in range(0, len(corpus), 50)]
+    total_chars = sum(len(d) for d in documents) * args.rounds
+
+    def run_legacy():
+        for doc in documents:
+            legacy_fix_latex_format(doc)
+
+    def run_full():
+        for doc in documents:
+            normalize_latex(doc)
+
+    def run_stream():
+        for doc in documents:
+            normalizer = LatexNormalizer()
+            for i in range(0, len(doc), 4):
+                normalizer.feed(doc[i:i + 4])
+            normalizer.flush()
+
+    print(f"{'实现':<20} {'耗时(s)':>10} {'吞吐(万字符/s)':>16}")
+    for name, fn in (("原实现 (整段)", run_legacy), ("新实现 (整段)", run_full), ("新实现 (流式)", run_stream)):
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            fn()
+        elapsed = time.perf_counter() - start
+        print(f"{name:<20} {elapsed:>10.3f} {total_chars / elapsed / 10000:>16.1f}")
+
+
+def _mistake_samples(args) -> list:
+    """错题样本：每张图片一道（走识别流程），文本文件中以空行分隔的每段一道"""
+    samples = []
+    for path in args.images or []:
+        with open(path, "rb") as f:
+            samples.append((path, {"ocr_image": base64.b64encode(f.read()).decode("utf-8")}))
+    if args.texts:
+        with open(args.texts, encoding="utf-8") as f:
+            blocks = [b.strip() for b in re.split(r'\n\s*\n', f.read()) if b.strip()]
+        samples.extend((f"{args.texts}#{i + 1}", {"question": block}) for i, block in enumerate(blocks))
+    return samples
+
+
+def bench_mistakes(args):
+    """对比错题处理流水线模式：每题端到端耗时、模型调用次数、token 用量，以及题型判断与 staged 的一致率"""
+    from job_queue import JobContext
+    from mistake_processor import run_pipeline
+
+    samples = _mistake_samples(args)
+    if not samples:
+        print("请通过 --images 或 --texts 提供样本")
+        return
+    print(f"样本数: {len(samples)}")
+
+    types = {}
+    print(f"{'模式':<10} {'成功':>4} {'每题耗时(s)':>12} {'调用次数':>8} {'输入token':>10} {'输出token':>10} {'免判断题型':>10}")
+    for mode in args.modes:
+        elapsed, calls, prompt_tokens, completion_tokens, skipped, ok = 0.0, 0, 0, 0, 0, 0
+        for name, payload in samples:
+            ctx = JobContext()
+            start = time.perf_counter()
+            try:
+                run_pipeline(payload, ctx, mode=mode)
+            except Exception as e:
+                print(f"  [{mode}] {name} 失败: {e}")
+                continue
+            elapsed += time.perf_counter() - start
+            ok += 1
+            calls += ctx.metrics.get("llm_calls", 0)
+            prompt_tokens += ctx.metrics.get("prompt_tokens", 0)
+            completion_tokens += ctx.metrics.get("completion_tokens", 0)
+            skipped += ctx.metrics.get("type_source") in ("rule", "ocr")
+            types.setdefault(name, {})[mode] = ctx.metrics.get("question_type")
+        n = max(ok, 1)
+        print(
+            f"{mode:<10} {ok:>4} {elapsed / n:>12.2f} {calls / n:>8.2f} "
+            f"{prompt_tokens / n:>10.0f} {completion_tokens / n:>10.0f} {skipped / n:>10.0%}"
+        )
+
+    if "staged" in args.modes:
+        for mode in args.modes:
+            if mode == "staged":
+                continue
+            pairs = [t for t in types.values() if "staged" in t and mode in t]
+            same = sum(1 for t in pairs if t["staged"] == t[mode])
+            print(f"{mode} 与 staged 题型一致: {same}/{len(pairs)}")
+            for name, t in types.items():
+                if "staged" in t and mode in t and t["staged"] != t[mode]:
+                    print(f"  {name}: staged={t['staged']} {mode}={t[mode]}")
+
+
+def bench_images(args):
+    """图片预处理：各参数下的体积、耗时，可选对比原图与处理后图片的识别结果相似度"""
+    from image_preprocess import prepare_image
+
+    if args.ocr:
+        from job_queue import JobContext
+        from mistake_processor import _load_clients, _recognize
+        vl_client, vl_model, _, _ = _load_clients()
+
+        def recognize(data: bytes) -> str:
+            text, _ = _recognize(vl_client, vl_model, base64.b64encode(data).decode("utf-8"), JobContext())
+            return text
+
+    originals = []
+    for path in args.paths:
+        with open(path, "rb") as f:
+            originals.append((path, f.read()))
+    if not originals:
+        print("请提供图片路径")
+        return
+    total_in = sum(len(data) for _, data in originals)
+    print(f"样本数: {len(originals)}，原始总大小 {total_in / 1024:.1f} KB")
+
+    # 原图只识别一次，作为各参数下的对照
+    reference = {path: recognize(data) for path, data in originals} if args.ocr else {}
+
+    header = f"{'最长边':>6} {'格式':<6} {'质量':>4} {'处理后(KB)':>10} {'节省':>6} {'每张耗时(ms)':>12}"
+    print(header + (f" {'识别相似度':>10}" if args.ocr else ""))
+    for max_side in args.max_side:
+        for fmt in args.formats:
+            total_out, elapsed, similarities = 0, 0.0, []
+            for path, data in originals:
+                start = time.perf_counter()
+                result = prepare_image(data, purpose="benchmark", max_side=max_side, fmt=fmt, quality=args.quality, crop=args.crop)
+                elapsed += time.perf_counter() - start
+                total_out += len(result)
+                if args.ocr:
+                    similarity = difflib.SequenceMatcher(None, reference[path], recognize(result)).ratio()
+                    similarities.append(similarity)
+                    if similarity < 0.9:
+                        print(f"  {path} ({max_side}/{fmt}) 识别相似度 {similarity:.0%}")
+            line = (
+                f"{max_side:>6} {fmt:<6} {args.quality:>4} {total_out / 1024:>10.1f} "
+                f"{1 - total_out / total_in:>6.0%} {elapsed / len(originals) * 1000:>12.1f}"
+            )
+            if similarities:
+                line += f" {sum(similarities) / len(similarities):>10.1%}"
+            print(line)
+
+
+def _percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+def bench_db(args):
+    """数据库并发：后台线程写入错题的同时页面线程分页查询，对比旧的单连接 DELETE 日志与 WAL + 只读连接池"""
+    import database
+    from question_db import QuestionDB
+
+    configs = [
+        ("DELETE 单连接", "DELETE", 0),
+        ("WAL + 读连接池", "WAL", database.READ_POOL_SIZE),
+    ]
+    book = "基准错题本"
+    print(f"初始题目: {args.rows}，写线程: {args.writers}，读线程: {args.readers}，每种配置 {args.seconds}s")
+    print(f"{'配置':<14} {'写入/s':>8} {'写 p95(ms)':>10} {'读取/s':>8} {'读 p50(ms)':>10} {'读 p95(ms)':>10}")
+    saved = (database.JOURNAL_MODE, database.READ_POOL_SIZE)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for label, journal_mode, pool_size in configs:
+            database.JOURNAL_MODE, database.READ_POOL_SIZE = journal_mode, pool_size
+            database.set_db_path(os.path.join(tmp_dir, f"{journal_mode.lower()}.db"))
+            db = QuestionDB()
+
+            def add_question(i: int) -> None:
+                question = {
+                    "question_type": "解答题",
+                    "question": f"第 {i} 题：求函数 f(x) = x^2 + {i}x 的最小值",
+                    "correct_answer": f"-{i * i / 4}",
+                    "explanation": "配方法求最值",
+                }
+                db.add_result("基准", question, "0", False, summary=f"二次函数最值 {i}", mistake_book=book)
+
+            for i in range(args.rows):
+                add_question(i)
+
+            write_latencies, read_latencies = [], []
+            stop = threading.Event()
+
+            def writer(seed: int) -> None:
+                i = args.rows + seed * 1_000_000
+                while not stop.is_set():
+                    start = time.perf_counter()
+                    add_question(i)
+                    write_latencies.append(time.perf_counter() - start)
+                    i += 1
+
+            def reader() -> None:
+                while not stop.is_set():
+                    start = time.perf_counter()
+                    db.list_questions(book, sort="newest", limit=50)
+                    db.get_book_counts(book)
+                    read_latencies.append(time.perf_counter() - start)
+
+            threads = [threading.Thread(target=writer, args=(n,)) for n in range(args.writers)]
+            threads += [threading.Thread(target=reader) for _ in range(args.readers)]
+            for t in threads:
+                t.start()
+            time.sleep(args.seconds)
+            stop.set()
+            for t in threads:
+                t.join()
+
+            print(
+                f"{label:<14} {len(write_latencies) / args.seconds:>8.0f} {_percentile(write_latencies, 0.95) * 1000:>10.1f} "
+                f"{len(read_latencies) / args.seconds:>8.0f} {_percentile(read_latencies, 0.5) * 1000:>10.1f} "
+                f"{_percentile(read_latencies, 0.95) * 1000:>10.1f}"
+            )
+        database.JOURNAL_MODE, database.READ_POOL_SIZE = saved
+        database.set_db_path(None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vulpis 性能基准")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p_quiz = subparsers.add_parser("quiz", help="批量出题：每次请求一道题 vs 每次请求 K 道题")
+    p_quiz.add_argument("--kb", default=COLLECTION_NAME, help="知识库名称")
+    p_quiz.add_argument("--count", type=int, default=20, help="每轮生成的题目数")
+    p_quiz.add_argument("--k", type=int, nargs="+", default=[1, 5], help="要对比的每次请求题数")
+    p_quiz.add_argument("--format", default="multiple_choice", choices=["multiple_choice", "fill_in_blank"])
+    p_quiz.add_argument("--topic", default="Core Concepts and Key Principles")
+    p_quiz.add_argument("--pool-size", type=int, default=EXERCISE_TOP_K)
+    p_quiz.set_defaults(func=bench_quiz)
+
+    p_latex = subparsers.add_parser("latex", help="LaTeX 格式修复：一致性校验与吞吐量")
+    p_latex.add_argument("--size", type=int, default=2000, help="随机语料的文本段数")
+    p_latex.add_argument("--rounds", type=int, default=5, help="吞吐量测试的重复轮数")
+    p_latex.add_argument("--seed", type=int, default=0)
+    p_latex.set_defaults(func=bench_latex)
+
+    p_mistakes = subparsers.add_parser("mistakes", help="错题处理：分步流水线 vs 合并识别与题型判断")
+    p_mistakes.add_argument("--images", nargs="*", help="题目图片（走识别流程）")
+    p_mistakes.add_argument("--texts", help="文字题样本文件，题目之间以空行分隔")
+    p_mistakes.add_argument("--modes", nargs="+", default=["staged", "combined"], choices=["staged", "combined"])
+    p_mistakes.set_defaults(func=bench_mistakes)
+
+    p_images = subparsers.add_parser("images", help="图片预处理：上传体积、耗时与识别准确率")
+    p_images.add_argument("paths", nargs="+", help="样本图片")
+    p_images.add_argument("--max-side", type=int, nargs="+", default=[1600], help="要对比的最长边像素")
+    p_images.add_argument("--formats", nargs="+", default=["jpeg", "webp"], choices=["jpeg", "webp"])
+    p_images.add_argument("--quality", type=int, default=85)
+    p_images.add_argument("--crop", action="store_true", help="自动裁掉四周空白")
+    p_images.add_argument("--ocr", action="store_true", help="调用视觉模型对比原图与处理后图片的识别结果（需要已配置好的 API）")
+    p_images.set_defaults(func=bench_images)
+
+    p_db = subparsers.add_parser("db", help="数据库并发：后台写入时的页面查询延迟")
+    p_db.add_argument("--rows", type=int, default=5000, help="预先写入的错题数")
+    p_db.add_argument("--writers", type=int, default=2, help="写线程数（模拟后台 worker）")
+    p_db.add_argument("--readers", type=int, default=4, help="读线程数（模拟页面刷新）")
+    p_db.add_argument("--seconds", type=float, default=10, help="每种配置的运行时长")
+    p_db.set_defaults(func=bench_db)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 import os
 import httpx
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 from dotenv import load_dotenv
+import http_pool
 
 # 数据目录配置
 from settings_utils import get_user_data_dir
@@ -35,6 +36,12 @@ VL_API_KEY = os.getenv("VL_API_KEY", OPENAI_API_KEY)
 VL_API_BASE = os.getenv("VL_API_BASE", OPENAI_API_BASE)
 VL_MODEL_NAME = os.getenv("VL_MODEL_NAME", "")
 
+# 图片预处理配置 (发送给视觉模型前缩放与重新编码)
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1600")) # 最长边像素，0 表示不缩放
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "jpeg") # jpeg 或 webp
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85")) # 编码质量 (1~100)
+IMAGE_AUTO_CROP = os.getenv("IMAGE_AUTO_CROP", "False").lower() == "true" # 裁掉四周空白，只保留文字区域
+
 # 课件图像理解配置
 ENABLE_IMAGE_CAPTIONING = os.getenv("ENABLE_IMAGE_CAPTIONING", "False").lower() == "true"
 IMAGE_CAPTION_MODEL = os.getenv("IMAGE_CAPTION_MODEL", "") 
@@ -68,16 +75,68 @@ MAX_TOKENS = int(os.getenv("MAX_TOKENS", "4096"))
 TOP_K = int(os.getenv("TOP_K", "6"))
 EXERCISE_TOP_K = int(os.getenv("EXERCISE_TOP_K", "100")) # Pool size for random quiz
 EXERCISE_TOP_K_TOPIC = int(os.getenv("EXERCISE_TOP_K_TOPIC", "30")) # Pool size when topic is specified
-QUIZ_CONTEXT_LENGTH = int(os.getenv("QUIZ_CONTEXT_LENGTH", "2000"))
+QUIZ_CONTEXT_LENGTH = int(os.getenv("QUIZ_CONTEXT_LENGTH", "2000")) # 每道题资料部分的 token 预算
+CHAT_CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", "6000")) # 问答时资料部分的 token 预算
+CONTEXT_NEIGHBOR_WINDOW = int(os.getenv("CONTEXT_NEIGHBOR_WINDOW", "1")) # 每个命中块前后各补充的相邻块数
+QUIZ_QUESTIONS_PER_CALL = int(os.getenv("QUIZ_QUESTIONS_PER_CALL", "1")) # 批量出题时每次请求生成的题目数
+ENABLE_QUIZ_POOL = os.getenv("ENABLE_QUIZ_POOL", "True").lower() == "true" # 后台预生成题目池
+QUIZ_POOL_TARGET_DEPTH = int(os.getenv("QUIZ_POOL_TARGET_DEPTH", "10")) # 每个 (知识库, 格式, 类型) 预生成的题目数
 PANDOC_PATH = os.getenv("PANDOC_PATH", "") # Optional custom path for pandoc
-MEMORY_WINDOW_SIZE = int(os.getenv("MEMORY_WINDOW_SIZE", "10"))
+MEMORY_WINDOW_SIZE = int(os.getenv("MEMORY_WINDOW_SIZE", "10")) # 最多保留原文的最近消息条数
+CHAT_HISTORY_TOKENS = int(os.getenv("CHAT_HISTORY_TOKENS", "2000")) # 对话历史（摘要 + 最近原文）的 token 上限
+ENABLE_MEMORY_SUMMARY = os.getenv("ENABLE_MEMORY_SUMMARY", "True").lower() == "true" # 较早的对话在后台压缩为摘要
+ENABLE_ANSWER_CACHE = os.getenv("ENABLE_ANSWER_CACHE", "False").lower() == "true" # 语义问答缓存
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")) # 查询向量余弦相似度阈值
+ANSWER_CACHE_TTL_HOURS = float(os.getenv("ANSWER_CACHE_TTL_HOURS", "168")) # 缓存有效期（小时）
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "500")) # 每个知识库最多缓存的回答数
+
+# 大纲生成配置 (map-reduce)
+OUTLINE_MAP_CONCURRENCY = int(os.getenv("OUTLINE_MAP_CONCURRENCY", "4")) # 同时进行的分段摘要请求数
+OUTLINE_MAP_INPUT_CHARS = int(os.getenv("OUTLINE_MAP_INPUT_CHARS", "12000")) # 每个摘要单元的最大字符数
+OUTLINE_REDUCE_INPUT_CHARS = int(os.getenv("OUTLINE_REDUCE_INPUT_CHARS", "24000")) # 每次合并/最终生成的最大输入字符数
+
+# 异步服务配置 (AsyncRAGAgent)
+ASYNC_LLM_CONCURRENCY = int(os.getenv("ASYNC_LLM_CONCURRENCY", "200")) # 单进程同时在途的 LLM 请求上限
+ASYNC_EMBEDDING_CONCURRENCY = int(os.getenv("ASYNC_EMBEDDING_CONCURRENCY", "50")) # 同时在途的 Embedding 请求上限
+
+# 后台任务队列配置 (错题识别等)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2")) # 同时执行的后台任务数（重启后生效）
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3")) # 每个任务最多尝试次数
+JOB_RETRY_BASE_SECONDS = float(os.getenv("JOB_RETRY_BASE_SECONDS", "5")) # 首次重试前的等待秒数，之后逐次翻倍
+MISTAKE_PIPELINE = os.getenv("MISTAKE_PIPELINE", "combined") # combined: 识别与题型判断合并为一次调用/本地规则判断题型; staged: 识别、判断、解题三次调用
+
+# HTTP 连接池配置 (所有 API 调用按 base URL 共享连接池)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "200"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "50"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "600")) # 读写超时（秒），与 openai 库默认值一致
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "True").lower() == "true" # 需要安装 h2 包才会实际启用
+
+# 答题记录保留与归档
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", "365")) # 超过天数的答题记录移入压缩归档文件，0 表示全部保留在数据库中
+HISTORY_MAINTENANCE_HOURS = float(os.getenv("HISTORY_MAINTENANCE_HOURS", "24")) # 后台归档与数据库整理的间隔（小时）
 
 
 
+def _http_limits():
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def _http_timeout():
+    return httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+
+
 def get_openai_client(api_key=None, base_url=None):
     """
     Factory function to create an OpenAI client with SSL verification disabled (verify=False).
     Use this instead of creating OpenAI() directly to ensure self-signed certificates are accepted.
+    The underlying httpx.Client is shared per base URL (see http_pool), so keep-alive connections
+    and TLS sessions are reused across every caller in the process.
     """
     # Fallback to defaults if None is passed
     if api_key is None: api_key = OPENAI_API_KEY
@@ -86,7 +145,8 @@ def get_openai_client(api_key=None, base_url=None):
     # Prepare arguments
     kwargs = {
         "api_key": api_key,
-        "http_client": httpx.Client(verify=False)
+        "timeout": _http_timeout(),
+        "http_client": http_pool.get_http_client(base_url, _http_limits(), _http_timeout(), http2=HTTP2_ENABLED)
     }
     
     # Only pass base_url if it's not empty, otherwise let OpenAI library use its default
@@ -94,3 +154,23 @@ def get_openai_client(api_key=None, base_url=None):
         kwargs["base_url"] = base_url
     
     return OpenAI(**kwargs)
+
+
+def get_async_openai_client(api_key=None, base_url=None):
+    """
+    Async counterpart of get_openai_client: an AsyncOpenAI client with SSL verification disabled.
+    The client must only be used from the event loop it was created in.
+    """
+    if api_key is None: api_key = OPENAI_API_KEY
+    if base_url is None: base_url = OPENAI_API_BASE
+    
+    kwargs = {
+        "api_key": api_key,
+        "timeout": _http_timeout(),
+        "http_client": http_pool.get_async_http_client(base_url, _http_limits(), _http_timeout(), http2=HTTP2_ENABLED)
+    }
+    
+    if base_url:
+        kwargs["base_url"] = base_url
+    
+    return AsyncOpenAI(**kwargs)
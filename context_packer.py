@@ -0,0 +1,171 @@
+"""
+检索结果的上下文组装
+
+检索返回的文档块按 chunk_overlap 切分，同一页相邻的块之间有大段重复文字。
+这里先把同一文件同一页中相邻或重叠的块合并成连续段落、去掉重复片段，
+再按检索排名在 token 预算内装箱，取代原先按字符数截断拼接结果的做法。
+"""
+import re
+from typing import Any, Dict, List, Optional
+
+# 中日韩文字与全角标点，约 1 字 1 token
+_CJK_RE = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]')
+_SENTENCE_END_RE = re.compile(r'[。！？.!?\n]')
+
+# 判定两个块首尾重叠所需的最短重复长度，避免偶然相同的几个字被当作重叠
+MIN_OVERLAP_CHARS = 16
+# 预算所剩不足以放下一个段落时，剩余 token 至少这么多才截断放入
+MIN_PARTIAL_TOKENS = 80
+
+
+def estimate_tokens(text: str) -> int:
+    """估算文本的 token 数：中文按 1 字 1 token，其余字符按约 4 字符 1 token
+
+    不依赖具体模型的分词器，对中英混排的课程资料误差在可接受范围内。
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _overlap_length(head: str, tail: str) -> int:
+    """head 的结尾与 tail 的开头重合的最大长度（不足 MIN_OVERLAP_CHARS 视为 0）"""
+    if len(head) < MIN_OVERLAP_CHARS or len(tail) < MIN_OVERLAP_CHARS:
+        return 0
+    probe = tail[:MIN_OVERLAP_CHARS]
+    pos = head.find(probe, max(0, len(head) - len(tail)))
+    while pos != -1:
+        # 从左往右找到的第一个匹配位置对应最长重叠
+        if tail.startswith(head[pos:]):
+            return len(head) - pos
+        pos = head.find(probe, pos + 1)
+    return 0
+
+
+def _as_int(value: Any, default: int = -1) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def merge_passages(docs: List[Dict]) -> List[Dict]:
+    """合并同一文件同一页中相邻/重叠的文档块并去重，按检索排名返回段落
+
+    docs 按检索排名排列，每项包含 content、metadata、score、source_label。
+    返回的段落沿用同样的字段，另有 rank（组内最靠前的排名）与 chunk_ids。
+    """
+    groups: Dict[tuple, List[Dict]] = {}
+    for rank, doc in enumerate(docs):
+        content = doc.get("content") or ""
+        if not content.strip():
+            continue
+        meta = doc.get("metadata") or {}
+        key = (meta.get("filepath") or meta.get("filename", ""), str(meta.get("page_number", "")))
+        groups.setdefault(key, []).append({
+            **doc,
+            "content": content,
+            "rank": rank,
+            "chunk_ids": [_as_int(meta.get("chunk_id"))],
+        })
+
+    passages = []
+    for items in groups.values():
+        items.sort(key=lambda p: p["chunk_ids"][0])
+        current = None
+        for item in items:
+            if current is None:
+                current = item
+                continue
+            text = item["content"]
+            if text in current["content"]:
+                # 完全被已有段落覆盖的重复片段
+                current["chunk_ids"].extend(item["chunk_ids"])
+                current["rank"] = min(current["rank"], item["rank"])
+                continue
+            overlap = _overlap_length(current["content"], text)
+            adjacent = item["chunk_ids"][0] == current["chunk_ids"][-1] + 1
+            if overlap or adjacent:
+                joiner = "" if overlap else "\n"
+                current["content"] = current["content"] + joiner + text[overlap:]
+                current["chunk_ids"].extend(item["chunk_ids"])
+                if item["rank"] < current["rank"]:
+                    current["rank"] = item["rank"]
+                    current["score"] = item.get("score")
+            else:
+                passages.append(current)
+                current = item
+        if current is not None:
+            passages.append(current)
+
+    passages.sort(key=lambda p: p["rank"])
+
+    # 不同文件中的重复片段（例如同一份讲义的副本），被排名更靠前的段落包含时去掉
+    kept = []
+    unique = []
+    for passage in passages:
+        fingerprint = "".join(passage["content"].split())
+        if any(fingerprint in other for other in kept):
+            continue
+        kept.append(fingerprint)
+        unique.append(passage)
+    return unique
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """把文本截断到不超过 max_tokens，尽量在句子边界处截断"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    cut = text[:lo]
+    # 最后一个句子结束符落在后 30% 的范围内时，在该处截断
+    ends = [m.end() for m in _SENTENCE_END_RE.finditer(cut)]
+    if ends and ends[-1] >= len(cut) * 0.7:
+        return cut[:ends[-1]]
+    return cut
+
+
+def _passage_header(index: int, passage: Dict) -> str:
+    return f"【资料 {index}】({passage.get('source_label', '')}):\n"
+
+
+def pack_passages(passages: List[Dict], token_budget: Optional[int]) -> List[Dict]:
+    """按给定顺序在 token 预算内装入段落；token_budget 为 None 或 <= 0 时不限制
+
+    放不下的段落跳过，后面更短的段落仍有机会装入；剩余预算足够时，
+    第一个放不下的段落截断后放入，保证至少返回一段资料。
+    """
+    if not token_budget or token_budget <= 0:
+        return list(passages)
+
+    packed = []
+    used = 0
+    for passage in passages:
+        overhead = estimate_tokens(_passage_header(len(packed) + 1, passage)) + 1
+        cost = estimate_tokens(passage["content"]) + overhead
+        if used + cost <= token_budget:
+            packed.append(passage)
+            used += cost
+            continue
+        remaining = token_budget - used - overhead
+        if remaining >= MIN_PARTIAL_TOKENS or not packed:
+            content = truncate_to_tokens(passage["content"], max(remaining, 0))
+            if content.strip():
+                packed.append({**passage, "content": content, "truncated": True})
+                used += estimate_tokens(content) + overhead
+    return packed
+
+
+def format_passages(passages: List[Dict]) -> str:
+    """拼接为提示词中的资料文本"""
+    return "".join(
+        f"{_passage_header(i + 1, passage)}{passage['content']}\n\n"
+        for i, passage in enumerate(passages)
+    )
@@ -0,0 +1,188 @@
+"""
+对话记忆：较早的对话压缩为滚动摘要，最近几条消息保留原文
+
+每轮回答结束后在后台线程中把移出原文窗口的消息合并进摘要，不阻塞当前回答；
+构建提示词时 历史摘要 + 最近原文 的总量不超过 CHAT_HISTORY_TOKENS。
+"""
+import threading
+from typing import Dict, List, Optional
+
+from config import MEMORY_WINDOW_SIZE, CHAT_HISTORY_TOKENS, ENABLE_MEMORY_SUMMARY
+from context_packer import estimate_tokens, truncate_to_tokens
+
+
+SUMMARY_PROMPT = """你负责维护一段师生答疑对话的记忆摘要。
+请把【已有摘要】与【新增对话】合并为一份新的摘要，要求：
+1. 保留学生问过的知识点、卡住的地方、已得出的关键结论与公式
+2. 若助教出过题，保留题干、选项和学生的作答情况
+3. 省略寒暄与重复的解释，不超过 {max_chars} 字
+4. 直接输出摘要正文，不要任何前缀
+
+【已有摘要】
+{summary}
+
+【新增对话】
+{dialogue}
+"""
+
+
+class ConversationMemory:
+    """单个会话的记忆，随 RAGAgent 实例存在（聊天页中保存在 session_state 里）
+
+    chat_history 是页面维护的完整消息列表；summarized_count 记录其中前多少条已经并入摘要。
+    """
+
+    def __init__(
+        self,
+        client,
+        model: str,
+        window_size: int = MEMORY_WINDOW_SIZE,
+        token_budget: int = CHAT_HISTORY_TOKENS,
+        enable_summary: bool = ENABLE_MEMORY_SUMMARY
+    ):
+        self.client = client
+        self.model = model
+        self.window_size = window_size
+        self.token_budget = token_budget
+        self.enable_summary = enable_summary
+        # 摘要最多占历史预算的四分之一，其余留给最近原文
+        self.summary_budget = max(token_budget // 4, 100)
+
+        self.summary = ""
+        self.summarized_count = 0
+        self._lock = threading.Lock()
+        self._updating = False
+        self._generation = 0  # 每次清空加一，用于丢弃清空前发起的摘要更新
+
+    def reset(self) -> None:
+        """清空对话历史时调用"""
+        with self._lock:
+            self._reset_locked()
+
+    def _reset_locked(self) -> None:
+        self.summary = ""
+        self.summarized_count = 0
+        self._generation += 1
+
+    def _clean(self, chat_history: List[Dict]) -> List[Dict]:
+        # 只保留文本，避免把历史消息中的 Base64 图片重复发给 API
+        return [{"role": msg.get("role", "user"), "content": msg.get("content", "") or ""} for msg in chat_history]
+
+    def _recent_start(self, history: List[Dict], budget: int) -> int:
+        """最近原文的起点：从最新一条往前，条数不超过 window_size、总 token 不超过 budget
+
+        至少保留最新一条（必要时截断），保证批改选择题时能看到上一轮的题目。
+        """
+        start = len(history)
+        used = 0
+        while start > 0 and len(history) - start < self.window_size:
+            cost = estimate_tokens(history[start - 1]["content"]) + 4
+            if used + cost > budget and start < len(history):
+                break
+            used += cost
+            start -= 1
+        return start
+
+    def _unsummarized_start(self, history: List[Dict], summarized_count: int, budget: int) -> int:
+        """原文窗口延伸到 summarized_count（不受 window_size 限制）；超出 budget 时最旧的一条由调用方截断
+
+        只有较新的消息已经用完 budget 时，更早的消息才会被舍弃。
+        """
+        start = len(history)
+        used = 0
+        while start > summarized_count and used < budget:
+            used += estimate_tokens(history[start - 1]["content"]) + 4
+            start -= 1
+        return start
+
+    def build_history(self, chat_history: Optional[List[Dict]]) -> List[Dict]:
+        """返回写入提示词的历史消息：[摘要(system)] + 最近原文，总量不超过 token_budget"""
+        if not chat_history:
+            return []
+        history = self._clean(chat_history)
+
+        with self._lock:
+            if self.summarized_count > len(history):
+                # 页面上的对话被清空或替换，旧摘要作废
+                self._reset_locked()
+            summary = self.summary
+            summarized_count = self.summarized_count
+
+        if not self.enable_summary:
+            summary = ""
+            summarized_count = 0
+
+        summary_cost = estimate_tokens(summary) + 16 if summary else 0
+        budget = self.token_budget - summary_cost
+        start = self._recent_start(history, budget)
+        if self.enable_summary and summarized_count < start:
+            # 摘要落后（后台更新未完成或失败）时，尚未并入摘要的消息仍发送原文，否则它们既不在摘要里也不在原文里
+            start = self._unsummarized_start(history, summarized_count, budget)
+        # 已并入摘要的消息不再重复发送原文
+        start = max(start, summarized_count) if summary else start
+        recent = history[start:]
+        if recent:
+            remaining = budget - 4 - sum(estimate_tokens(m["content"]) + 4 for m in recent[1:])
+            recent[0] = {**recent[0], "content": truncate_to_tokens(recent[0]["content"], max(remaining, 0))}
+
+        messages = []
+        if summary:
+            messages.append({"role": "system", "content": f"此前对话的摘要：\n{summary}"})
+        messages.extend(recent)
+        return messages
+
+    def remember_turn(self, chat_history: Optional[List[Dict]], query: str, reply: str) -> None:
+        """一轮回答结束后调用：在后台把移出原文窗口的消息并入摘要"""
+        if not self.enable_summary:
+            return
+        history = self._clean(chat_history or []) + [
+            {"role": "user", "content": query},
+            {"role": "assistant", "content": reply},
+        ]
+        with self._lock:
+            if self._updating:
+                # 上一次更新还没完成，新增的消息留到下一轮一起合并
+                return
+            if self.summarized_count > len(history):
+                self._reset_locked()
+            end = self._recent_start(history, self.token_budget - self.summary_budget)
+            if end <= self.summarized_count:
+                return
+            self._updating = True
+            summary = self.summary
+            pending = history[self.summarized_count:end]
+            generation = self._generation
+
+        threading.Thread(
+            target=self._update_summary,
+            args=(summary, pending, end, generation),
+            daemon=True
+        ).start()
+
+    def _update_summary(self, summary: str, pending: List[Dict], end: int, generation: int) -> None:
+        dialogue = "\n".join(
+            f"{'学生' if msg['role'] == 'user' else '助教'}：{msg['content']}" for msg in pending
+        )
+        prompt = SUMMARY_PROMPT.format(
+            max_chars=self.summary_budget,
+            summary=summary or "（无）",
+            dialogue=dialogue
+        )
+        try:
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.2,
+                max_tokens=self.summary_budget * 2
+            )
+            new_summary = truncate_to_tokens((response.choices[0].message.content or "").strip(), self.summary_budget)
+            with self._lock:
+                # 期间对话被清空时丢弃本次结果
+                if self._generation == generation:
+                    self.summary = new_summary
+                    self.summarized_count = end
+        except Exception as e:
+            print(f"更新对话摘要失败: {e}")
+        finally:
+            with self._lock:
+                self._updating = False
@@ -3,134 +3,390 @@ SQLite Database Layer for User Progress Storage.
 
 This module replaces the JSON-based storage with SQLite for better
 reliability and query performance.
+
+The database runs in WAL mode. All writes go through one shared writer
+connection (get_connection), serialized by a lock, while read-only queries
+use a small pool of separate read-only connections (get_read_connection).
+Under WAL, readers see the last committed state without waiting for the
+writer, so background workers saving results do not block page renders.
+
+The schema is versioned: init_db applies the entries of MIGRATIONS that are
+newer than the version recorded in the schema_version table, each in its
+own transaction.
 """
 import sqlite3
 import os
 import json
+import queue
 import sys
 import threading
 from contextlib import contextmanager
+from pathlib import Path
 from settings_utils import get_user_data_dir
+from text_search import search_tokens
 
 DB_FILE = "user_progress.db"
 
-# Thread-local storage for connections (one connection per thread)
-_thread_local = threading.local()
+# Connection tuning
+JOURNAL_MODE = "WAL"
+BUSY_TIMEOUT_MS = 30000
+CACHE_SIZE_KB = 16 * 1024
+MMAP_SIZE = 128 * 1024 * 1024
+# Read-only connections kept for get_read_connection (0: reads use the writer)
+READ_POOL_SIZE = 4
+
+_db_path_override = None
+_writer = None
+_writer_lock = threading.RLock()
+_idle_readers = queue.LifoQueue()
+_reader_slots = threading.BoundedSemaphore(READ_POOL_SIZE)
 
 
 def get_db_path():
     """Get the absolute path to the database file."""
+    if _db_path_override:
+        return _db_path_override
     data_dir = get_user_data_dir()
     return os.path.join(data_dir, DB_FILE)
 
 
-def _get_thread_connection():
-    """Get or create a connection for the current thread."""
-    if not hasattr(_thread_local, 'conn') or _thread_local.conn is None:
-        db_path = get_db_path()
+def _connect(read_only=False):
+    db_path = get_db_path()
+    if read_only:
+        conn = sqlite3.connect(f"{Path(db_path).as_uri()}?mode=ro", uri=True, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        conn.execute("PRAGMA query_only = 1")
+    else:
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
-        conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
-        conn.row_factory = sqlite3.Row
-        _thread_local.conn = conn
-    return _thread_local.conn
+        conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        # Must precede the journal mode switch to apply to a new database; existing
+        # ones switch on their next full VACUUM (history_archive)
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute(f"PRAGMA journal_mode = {JOURNAL_MODE}")
+        # NORMAL is durable across application crashes in WAL mode (only an OS crash can lose the last commits)
+        conn.execute(f"PRAGMA synchronous = {'NORMAL' if JOURNAL_MODE.upper() == 'WAL' else 'FULL'}")
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.row_factory = sqlite3.Row
+    # Used by the full-text search triggers, must exist on every connection that writes
+    conn.create_function("search_tokens", 1, search_tokens, deterministic=True)
+    return conn
 
 
 @contextmanager
 def get_connection():
-    """Context manager for database connections using thread-local singleton."""
-    conn = _get_thread_connection()
-    try:
-        yield conn
-        conn.commit()
-    except Exception:
-        conn.rollback()
-        raise
+    """Context manager for the shared writer connection.
+
+    Blocks are serialized across threads (re-entrant within a thread) and
+    committed on exit, rolled back on error. Keep slow work outside the block.
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = _connect()
+        conn = _writer
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+@contextmanager
+def get_read_connection():
+    """Context manager for a pooled read-only connection (sees committed data only).
+
+    Waits while all READ_POOL_SIZE connections are in use.
+    """
+    if READ_POOL_SIZE <= 0:
+        with get_connection() as conn:
+            yield conn
+        return
+    init_db()  # the database file must exist before it can be opened read-only
+    with _reader_slots:
+        try:
+            conn = _idle_readers.get_nowait()
+        except queue.Empty:
+            conn = _connect(read_only=True)
+        try:
+            yield conn
+        finally:
+            _idle_readers.put(conn)
+
+
+def set_db_path(path):
+    """Point the module at another database file (benchmarks, tools), closing open connections."""
+    global _db_path_override, _writer, _db_initialized, _reader_slots
+    with _writer_lock:
+        if _writer is not None:
+            _writer.close()
+            _writer = None
+        while True:
+            try:
+                _idle_readers.get_nowait().close()
+            except queue.Empty:
+                break
+        _reader_slots = threading.BoundedSemaphore(max(READ_POOL_SIZE, 1))
+        _db_path_override = path
+        _db_initialized = False
+
+
+def _add_column(cursor, table, column, definition):
+    cursor.execute(f'PRAGMA table_info({table})')
+    if column not in {row['name'] for row in cursor.fetchall()}:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+def _migration_base_tables(cursor):
+    # 错题本表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS mistake_books (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            is_archived INTEGER DEFAULT 0,
+            created_at REAL
+        )
+    ''')
+    
+    # 答题记录/错题表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS questions (
+            id TEXT PRIMARY KEY,
+            book_id INTEGER,
+            timestamp REAL,
+            kb_name TEXT,
+            question_type TEXT,
+            question_text TEXT,
+            options TEXT,
+            correct_answer TEXT,
+            explanation TEXT,
+            user_answer TEXT,
+            is_correct INTEGER,
+            summary TEXT,
+            status TEXT DEFAULT 'completed',
+            familiarity_score INTEGER DEFAULT 2,
+            is_archived INTEGER DEFAULT 0,
+            last_reviewed REAL,
+            review_count INTEGER DEFAULT 0,
+            FOREIGN KEY (book_id) REFERENCES mistake_books(id)
+        )
+    ''')
+    
+    # 历史记录表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS history (
+            id TEXT PRIMARY KEY,
+            timestamp REAL,
+            kb_name TEXT,
+            question_data TEXT,
+            user_answer TEXT,
+            is_correct INTEGER,
+            summary TEXT,
+            status TEXT
+        )
+    ''')
+    
+    # 大纲表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outlines (
+            kb_name TEXT PRIMARY KEY,
+            content TEXT,
+            status TEXT DEFAULT 'completed',
+            timestamp REAL
+        )
+    ''')
+    
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_questions_book_id ON questions(book_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_questions_kb_name ON questions(kb_name)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history(timestamp)')
+
+
+def _migration_answers_and_outline_cache(cursor):
+    # 填空/解答题的答案列表
+    _add_column(cursor, 'questions', 'answers', 'TEXT')
+    # 大纲生成时的知识库指纹与各文件签名，用于判断大纲是否过期
+    _add_column(cursor, 'outlines', 'kb_fingerprint', 'TEXT')
+    _add_column(cursor, 'outlines', 'file_signatures', 'TEXT')
+    
+    # 大纲分段摘要缓存 (按内容哈希)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outline_summaries (
+            content_hash TEXT PRIMARY KEY,
+            source_label TEXT,
+            summary TEXT,
+            created_at REAL
+        )
+    ''')
+
+
+def _migration_quiz_pool(cursor):
+    # 预生成题目池
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS quiz_pool (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kb_name TEXT NOT NULL,
+            question_format TEXT NOT NULL,
+            q_type TEXT NOT NULL,
+            variant INTEGER NOT NULL,
+            question_data TEXT,
+            kb_fingerprint TEXT,
+            created_at REAL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_quiz_pool_key ON quiz_pool(kb_name, question_format, q_type, variant)')
+
+
+def _migration_answer_cache(cursor):
+    # 语义问答缓存 (按知识库隔离，embedding 为 float32 字节)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS answer_cache (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kb_name TEXT NOT NULL,
+            query TEXT,
+            embedding BLOB,
+            answer TEXT,
+            sources TEXT,
+            source_fingerprint TEXT,
+            created_at REAL,
+            last_hit_at REAL,
+            hit_count INTEGER DEFAULT 0
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_answer_cache_kb ON answer_cache(kb_name, last_hit_at)')
+
+
+def _migration_jobs(cursor):
+    # 后台任务队列 (status: queued / running / done / failed / cancelled)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            ref_id TEXT,
+            payload TEXT,
+            status TEXT DEFAULT 'queued',
+            attempts INTEGER DEFAULT 0,
+            max_attempts INTEGER DEFAULT 3,
+            next_run_at REAL,
+            last_error TEXT,
+            stage_timings TEXT,
+            created_at REAL,
+            started_at REAL,
+            finished_at REAL
+        )
+    ''')
+    # 任务的模型调用次数与 token 用量 (JSON)
+    _add_column(cursor, 'jobs', 'metrics', 'TEXT')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, next_run_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_ref ON jobs(kind, ref_id)')
+
+
+def _migration_image_store(cursor):
+    # 题目图片存储在 image_store 中，这里只保存引用 (SHA-256)
+    _add_column(cursor, 'questions', 'image_ref', 'TEXT')
+    _migrate_inline_images(cursor)
+
+
+def _migration_list_indexes(cursor):
+    # 错题本分页列表的两种排序
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_questions_book_time ON questions(book_id, is_archived, timestamp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_questions_book_familiarity ON questions(book_id, is_archived, COALESCE(familiarity_score, 0), timestamp)')
+
+
+def _migration_search_index(cursor):
+    _init_search_index(cursor)
+
+
+def _migration_review_schedule(cursor):
+    # 间隔重复调度状态 (见 review_scheduler)
+    _add_column(cursor, 'questions', 'due_at', 'REAL')
+    _add_column(cursor, 'questions', 'interval_days', 'REAL DEFAULT 0')
+    _add_column(cursor, 'questions', 'ease', 'REAL DEFAULT 2.5')
+    _add_column(cursor, 'questions', 'repetitions', 'INTEGER DEFAULT 0')
+    # 已有错题全部立即到期，最久没复习的排在前面
+    cursor.execute('UPDATE questions SET due_at = COALESCE(last_reviewed, timestamp, 0) WHERE due_at IS NULL')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_questions_book_due ON questions(book_id, is_archived, due_at)')
+
+
+def _migration_progress_stats(cursor):
+    # 按天汇总的答题与复习统计 (见 progress_stats)
+    from progress_stats import create_tables, backfill_stats
+    create_tables(cursor)
+    backfill_stats(cursor)
 
 
+def _migration_history_archive(cursor):
+    # 已移出数据库的答题记录归档文件 (见 history_archive)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS history_archive_segments (
+            name TEXT PRIMARY KEY,
+            first_timestamp REAL,
+            last_timestamp REAL,
+            row_count INTEGER,
+            size_bytes INTEGER,
+            created_at REAL
+        )
+    ''')
+
+
+# Schema history, applied in order; an entry's version is its position (1-based).
+# Append new migrations, never reorder or edit applied ones. Databases created
+# before versioning start at 0, so every step must tolerate existing objects.
+MIGRATIONS = [
+    _migration_base_tables,
+    _migration_answers_and_outline_cache,
+    _migration_quiz_pool,
+    _migration_answer_cache,
+    _migration_jobs,
+    _migration_image_store,
+    _migration_list_indexes,
+    _migration_search_index,
+    _migration_review_schedule,
+    _migration_progress_stats,
+    _migration_history_archive,
+]
+
+
+def get_schema_version(cursor):
+    cursor.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)')
+    cursor.execute('SELECT version FROM schema_version')
+    row = cursor.fetchone()
+    return row['version'] if row else 0
+
+
+def _run_migrations(conn):
+    cursor = conn.cursor()
+    version = get_schema_version(cursor)
+    conn.commit()
+    for target, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        print(f"Applying database migration {target}: {migration.__name__}")
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            migration(cursor)
+            cursor.execute('DELETE FROM schema_version')
+            cursor.execute('INSERT INTO schema_version (version) VALUES (?)', (target,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
 
 _db_initialized = False
 
 def init_db():
-    """Initialize the database with required tables."""
+    """Initialize the database: apply pending migrations and ensure the default mistake book exists."""
     global _db_initialized
     if _db_initialized:
         return
     
     with get_connection() as conn:
-        cursor = conn.cursor()
-        
-        # 错题本表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS mistake_books (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT UNIQUE NOT NULL,
-                is_archived INTEGER DEFAULT 0,
-                created_at REAL
-            )
-        ''')
-        
-        # 答题记录/错题表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS questions (
-                id TEXT PRIMARY KEY,
-                book_id INTEGER,
-                timestamp REAL,
-                kb_name TEXT,
-                question_type TEXT,
-                question_text TEXT,
-                options TEXT,
-                answers TEXT,
-                correct_answer TEXT,
-                explanation TEXT,
-                user_answer TEXT,
-                is_correct INTEGER,
-                summary TEXT,
-                status TEXT DEFAULT 'completed',
-                familiarity_score INTEGER DEFAULT 2,
-                is_archived INTEGER DEFAULT 0,
-                last_reviewed REAL,
-                review_count INTEGER DEFAULT 0,
-                FOREIGN KEY (book_id) REFERENCES mistake_books(id)
-            )
-        ''')
-        
-        # Migration: Add answers column if missing (for existing databases)
-        try:
-            cursor.execute('ALTER TABLE questions ADD COLUMN answers TEXT')
-        except sqlite3.OperationalError:
-            pass  # Column already exists
-        
-        # 历史记录表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS history (
-                id TEXT PRIMARY KEY,
-                timestamp REAL,
-                kb_name TEXT,
-                question_data TEXT,
-                user_answer TEXT,
-                is_correct INTEGER,
-                summary TEXT,
-                status TEXT
-            )
-        ''')
-        
-        # 大纲表
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS outlines (
-                kb_name TEXT PRIMARY KEY,
-                content TEXT,
-                status TEXT DEFAULT 'completed',
-                timestamp REAL
-            )
-        ''')
-        
-        # 创建索引以提高查询性能
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_questions_book_id ON questions(book_id)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_questions_kb_name ON questions(kb_name)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history(timestamp)')
+        if _db_initialized:  # another thread finished while we waited for the writer
+            return
+        _run_migrations(conn)
         
         # 确保默认错题本存在
-        cursor.execute('''
+        conn.execute('''
             INSERT OR IGNORE INTO mistake_books (name, created_at) 
             VALUES (?, ?)
         ''', ("默认错题本", None))
@@ -138,6 +394,100 @@ def init_db():
     _db_initialized = True
 
 
+def _migrate_inline_images(cursor):
+    """Move base64 images embedded in history.question_data into the image store.
+
+    Rows are rewritten to hold the reference instead, and the matching question
+    row gets it in image_ref. Already migrated rows (64-char refs) are skipped.
+    """
+    try:
+        cursor.execute('''
+            SELECT id, question_data FROM history
+            WHERE length(json_extract(question_data, '$.image')) > 64
+        ''')
+    except sqlite3.OperationalError as e:
+        print(f"Skipping inline image migration: {e}")
+        return
+    rows = cursor.fetchall()
+    if not rows:
+        return
+    
+    from image_store import store_image_value
+    migrated = 0
+    for row in rows:
+        question_data = json.loads(row['question_data'])
+        ref = store_image_value(question_data.get('image'))
+        if ref == question_data.get('image'):
+            continue  # URL or undecodable value, leave as is
+        question_data['image'] = ref
+        cursor.execute(
+            'UPDATE history SET question_data = ? WHERE id = ?',
+            (json.dumps(question_data, ensure_ascii=False), row['id'])
+        )
+        cursor.execute(
+            'UPDATE questions SET image_ref = ? WHERE id = ? AND image_ref IS NULL',
+            (ref, row['id'])
+        )
+        migrated += 1
+    print(f"Moved {migrated} inline images to the image store")
+
+
+# Full-text search tables: FTS column -> source expression ({row} is "" or "new."),
+# stored pre-segmented by search_tokens(). The listed source columns fire the update trigger.
+_SEARCH_TABLES = {
+    'questions_fts': ('questions', ('question_text', 'options', 'explanation', 'summary'), {
+        'question': '{row}question_text',
+        'options': '{row}options',
+        'explanation': '{row}explanation',
+        'summary': '{row}summary',
+    }),
+    'history_fts': ('history', ('question_data', 'summary'), {
+        'question': "json_extract({row}question_data, '$.question')",
+        'options': "json_extract({row}question_data, '$.options')",
+        'explanation': "json_extract({row}question_data, '$.explanation')",
+        'summary': '{row}summary',
+    }),
+}
+
+
+def _init_search_index(cursor):
+    """Create the FTS5 tables and sync triggers, and index existing rows on first run.
+
+    FTS rows share the rowid of the source row. Skipped (search falls back to
+    LIKE matching) when SQLite is built without FTS5.
+    """
+    for fts_table, (source, source_columns, columns) in _SEARCH_TABLES.items():
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts_table,))
+        exists = cursor.fetchone() is not None
+        try:
+            cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5({', '.join(columns)})")
+        except sqlite3.OperationalError as e:
+            print(f"Full-text search unavailable: {e}")
+            return
+        
+        names = ', '.join(columns)
+        values = ', '.join(f'search_tokens({expr.format(row="")})' for expr in columns.values())
+        new_values = ', '.join(f'search_tokens({expr.format(row="new.")})' for expr in columns.values())
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts_table}_insert AFTER INSERT ON {source} BEGIN
+                INSERT INTO {fts_table} (rowid, {names}) VALUES (new.rowid, {new_values});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts_table}_delete AFTER DELETE ON {source} BEGIN
+                DELETE FROM {fts_table} WHERE rowid = old.rowid;
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {fts_table}_update AFTER UPDATE OF {', '.join(source_columns)} ON {source} BEGIN
+                DELETE FROM {fts_table} WHERE rowid = old.rowid;
+                INSERT INTO {fts_table} (rowid, {names}) VALUES (new.rowid, {new_values});
+            END
+        ''')
+        if not exists:
+            cursor.execute(f'INSERT INTO {fts_table} (rowid, {names}) SELECT rowid, {values} FROM {source}')
+            print(f"Indexed {cursor.rowcount} rows for full-text search ({source})")
+
 
 # Helper functions for JSON serialization
 def serialize_options(options):
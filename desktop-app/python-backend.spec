@@ -13,15 +13,32 @@ project_root = os.path.dirname(os.path.dirname(os.path.abspath(SPEC)))
 # Collect all necessary data files
 datas = [
     # Streamlit app files
+    (os.path.join(project_root, 'answer_cache.py'), '.'),
     (os.path.join(project_root, 'app.py'), '.'),
+    (os.path.join(project_root, 'async_rag_agent.py'), '.'),
     (os.path.join(project_root, 'config.py'), '.'),
+    (os.path.join(project_root, 'context_packer.py'), '.'),
+    (os.path.join(project_root, 'conversation_memory.py'), '.'),
     (os.path.join(project_root, 'database.py'), '.'),
     (os.path.join(project_root, 'document_loader.py'), '.'),
+    (os.path.join(project_root, 'history_archive.py'), '.'),
+    (os.path.join(project_root, 'http_pool.py'), '.'),
+    (os.path.join(project_root, 'image_preprocess.py'), '.'),
+    (os.path.join(project_root, 'image_store.py'), '.'),
+    (os.path.join(project_root, 'job_queue.py'), '.'),
     # (os.path.join(project_root, 'exercise_generator.py'), '.'), # REMOVED: File does not exist
     (os.path.join(project_root, 'kb_manager.py'), '.'),
+    (os.path.join(project_root, 'latex_normalizer.py'), '.'),
+    (os.path.join(project_root, 'mistake_processor.py'), '.'),
+    (os.path.join(project_root, 'outline_engine.py'), '.'),
+    (os.path.join(project_root, 'progress_stats.py'), '.'),
     (os.path.join(project_root, 'question_db.py'), '.'),
+    (os.path.join(project_root, 'quiz_pool.py'), '.'),
     (os.path.join(project_root, 'rag_agent.py'), '.'),
+    (os.path.join(project_root, 'review_scheduler.py'), '.'),
     (os.path.join(project_root, 'settings_utils.py'), '.'),
+    (os.path.join(project_root, 'task_manager.py'), '.'),
+    (os.path.join(project_root, 'text_search.py'), '.'),
     (os.path.join(project_root, 'text_splitter.py'), '.'),
     (os.path.join(project_root, 'ui_components.py'), '.'), # ADDED CRITICAL MISSING FILE
     (os.path.join(project_root, 'vector_store.py'), '.'),
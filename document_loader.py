@@ -4,10 +4,10 @@ import docx2txt
 from PyPDF2 import PdfReader
 from pptx import Presentation
 from pptx.enum.shapes import MSO_SHAPE_TYPE
-import base64
 import io
 from openai import OpenAI
 from config import DATA_DIR, OPENAI_API_KEY, OPENAI_API_BASE, ENABLE_IMAGE_CAPTIONING, IMAGE_CAPTION_MODEL, VL_API_KEY, VL_API_BASE, get_openai_client
+from image_preprocess import prepare_image_b64, image_data_url
 
 class DocumentLoader:
     def __init__(
@@ -27,7 +27,7 @@ class DocumentLoader:
             return ""
             
         try:
-            base64_image = base64.b64encode(image_bytes).decode('utf-8')
+            base64_image = prepare_image_b64(image_bytes, purpose="caption")
             
             response = self.client.chat.completions.create(
                 model=IMAGE_CAPTION_MODEL,
@@ -39,7 +39,7 @@ class DocumentLoader:
                             {
                                 "type": "image_url",
                                 "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
+                                    "url": image_data_url(base64_image)
                                 },
                             },
                         ],
@@ -0,0 +1,249 @@
+"""
+History Retention and Cold Archive.
+
+Every practice answer keeps a full copy of its question in `history`, so the
+table only grows. Rows older than HISTORY_RETENTION_DAYS are moved out of
+SQLite into gzip-compressed JSONL segments under the user data directory,
+one line per row in the same shape QuestionDB returns for history. Aggregates
+are not lost: progress_stats already counts every answer when it is written.
+
+A segment file is written before its rows are deleted, and the segment record
+and the deletion commit in one transaction. A file without a record (crash in
+between) is never read; its rows are still in the database and get archived
+again into a new segment. Batches are read and compressed without holding
+the writer lock; only the record and the deletion take it.
+Archived rows can be read back with iter_archived_history (QuestionDB.
+iter_history merges them with the live rows for export), but are no longer
+covered by search_history.
+
+After archiving, free pages are returned to the file system: with
+auto_vacuum=INCREMENTAL an incremental vacuum, otherwise (databases created
+before this setting) one full VACUUM, which also switches the database to
+incremental mode. The work runs as a periodic background job.
+"""
+import gzip
+import json
+import os
+import time
+import uuid
+from typing import Any, Dict, Iterator, List, Optional
+
+import config
+from database import get_connection, get_read_connection, deserialize_question_data
+from job_queue import JobCancelled, JobQueue, register_handler
+from progress_stats import stat_day
+from settings_utils import get_user_data_dir
+
+JOB_KIND = "history_maintenance"
+# 每个归档文件最多包含的记录数
+SEGMENT_ROWS = 5000
+# 空闲页超过数据库页数的该比例时整理数据库
+VACUUM_FREE_RATIO = 0.1
+# 应用启动后至少等待多久再执行（秒），避免拖慢启动
+STARTUP_DELAY = 60
+
+
+def get_archive_dir() -> str:
+    return os.path.join(get_user_data_dir(), "history_archive")
+
+
+def _segment_path(name: str) -> str:
+    return os.path.join(get_archive_dir(), name)
+
+
+def _current_retention_days() -> int:
+    """读取当前设置（设置页保存后会刷新环境变量，无需重启）"""
+    return int(os.getenv("HISTORY_RETENTION_DAYS", config.HISTORY_RETENTION_DAYS))
+
+
+def _maintenance_interval() -> float:
+    return float(os.getenv("HISTORY_MAINTENANCE_HOURS", config.HISTORY_MAINTENANCE_HOURS)) * 3600
+
+
+def _row_to_record(row) -> Dict[str, Any]:
+    return {
+        'id': row['id'],
+        'timestamp': row['timestamp'],
+        'kb_name': row['kb_name'],
+        'question': deserialize_question_data(row['question_data']) or {},
+        'user_answer': row['user_answer'],
+        'is_correct': bool(row['is_correct']),
+        'summary': row['summary'],
+        'status': row['status'],
+    }
+
+
+def list_segments() -> List[Dict[str, Any]]:
+    """已有的归档文件，按时间先后：[{"name", "first_timestamp", "last_timestamp", "row_count", "size_bytes", "created_at"}]"""
+    with get_read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM history_archive_segments ORDER BY first_timestamp, name')
+        return [dict(row) for row in cursor.fetchall()]
+
+
+def _remove_partial_segments() -> None:
+    """删除上次写到一半的临时文件"""
+    archive_dir = get_archive_dir()
+    if not os.path.isdir(archive_dir):
+        return
+    for name in os.listdir(archive_dir):
+        if name.endswith(".tmp"):
+            os.remove(os.path.join(archive_dir, name))
+
+
+def archive_history(retention_days: Optional[int] = None, now: Optional[float] = None) -> int:
+    """把早于保留天数的答题记录移入归档文件，返回移出的记录数（retention_days 为 0 时不归档）"""
+    retention_days = _current_retention_days() if retention_days is None else retention_days
+    if retention_days <= 0:
+        return 0
+    cutoff = (time.time() if now is None else now) - retention_days * 86400
+    _remove_partial_segments()
+    os.makedirs(get_archive_dir(), exist_ok=True)
+
+    archived = 0
+    while True:
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            # 处理中的错题还会被后台任务更新，留到下次
+            cursor.execute('''
+                SELECT * FROM history
+                WHERE timestamp < ? AND COALESCE(status, 'completed') != 'processing'
+                ORDER BY timestamp, id LIMIT ?
+            ''', (cutoff, SEGMENT_ROWS))
+            rows = cursor.fetchall()
+        if not rows:
+            break
+
+        # Compression and file I/O run without the writer lock
+        first, last = rows[0]['timestamp'], rows[-1]['timestamp']
+        name = f"history-{stat_day(first)}-{stat_day(last)}-{uuid.uuid4().hex[:8]}.jsonl.gz"
+        path = _segment_path(name)
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(_row_to_record(row), ensure_ascii=False) + "\n")
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO history_archive_segments (name, first_timestamp, last_timestamp, row_count, size_bytes, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (name, first, last, len(rows), size, time.time()))
+            ids = [row['id'] for row in rows]
+            # Chunked to stay under SQLite's bound-parameter limit
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                cursor.execute(f"DELETE FROM history WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+        archived += len(rows)
+        print(f"Archived {len(rows)} history rows to {name}")
+    return archived
+
+
+def iter_archived_history(
+    kb_name: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None
+) -> Iterator[Dict[str, Any]]:
+    """按时间顺序读出归档的答题记录（格式同 QuestionDB 的答题记录），可按知识库与时间范围（时间戳）筛选"""
+    for segment in list_segments():
+        if since is not None and segment["last_timestamp"] < since:
+            continue
+        if until is not None and segment["first_timestamp"] >= until:
+            continue
+        with gzip.open(_segment_path(segment["name"]), "rt", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                if kb_name is not None and record["kb_name"] != kb_name:
+                    continue
+                if since is not None and record["timestamp"] < since:
+                    continue
+                if until is not None and record["timestamp"] >= until:
+                    continue
+                yield record
+
+
+def get_storage_stats() -> Dict[str, Any]:
+    """界面显示用：{"live_rows", "archived_rows", "segments", "archive_bytes", "db_bytes", "free_ratio", "auto_vacuum"}"""
+    with get_read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT COUNT(*) AS n FROM history')
+        live_rows = cursor.fetchone()['n']
+        cursor.execute('SELECT COUNT(*) AS n, COALESCE(SUM(row_count), 0) AS rows, COALESCE(SUM(size_bytes), 0) AS size FROM history_archive_segments')
+        segments = cursor.fetchone()
+        page_size = cursor.execute('PRAGMA page_size').fetchone()[0]
+        page_count = cursor.execute('PRAGMA page_count').fetchone()[0]
+        free_pages = cursor.execute('PRAGMA freelist_count').fetchone()[0]
+        auto_vacuum = cursor.execute('PRAGMA auto_vacuum').fetchone()[0]
+    return {
+        "live_rows": live_rows,
+        "archived_rows": segments['rows'],
+        "segments": segments['n'],
+        "archive_bytes": segments['size'],
+        "db_bytes": page_size * page_count,
+        "free_ratio": free_pages / page_count if page_count else 0.0,
+        "auto_vacuum": {0: "none", 1: "full", 2: "incremental"}.get(auto_vacuum, str(auto_vacuum)),
+    }
+
+
+def vacuum_if_needed(force: bool = False) -> Optional[str]:
+    """空闲页较多时整理数据库，返回执行的方式（"incremental" / "full"），无需整理时返回 None"""
+    with get_connection() as conn:
+        page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+        free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if not force and (not page_count or free_pages / page_count < VACUUM_FREE_RATIO):
+            return None
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+            # Each step of the pragma frees one page and execute() only steps once;
+            # executescript runs it to completion
+            conn.executescript('PRAGMA incremental_vacuum;')
+            return "incremental"
+        # 旧数据库：一次完整 VACUUM，同时切换为增量模式（连接上已设置 auto_vacuum = INCREMENTAL）
+        conn.commit()
+        conn.execute('VACUUM')
+        return "full"
+
+
+def run_maintenance(payload: Dict[str, Any], ctx) -> None:
+    """后台任务：归档过期答题记录并整理数据库，完成或失败后安排下一次（被取消时不再安排）"""
+    cancelled = False
+    try:
+        with ctx.stage("archive"):
+            ctx.metrics["archived_rows"] = archive_history()
+        with ctx.stage("vacuum"):
+            ctx.metrics["vacuum"] = vacuum_if_needed(force=payload.get("force_vacuum", False))
+    except JobCancelled:
+        cancelled = True
+        raise
+    finally:
+        # 最后一个阶段执行期间被取消时不会抛出 JobCancelled，需要再查一次
+        if ctx.queue is not None and ctx.queue.is_cancelled(ctx.job_id):
+            cancelled = True
+        if payload.get("reschedule", True) and not cancelled:
+            schedule_maintenance(delay=_maintenance_interval(), current_job_id=ctx.job_id)
+
+
+def schedule_maintenance(delay: Optional[float] = None, current_job_id: Optional[int] = None) -> Optional[int]:
+    """安排下一次定期归档任务，返回任务 ID；已有未完成的定期任务时不重复添加
+
+    delay 为 None 时（应用启动）按上次完成时间与 HISTORY_MAINTENANCE_HOURS 推算，至少 STARTUP_DELAY 秒。
+    """
+    queue = JobQueue()
+    pending = queue.active_jobs(JOB_KIND).get("history")
+    if pending is not None and pending["id"] != current_job_id:
+        return None
+    if delay is None:
+        finished = queue.recent_finished(JOB_KIND, 1)
+        delay = STARTUP_DELAY
+        if finished:
+            delay = max(finished[0]["finished_at"] + _maintenance_interval() - time.time(), STARTUP_DELAY)
+    return queue.enqueue(JOB_KIND, "history", {"reschedule": True}, max_attempts=1, delay=delay)
+
+
+def run_now(force_vacuum: bool = False) -> int:
+    """立即执行一次归档与整理（设置页按钮），不影响定期任务"""
+    return JobQueue().enqueue(JOB_KIND, "history-manual", {"reschedule": False, "force_vacuum": force_vacuum}, max_attempts=1)
+
+
+register_handler(JOB_KIND, run_maintenance)
@@ -0,0 +1,189 @@
+"""
+进程级共享的 HTTP 连接池
+
+所有 LLM / Embedding / VL 调用都通过 config.get_openai_client 取得客户端，
+底层的 httpx.Client 按 base URL 复用，从而复用 TLS 握手与 keep-alive 连接。
+该模块不会随 config 一起被 importlib.reload，连接池在整个进程生命周期内保持。
+"""
+import asyncio
+import atexit
+import importlib.util
+import threading
+import time
+import weakref
+from typing import Dict, List, Tuple
+
+import httpx
+
+_lock = threading.Lock()
+_sync_clients: Dict[Tuple, httpx.Client] = {}
+# 异步客户端的连接绑定在事件循环上，因此按事件循环分别缓存
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple, httpx.AsyncClient]]" = weakref.WeakKeyDictionary()
+_stats: Dict[str, "PoolStats"] = {}
+
+
+def http2_available() -> bool:
+    """httpx 的 HTTP/2 支持依赖可选的 h2 包"""
+    return importlib.util.find_spec("h2") is not None
+
+
+class PoolStats:
+    """单个 base URL 的请求统计（线程安全）"""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.reused_connections = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.http_versions: Dict[str, int] = {}
+
+    def record(self, latency: float, reused: bool, http_version: str) -> None:
+        with self._lock:
+            self.requests += 1
+            if reused:
+                self.reused_connections += 1
+            else:
+                self.new_connections += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            self.http_versions[http_version] = self.http_versions.get(http_version, 0) + 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "base_url": self.base_url,
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "reused_connections": self.reused_connections,
+                "reuse_rate": self.reused_connections / self.requests if self.requests else 0.0,
+                "avg_latency": self.total_latency / self.requests if self.requests else 0.0,
+                "max_latency": self.max_latency,
+                "http_versions": dict(self.http_versions),
+            }
+
+
+class _RequestTrace:
+    """挂在 request.extensions["trace"] 上的 httpcore 回调：记录起始时间以及是否新建了 TCP 连接"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.connected = False
+
+    def on_event(self, event_name: str) -> None:
+        if event_name.startswith("connection.connect_tcp") or event_name.startswith("connection.connect_unix_socket"):
+            self.connected = True
+
+    def __call__(self, event_name: str, info: Dict) -> None:
+        self.on_event(event_name)
+
+
+class _AsyncRequestTrace(_RequestTrace):
+    async def __call__(self, event_name: str, info: Dict) -> None:
+        self.on_event(event_name)
+
+
+def _get_stats(base_url: str) -> PoolStats:
+    with _lock:
+        if base_url not in _stats:
+            _stats[base_url] = PoolStats(base_url)
+        return _stats[base_url]
+
+
+def _record_response(stats: PoolStats, response: httpx.Response) -> None:
+    trace = response.request.extensions.get("trace")
+    if isinstance(trace, _RequestTrace):
+        # 响应头到达即记录，流式响应时相当于首包延迟
+        stats.record(time.perf_counter() - trace.start, reused=not trace.connected, http_version=response.http_version)
+
+
+def _client_kwargs(limits: httpx.Limits, timeout: httpx.Timeout, http2: bool) -> Dict:
+    return {
+        "verify": False,
+        "limits": limits,
+        "timeout": timeout,
+        "http2": http2 and http2_available(),
+    }
+
+
+def _make_sync_client(base_url: str, limits: httpx.Limits, timeout: httpx.Timeout, http2: bool) -> httpx.Client:
+    def on_request(request: httpx.Request) -> None:
+        request.extensions["trace"] = _RequestTrace()
+
+    def on_response(response: httpx.Response) -> None:
+        _record_response(_get_stats(base_url), response)
+
+    return httpx.Client(
+        event_hooks={"request": [on_request], "response": [on_response]},
+        **_client_kwargs(limits, timeout, http2),
+    )
+
+
+def _make_async_client(base_url: str, limits: httpx.Limits, timeout: httpx.Timeout, http2: bool) -> httpx.AsyncClient:
+    async def on_request(request: httpx.Request) -> None:
+        request.extensions["trace"] = _AsyncRequestTrace()
+
+    async def on_response(response: httpx.Response) -> None:
+        _record_response(_get_stats(base_url), response)
+
+    return httpx.AsyncClient(
+        event_hooks={"request": [on_request], "response": [on_response]},
+        **_client_kwargs(limits, timeout, http2),
+    )
+
+
+def _pool_key(base_url: str, limits: httpx.Limits, timeout: httpx.Timeout, http2: bool) -> Tuple:
+    return (base_url or "", limits.max_connections, limits.max_keepalive_connections, limits.keepalive_expiry, repr(timeout), http2)
+
+
+def get_http_client(base_url: str, limits: httpx.Limits, timeout: httpx.Timeout, http2: bool = True) -> httpx.Client:
+    """返回该 base URL 共享的同步 httpx.Client（连接参数变化时新建一个池）"""
+    key = _pool_key(base_url, limits, timeout, http2)
+    with _lock:
+        client = _sync_clients.get(key)
+        if client is None or client.is_closed:
+            client = _sync_clients[key] = _make_sync_client(base_url or "", limits, timeout, http2)
+        return client
+
+
+def get_async_http_client(base_url: str, limits: httpx.Limits, timeout: httpx.Timeout, http2: bool = True) -> httpx.AsyncClient:
+    """返回当前事件循环中该 base URL 共享的 httpx.AsyncClient；不在事件循环中调用时返回一个新客户端"""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return _make_async_client(base_url or "", limits, timeout, http2)
+
+    key = _pool_key(base_url, limits, timeout, http2)
+    with _lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(key)
+        if client is None or client.is_closed:
+            client = clients[key] = _make_async_client(base_url or "", limits, timeout, http2)
+        return client
+
+
+def get_pool_stats() -> List[Dict]:
+    """各 base URL 的连接复用与延迟统计"""
+    with _lock:
+        stats = list(_stats.values())
+    return [s.snapshot() for s in stats]
+
+
+def reset_pool_stats() -> None:
+    with _lock:
+        _stats.clear()
+
+
+@atexit.register
+def close_all() -> None:
+    """关闭所有同步连接池（异步客户端随各自的事件循环释放）"""
+    with _lock:
+        clients = list(_sync_clients.values())
+        _sync_clients.clear()
+    for client in clients:
+        try:
+            client.close()
+        except Exception:
+            pass
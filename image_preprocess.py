@@ -0,0 +1,161 @@
+"""
+发送给视觉模型前的图片预处理（错题识别、聊天图片、课件图片描述共用）
+
+手机拍摄的题目照片常有几 MB，原样 Base64 上传既慢又按分辨率计费。这里统一做：
+    1. 按 EXIF 方向旋正（去掉 EXIF，避免模型看到侧躺的图片）
+    2. 可选：裁掉四周的空白，只保留文字区域
+    3. 最长边限制在 IMAGE_MAX_SIDE 以内
+    4. 重新编码为 JPEG / WebP
+处理失败或处理后反而更大时返回原图，不会让请求变差。各用途节省的字节数见 get_image_stats()。
+"""
+import base64
+import io
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import config
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow 随 streamlit 安装，缺失时图片原样发送
+    Image = None
+
+# 灰度低于该值的像素视为文字/笔迹
+_INK_THRESHOLD = 200
+# 裁剪时在文字区域四周保留的边距（占边长的比例）
+_CROP_MARGIN = 0.02
+# 裁剪后面积至少减少这么多才裁剪，避免对已经很紧凑的截图做无意义的裁剪
+_MIN_CROP_GAIN = 0.1
+
+_stats_lock = threading.Lock()
+_stats: Dict[str, Dict[str, float]] = {}
+
+
+def detect_mime_type(data: bytes) -> str:
+    """根据文件头判断图片类型，未知时按 JPEG 处理"""
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return "image/png"
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return "image/webp"
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return "image/gif"
+    return "image/jpeg"
+
+
+def image_data_url(image_b64: str) -> str:
+    """Base64 图片 -> data URL（按实际格式填写 MIME 类型）"""
+    head = base64.b64decode(image_b64[:24] + "=" * (-len(image_b64[:24]) % 4))
+    return f"data:{detect_mime_type(head)};base64,{image_b64}"
+
+
+def _record(purpose: str, bytes_in: int, bytes_out: int, seconds: float) -> None:
+    with _stats_lock:
+        stats = _stats.setdefault(purpose, {"images": 0, "bytes_in": 0, "bytes_out": 0, "seconds": 0.0})
+        stats["images"] += 1
+        stats["bytes_in"] += bytes_in
+        stats["bytes_out"] += bytes_out
+        stats["seconds"] += seconds
+
+
+def get_image_stats() -> List[Dict]:
+    """各用途的预处理统计：图片数、原始/处理后字节数、节省比例与平均耗时"""
+    with _stats_lock:
+        items = [(purpose, dict(stats)) for purpose, stats in _stats.items()]
+    return [
+        {
+            "purpose": purpose,
+            **stats,
+            "saved_ratio": 1 - stats["bytes_out"] / stats["bytes_in"] if stats["bytes_in"] else 0.0,
+            "avg_seconds": stats["seconds"] / stats["images"] if stats["images"] else 0.0,
+        }
+        for purpose, stats in items
+    ]
+
+
+def _text_bbox(img) -> Optional[Tuple[int, int, int, int]]:
+    """文字区域的边界框（含边距），没有明显可裁的空白时返回 None"""
+    gray = img.convert("L")
+    # 先缩小再找边界，大图上逐像素阈值化太慢
+    scale = max(gray.size) / 512
+    small = gray.resize((max(int(gray.width / scale), 1), max(int(gray.height / scale), 1))) if scale > 1 else gray
+    scale = max(scale, 1)
+    bbox = small.point(lambda v: 255 if v < _INK_THRESHOLD else 0).getbbox()
+    if not bbox:
+        return None
+    left, top, right, bottom = (int(v * scale) for v in bbox)
+    margin_x, margin_y = int(img.width * _CROP_MARGIN), int(img.height * _CROP_MARGIN)
+    left, top = max(left - margin_x, 0), max(top - margin_y, 0)
+    right, bottom = min(right + margin_x, img.width), min(bottom + margin_y, img.height)
+    if (right - left) * (bottom - top) > (1 - _MIN_CROP_GAIN) * img.width * img.height:
+        return None
+    return left, top, right, bottom
+
+
+def _current_settings() -> Tuple[int, str, int, bool]:
+    """读取当前设置（设置页保存后会刷新环境变量，无需重启）"""
+    return (
+        int(os.getenv("IMAGE_MAX_SIDE", config.IMAGE_MAX_SIDE)),
+        os.getenv("IMAGE_FORMAT", config.IMAGE_FORMAT),
+        int(os.getenv("IMAGE_QUALITY", config.IMAGE_QUALITY)),
+        str(os.getenv("IMAGE_AUTO_CROP", config.IMAGE_AUTO_CROP)).lower() == "true",
+    )
+
+
+def prepare_image(
+    data: bytes,
+    purpose: str = "other",
+    max_side: Optional[int] = None,
+    fmt: Optional[str] = None,
+    quality: Optional[int] = None,
+    crop: Optional[bool] = None
+) -> bytes:
+    """预处理一张图片，返回新的图片字节（格式以文件头为准，见 detect_mime_type）
+
+    未指定的参数使用设置中的 IMAGE_MAX_SIDE / IMAGE_FORMAT / IMAGE_QUALITY / IMAGE_AUTO_CROP。
+    """
+    if Image is None or not data:
+        return data
+    start = time.perf_counter()
+    defaults = _current_settings()
+    max_side = defaults[0] if max_side is None else max_side
+    fmt = defaults[1] if fmt is None else fmt
+    quality = defaults[2] if quality is None else quality
+    crop = defaults[3] if crop is None else crop
+    fmt = fmt.lower() if fmt and fmt.lower() in ("jpeg", "webp") else "jpeg"
+    changed = False  # 旋转或裁剪过的图片即使变大也不能退回原图
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            changed = img.getexif().get(0x0112, 1) != 1
+            img = ImageOps.exif_transpose(img)
+            if crop:
+                bbox = _text_bbox(img)
+                if bbox:
+                    img = img.crop(bbox)
+                    changed = True
+            if max_side and max(img.size) > max_side:
+                img.thumbnail((max_side, max_side), Image.LANCZOS)
+            if fmt == "jpeg" and img.mode != "RGB":
+                # 透明背景按白底处理，避免转换后变成黑底
+                background = Image.new("RGB", img.size, (255, 255, 255))
+                rgba = img.convert("RGBA")
+                background.paste(rgba, mask=rgba.getchannel("A"))
+                img = background
+            elif fmt == "webp" and img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+            output = io.BytesIO()
+            img.save(output, format=fmt.upper(), quality=quality, optimize=True)
+            result = output.getvalue()
+    except Exception as e:
+        print(f" [图片预处理] 失败，使用原图: {e}")
+        result, changed = data, False
+    if len(result) >= len(data) and not changed:
+        result = data
+    _record(purpose, len(data), len(result), time.perf_counter() - start)
+    return result
+
+
+def prepare_image_b64(data: bytes, purpose: str = "other") -> str:
+    """预处理并编码为 Base64 字符串（与 image_data_url 配合使用）"""
+    return base64.b64encode(prepare_image(data, purpose=purpose)).decode('utf-8')
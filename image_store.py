@@ -0,0 +1,143 @@
+"""
+Content-Addressed Image Store.
+
+Question images are written once under the user data directory, named by the
+SHA-256 of their bytes, and rows in SQLite only keep that 64-character
+reference. Identical uploads share one file. A small JPEG thumbnail is
+generated on write for list and batch views.
+
+Layout:
+    images/ab/abcdef....      original bytes (format as uploaded/preprocessed)
+    images/thumbs/ab/abcdef.jpg
+"""
+import base64
+import hashlib
+import io
+import os
+import re
+import tempfile
+from typing import Optional, Union
+
+from settings_utils import get_user_data_dir
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # thumbnails are skipped, views fall back to the original
+    Image = None
+
+THUMBNAIL_SIZE = 320
+THUMBNAIL_QUALITY = 80
+
+_REF_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+def get_image_dir() -> str:
+    return os.path.join(get_user_data_dir(), "images")
+
+
+def is_image_ref(value) -> bool:
+    return isinstance(value, str) and _REF_RE.match(value) is not None
+
+
+def image_path(ref: str) -> str:
+    return os.path.join(get_image_dir(), ref[:2], ref)
+
+
+def thumbnail_path(ref: str) -> str:
+    return os.path.join(get_image_dir(), "thumbs", ref[:2], f"{ref}.jpg")
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # Unique temp name: workers storing the same image concurrently must not share it
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        # Content-addressed: a file another writer put there first is identical
+        if not os.path.exists(path):
+            raise
+
+
+def _make_thumbnail(data: bytes) -> Optional[bytes]:
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+            if img.mode != "RGB":
+                background = Image.new("RGB", img.size, (255, 255, 255))
+                rgba = img.convert("RGBA")
+                background.paste(rgba, mask=rgba.getchannel("A"))
+                img = background
+            output = io.BytesIO()
+            img.save(output, format="JPEG", quality=THUMBNAIL_QUALITY)
+            return output.getvalue()
+    except Exception as e:
+        print(f"Thumbnail generation failed: {e}")
+        return None
+
+
+def put_image(data: bytes) -> str:
+    """Store image bytes (no-op if already stored) and return the reference."""
+    ref = hashlib.sha256(data).hexdigest()
+    path = image_path(ref)
+    if not os.path.exists(path):
+        _write_atomic(path, data)
+    thumb = thumbnail_path(ref)
+    if not os.path.exists(thumb):
+        thumb_data = _make_thumbnail(data)
+        if thumb_data is not None:
+            _write_atomic(thumb, thumb_data)
+    return ref
+
+
+def store_image_value(value: Optional[str]) -> Optional[str]:
+    """Normalize an image field for storage.
+
+    Base64 payloads are moved into the store and replaced by their reference;
+    references, URLs and empty values are returned unchanged.
+    """
+    if not value or is_image_ref(value) or value.startswith("http"):
+        return value or None
+    try:
+        data = base64.b64decode(value, validate=True)
+    except (ValueError, TypeError):
+        return value
+    return put_image(data)
+
+
+def load_image_bytes(ref: str) -> Optional[bytes]:
+    try:
+        with open(image_path(ref), "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def load_image_b64(value: Optional[str]) -> Optional[str]:
+    """Base64 content of an image field (reference or legacy inline base64), for model requests."""
+    if not value or not is_image_ref(value):
+        return value or None
+    data = load_image_bytes(value)
+    return base64.b64encode(data).decode('utf-8') if data is not None else None
+
+
+def resolve_image(value: Optional[str], thumbnail: bool = False) -> Optional[Union[str, bytes]]:
+    """Something st.image can display: a file path, a URL, or decoded legacy base64 bytes."""
+    if not value:
+        return None
+    if is_image_ref(value):
+        if thumbnail and os.path.exists(thumbnail_path(value)):
+            return thumbnail_path(value)
+        path = image_path(value)
+        return path if os.path.exists(path) else None
+    if value.startswith("http"):
+        return value
+    return base64.b64decode(value)
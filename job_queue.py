@@ -0,0 +1,355 @@
+"""
+Persistent Background Job Queue.
+
+Jobs are rows in the SQLite `jobs` table and are executed by a fixed-size
+pool of worker threads, so the number of concurrent API calls no longer grows
+with the number of submitted items. A failed attempt is retried with
+exponential backoff up to max_attempts. Jobs left 'running' by a previous
+process are put back in the queue when the pool starts, and a job can be
+cancelled while queued or between the stages of a running attempt.
+Every finished attempt records how long each stage took, plus handler-defined
+metrics such as model calls and token usage, which the UI uses to show queue
+depth, per-stage latency and cost.
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import JOB_WORKERS, JOB_MAX_ATTEMPTS, JOB_RETRY_BASE_SECONDS
+from database import get_connection, get_read_connection, init_db
+
+# 重试间隔上限（秒）
+MAX_RETRY_DELAY = 300
+# 没有可执行任务时的轮询间隔（秒），新任务入队会立即唤醒
+POLL_INTERVAL = 2.0
+# 已结束的任务保留天数
+FINISHED_RETENTION_DAYS = 7
+
+ACTIVE_STATUSES = ("queued", "running")
+
+# 同一进程内的所有 worker 共用，保证一个任务只被领取一次
+_claim_lock = threading.Lock()
+_handlers: Dict[str, Tuple[Callable, Optional[Callable]]] = {}
+
+
+class JobCancelled(Exception):
+    """任务已被取消，由 JobContext 在阶段边界处抛出"""
+
+
+class PermanentJobError(Exception):
+    """重试也不会成功的错误（如缺少配置、输入为空），直接判定失败"""
+
+
+def register_handler(kind: str, run: Callable, on_failed: Optional[Callable] = None) -> None:
+    """注册某类任务的处理函数
+
+    run(payload, ctx) 执行任务，ctx 为 JobContext；
+    on_failed(payload, error) 在最后一次尝试失败后调用，用于把失败状态写回业务数据。
+    """
+    _handlers[kind] = (run, on_failed)
+
+
+def _retry_delay(attempts: int) -> float:
+    return min(JOB_RETRY_BASE_SECONDS * (2 ** max(attempts - 1, 0)), MAX_RETRY_DELAY)
+
+
+class JobContext:
+    """传给处理函数的上下文：按阶段计时、累计模型调用用量，并在阶段之间检查任务是否已被取消
+
+    不经过队列直接调用处理逻辑时（如 benchmark.py），queue 与 job 传 None。
+    """
+
+    def __init__(self, queue: Optional["JobQueue"] = None, job: Optional[Dict[str, Any]] = None):
+        self.queue = queue
+        self.job_id = job["id"] if job else None
+        self.attempt = job["attempts"] if job else 1
+        self.timings: Dict[str, float] = {}
+        self.metrics: Dict[str, Any] = {}
+        if job:
+            # 本次尝试在队列中等待的时间
+            self.timings["queued"] = max(time.time() - job["next_run_at"], 0.0)
+
+    def check_cancelled(self) -> None:
+        if self.queue is not None and self.queue.is_cancelled(self.job_id):
+            raise JobCancelled()
+
+    def record_usage(self, response: Any) -> None:
+        """累计一次模型调用的次数与 token 用量"""
+        self.metrics["llm_calls"] = self.metrics.get("llm_calls", 0) + 1
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            for field in ("prompt_tokens", "completion_tokens"):
+                self.metrics[field] = self.metrics.get(field, 0) + (getattr(usage, field, 0) or 0)
+
+    @contextmanager
+    def stage(self, name: str):
+        self.check_cancelled()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+
+class JobQueue:
+    def __init__(self):
+        init_db()
+
+    def enqueue(self, kind: str, ref_id: Optional[str], payload: Dict[str, Any], max_attempts: int = JOB_MAX_ATTEMPTS, delay: float = 0.0) -> int:
+        """加入一个任务（delay 秒后才可执行），返回任务 ID"""
+        now = time.time()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO jobs (kind, ref_id, payload, status, attempts, max_attempts, next_run_at, created_at)
+                VALUES (?, ?, ?, 'queued', 0, ?, ?, ?)
+            ''', (kind, ref_id, json.dumps(payload, ensure_ascii=False), max(max_attempts, 1), now + max(delay, 0.0), now))
+            job_id = cursor.lastrowid
+        if _pool is not None:
+            _pool.notify()
+        return job_id
+
+    def claim(self, kinds: List[str]) -> Optional[Dict[str, Any]]:
+        """领取一个已到执行时间的任务并标记为 running，没有则返回 None"""
+        if not kinds:
+            return None
+        now = time.time()
+        placeholders = ",".join("?" * len(kinds))
+        with _claim_lock, get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT * FROM jobs
+                WHERE status = 'queued' AND next_run_at <= ? AND kind IN ({placeholders})
+                ORDER BY next_run_at, id LIMIT 1
+            ''', (now, *kinds))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            cursor.execute('''
+                UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?
+                WHERE id = ? AND status = 'queued'
+            ''', (now, row['id']))
+            if cursor.rowcount != 1:
+                return None
+        job = dict(row)
+        job["attempts"] += 1
+        job["payload"] = json.loads(job["payload"] or "{}")
+        return job
+
+    def next_due_in(self, kinds: List[str]) -> Optional[float]:
+        """距离最早一个排队任务可执行还有多少秒，没有排队任务返回 None"""
+        if not kinds:
+            return None
+        placeholders = ",".join("?" * len(kinds))
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT MIN(next_run_at) AS due FROM jobs WHERE status = 'queued' AND kind IN ({placeholders})",
+                kinds
+            )
+            row = cursor.fetchone()
+        if row is None or row['due'] is None:
+            return None
+        return max(row['due'] - time.time(), 0.0)
+
+    def complete(self, job_id: int, ctx: JobContext) -> None:
+        with get_connection() as conn:
+            conn.execute('''
+                UPDATE jobs SET status = 'done', finished_at = ?, stage_timings = ?, metrics = ?, last_error = NULL
+                WHERE id = ? AND status = 'running'
+            ''', (time.time(), json.dumps(ctx.timings), json.dumps(ctx.metrics), job_id))
+
+    def fail(self, job: Dict[str, Any], error: str, ctx: JobContext, retry: bool = True) -> bool:
+        """记录一次失败；还有重试次数时按指数退避重新排队并返回 True，否则标记为 failed 返回 False"""
+        now = time.time()
+        will_retry = retry and job["attempts"] < job["max_attempts"]
+        with get_connection() as conn:
+            if will_retry:
+                conn.execute('''
+                    UPDATE jobs SET status = 'queued', next_run_at = ?, last_error = ?, stage_timings = ?, metrics = ?
+                    WHERE id = ? AND status = 'running'
+                ''', (now + _retry_delay(job["attempts"]), error, json.dumps(ctx.timings), json.dumps(ctx.metrics), job["id"]))
+            else:
+                conn.execute('''
+                    UPDATE jobs SET status = 'failed', finished_at = ?, last_error = ?, stage_timings = ?, metrics = ?
+                    WHERE id = ? AND status = 'running'
+                ''', (now, error, json.dumps(ctx.timings), json.dumps(ctx.metrics), job["id"]))
+        return will_retry
+
+    def cancel(self, job_id: int) -> bool:
+        """取消排队中或执行中的任务；执行中的任务在下一个阶段开始前停止"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE jobs SET status = 'cancelled', finished_at = ?
+                WHERE id = ? AND status IN ('queued', 'running')
+            ''', (time.time(), job_id))
+            return cursor.rowcount > 0
+
+    def cancel_ref(self, kind: str, ref_id: str) -> int:
+        """取消某条业务数据对应的所有未完成任务，返回取消数量"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE jobs SET status = 'cancelled', finished_at = ?
+                WHERE kind = ? AND ref_id = ? AND status IN ('queued', 'running')
+            ''', (time.time(), kind, ref_id))
+            return cursor.rowcount
+
+    def is_cancelled(self, job_id: int) -> bool:
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT status FROM jobs WHERE id = ?', (job_id,))
+            row = cursor.fetchone()
+        return row is None or row['status'] == 'cancelled'
+
+    def recover(self) -> int:
+        """进程启动时调用：上次退出时仍在执行的任务重新排队，并清理过期的已结束任务"""
+        now = time.time()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE jobs SET status = 'queued', next_run_at = ? WHERE status = 'running'", (now,))
+            recovered = cursor.rowcount
+            cursor.execute('''
+                DELETE FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND finished_at < ?
+            ''', (now - FINISHED_RETENTION_DAYS * 86400,))
+        return recovered
+
+    def active_jobs(self, kind: str) -> Dict[str, Dict[str, Any]]:
+        """某类未完成任务的状态，按 ref_id 索引：{"id", "status", "attempts", "max_attempts", "last_error"}"""
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, ref_id, status, attempts, max_attempts, last_error FROM jobs
+                WHERE kind = ? AND status IN ('queued', 'running')
+            ''', (kind,))
+            rows = cursor.fetchall()
+        return {row['ref_id']: dict(row) for row in rows}
+
+    def depth(self, kind: Optional[str] = None) -> Dict[str, int]:
+        """排队中与执行中的任务数：{"queued": n, "running": m}"""
+        query = "SELECT status, COUNT(*) AS n FROM jobs WHERE status IN ('queued', 'running')"
+        params: Tuple = ()
+        if kind:
+            query += " AND kind = ?"
+            params = (kind,)
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query + " GROUP BY status", params)
+            counts = {row['status']: row['n'] for row in cursor.fetchall()}
+        return {status: counts.get(status, 0) for status in ACTIVE_STATUSES}
+
+    def stage_latency(self, kind: str, limit: int = 50) -> Dict[str, Dict[str, float]]:
+        """最近 limit 个已完成任务各阶段的耗时：{stage: {"count", "avg", "max"}}（秒）"""
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT stage_timings FROM jobs
+                WHERE kind = ? AND status = 'done' AND stage_timings IS NOT NULL
+                ORDER BY finished_at DESC LIMIT ?
+            ''', (kind, limit))
+            rows = cursor.fetchall()
+
+        samples: Dict[str, List[float]] = {}
+        for row in rows:
+            for stage, seconds in json.loads(row['stage_timings']).items():
+                samples.setdefault(stage, []).append(seconds)
+        return {
+            stage: {"count": len(values), "avg": sum(values) / len(values), "max": max(values)}
+            for stage, values in samples.items()
+        }
+
+    def recent_finished(self, kind: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """最近 limit 个成功完成的任务：{"created_at", "finished_at", "attempts", "stage_timings", "metrics"}"""
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT created_at, finished_at, attempts, stage_timings, metrics FROM jobs
+                WHERE kind = ? AND status = 'done'
+                ORDER BY finished_at DESC LIMIT ?
+            ''', (kind, limit))
+            rows = cursor.fetchall()
+        return [
+            {
+                **dict(row),
+                "stage_timings": json.loads(row['stage_timings'] or "{}"),
+                "metrics": json.loads(row['metrics'] or "{}"),
+            }
+            for row in rows
+        ]
+
+
+class WorkerPool:
+    """固定数量的后台线程，循环领取并执行已注册类型的任务"""
+
+    def __init__(self, queue: JobQueue, size: int = JOB_WORKERS):
+        self.queue = queue
+        self.size = max(size, 1)
+        self._wakeup = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        recovered = self.queue.recover()
+        if recovered:
+            print(f"恢复了 {recovered} 个中断的后台任务")
+        for i in range(self.size):
+            thread = threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def notify(self) -> None:
+        """有新任务时唤醒空闲的 worker"""
+        self._wakeup.set()
+
+    def _worker_loop(self) -> None:
+        while True:
+            try:
+                job = self.queue.claim(list(_handlers))
+            except Exception as e:
+                print(f"领取后台任务失败: {e}")
+                job = None
+            if job is None:
+                try:
+                    due = self.queue.next_due_in(list(_handlers))
+                except Exception:
+                    due = None
+                self._wakeup.wait(POLL_INTERVAL if due is None else min(due, POLL_INTERVAL))
+                self._wakeup.clear()
+                continue
+            self._run(job)
+
+    def _run(self, job: Dict[str, Any]) -> None:
+        run, on_failed = _handlers[job["kind"]]
+        ctx = JobContext(self.queue, job)
+        try:
+            run(job["payload"], ctx)
+            self.queue.complete(job["id"], ctx)
+        except JobCancelled:
+            print(f"后台任务 {job['id']} 已取消")
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            retry = not isinstance(e, PermanentJobError)
+            will_retry = self.queue.fail(job, error, ctx, retry=retry)
+            print(f"后台任务 {job['id']} 第 {job['attempts']} 次执行失败: {error}" + ("，稍后重试" if will_retry else ""))
+            if not will_retry and on_failed is not None and not self.queue.is_cancelled(job["id"]):
+                try:
+                    on_failed(job["payload"], e)
+                except Exception as cb_e:
+                    print(f"写回任务失败状态时出错: {cb_e}")
+
+
+_pool: Optional[WorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def start_workers() -> WorkerPool:
+    """启动进程内唯一的 worker 池（重复调用直接返回），并恢复上次未完成的任务"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            pool = WorkerPool(JobQueue())
+            pool.start()
+            _pool = pool
+    return _pool
@@ -1,9 +1,12 @@
 import os
 import shutil
+import hashlib
 from document_loader import DocumentLoader
 from text_splitter import TextSplitter
 from vector_store import VectorStore
 from config import DATA_DIR, CHUNK_SIZE, CHUNK_OVERLAP, SIZE_ERROR, OVERLAP_ERROR
+from quiz_pool import QuizPool
+from answer_cache import AnswerCache
 
 class KBManager:
     def __init__(self, base_dir=DATA_DIR):
@@ -44,6 +47,7 @@ class KBManager:
                 vs.delete_collection(name)
             except Exception as e:
                 print(f"Error deleting collection: {e}")
+            self._invalidate_kb_caches(name)
             return True
         return False
 
@@ -74,6 +78,50 @@ class KBManager:
                             pass  # 忽略无法访问的文件
         return total_size
 
+    def get_kb_file_signatures(self, kb_name):
+        """知识库中每个文件的签名 {相对路径: "大小|修改时间"}"""
+        path = os.path.join(self.base_dir, kb_name)
+        signatures = {}
+        if os.path.exists(path):
+            for root, dirs, files in os.walk(path):
+                for f in files:
+                    if not f.startswith('.'):
+                        file_path = os.path.join(root, f)
+                        try:
+                            stat = os.stat(file_path)
+                        except OSError:
+                            continue
+                        signatures[os.path.relpath(file_path, path)] = f"{stat.st_size}|{stat.st_mtime_ns}"
+        return signatures
+
+    def get_kb_fingerprint(self, kb_name, file_signatures=None):
+        """知识库内容指纹：文件列表、大小、修改时间及切分参数的哈希，任一变化即表示索引已变化"""
+        if file_signatures is None:
+            file_signatures = self.get_kb_file_signatures(kb_name)
+        entries = sorted(f"{rel_path}|{sig}" for rel_path, sig in file_signatures.items())
+        entries.append(f"chunk|{CHUNK_SIZE}|{CHUNK_OVERLAP}|{SIZE_ERROR}|{OVERLAP_ERROR}")
+        return hashlib.md5("\n".join(entries).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def diff_file_signatures(old, new):
+        """比较两份文件签名，返回 (新增, 删除, 修改) 的文件列表"""
+        old = old or {}
+        added = sorted(set(new) - set(old))
+        removed = sorted(set(old) - set(new))
+        modified = sorted(f for f in set(old) & set(new) if old[f] != new[f])
+        return added, removed, modified
+
+    def _invalidate_kb_caches(self, kb_name):
+        """知识库索引变化后清空预生成题目池与问答缓存"""
+        try:
+            QuizPool().invalidate(kb_name)
+        except Exception as e:
+            print(f"清空题目池失败: {e}")
+        try:
+            AnswerCache().invalidate(kb_name)
+        except Exception as e:
+            print(f"清空问答缓存失败: {e}")
+
     def add_file(self, kb_name, uploaded_file):
         """添加文件到知识库（增量更新模式）"""
         kb_path = os.path.join(self.base_dir, kb_name)
@@ -110,6 +158,7 @@ class KBManager:
             
             # 然后删除文件
             os.remove(file_path)
+            self._invalidate_kb_caches(kb_name)
             return True
         return False
     
@@ -150,6 +199,7 @@ class KBManager:
             print(f"文件 {filename} 已成功添加到向量数据库")
         else:
             print(f"文件 {filename} 未能提取到内容")
+        self._invalidate_kb_caches(kb_name)
 
     def import_from_directory(self, kb_name, source_dir):
         """递归导入本地文件夹内容到知识库"""
@@ -246,6 +296,9 @@ class KBManager:
                     count_add += 1
                 except Exception as e:
                     print(f"添加文件失败 {fp}: {e}")
+        
+        if count_rem:
+            self._invalidate_kb_caches(kb_name)
                 
         return count_add, count_rem
 
@@ -265,4 +318,5 @@ class KBManager:
         if documents:
             chunks = splitter.split_documents(documents)
             vector_store.add_documents(chunks)
+        self._invalidate_kb_caches(kb_name)
 
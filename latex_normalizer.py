@@ -0,0 +1,219 @@
+"""
+LaTeX 格式修复（流式、增量）
+
+把模型输出中被写成代码块/行内代码的公式改为美元符号格式，并给选择题选项中裸露的 LaTeX 加上 $...$。
+规则与原 RAGAgent.fix_latex_format 完全一致，依次为三步：
+    1. ```...``` 代码块（可带 latex/math 标记）中的公式 -> $...$ 或 $$...$$
+    2. 行内代码 `...` 中的公式 -> $...$
+    3. 以 A. / B) 等开头的选项行中未包裹的 LaTeX 片段 -> $...$
+每一步实现为一个带状态的增量处理器，只在必要时缓冲（未闭合的代码块、行内代码、尚未结束的选项行），
+文本可以按任意方式切分后逐段输入，拼接后的输出与对全文一次性处理相同。
+"""
+import re
+from typing import List
+
+# 内容中出现任一标记即视为公式
+_LATEX_HINT_RE = re.compile(r'\\sum|\\frac|\\int|\\sqrt|\\left|\\right|[=^_]')
+_CODE_BLOCK_RE = re.compile(r'```(?:latex|math)?\n?(.*?)```', re.DOTALL)
+_INLINE_CODE_RE = re.compile(r'`([^`]+)`')
+_OPTION_LINE_RE = re.compile(r'^[A-D][\.\)][^\n]*', re.MULTILINE)
+_OPTION_RE = re.compile(r'([A-D][\.\)])\s*(.+)')
+_DOLLAR_SPLIT_RE = re.compile(r'(\$[^$]+\$)')
+
+
+def _looks_like_latex(text: str) -> bool:
+    return _LATEX_HINT_RE.search(text) is not None
+
+
+def _replace_code_block(match: re.Match) -> str:
+    code_content = match.group(1)
+    if not _looks_like_latex(code_content):
+        return match.group(0)
+    cleaned = code_content.strip()
+    # 单行用单美元符号，多行用双美元符号
+    return f"$${cleaned}$$" if '\n' in cleaned else f"${cleaned}$"
+
+
+def _replace_inline_code(match: re.Match) -> str:
+    code_content = match.group(1)
+    return f"${code_content}$" if _looks_like_latex(code_content) else match.group(0)
+
+
+def _fix_option_line(match: re.Match) -> str:
+    line = match.group(0)
+    option_match = _OPTION_RE.match(line)
+    if not option_match:
+        return line
+    prefix, content = option_match.group(1), option_match.group(2)
+    if '\\' not in content:
+        return line
+    if '$' not in content:
+        # 整个内容作为公式包裹
+        return f"{prefix} ${content}$"
+    # 已经有部分美元符号，只包裹未包裹的 LaTeX 片段
+    parts = []
+    for part in _DOLLAR_SPLIT_RE.split(content):
+        if part.startswith('$') and part.endswith('$'):
+            parts.append(part)
+        elif '\\' in part:
+            parts.append(f"${part}$")
+        else:
+            parts.append(part)
+    return f"{prefix} {''.join(parts)}"
+
+
+class _CodeBlockStage:
+    """第 1 步：```...``` 代码块
+
+    从左到右匹配到的代码块不会因为后续输入而改变；未闭合的 ``` 之后（或末尾可能拼成 ``` 的反引号）需要等待。
+    """
+
+    def __init__(self):
+        self.buf = ""
+        self.scan = 0  # buf 以未闭合的 ``` 开头时，下次查找闭合 ``` 的起点
+
+    def feed(self, text: str, final: bool = False) -> str:
+        self.buf += text
+        if final:
+            out, self.buf, self.scan = _CODE_BLOCK_RE.sub(_replace_code_block, self.buf), "", 0
+            return out
+        if self.scan and self.buf.find('```', self.scan) == -1:
+            self.scan = max(3, len(self.buf) - 2)
+            return ""
+
+        last_end = 0
+        for match in _CODE_BLOCK_RE.finditer(self.buf):
+            last_end = match.end()
+        unclosed = self.buf.find('```', last_end)
+        if unclosed != -1:
+            cut = unclosed
+            self.scan = max(3, len(self.buf) - unclosed - 2)
+        else:
+            # 末尾的 1~2 个反引号可能与后续输入拼成 ```
+            cut = max(last_end, len(self.buf.rstrip('`')))
+            self.scan = 0
+        out = _CODE_BLOCK_RE.sub(_replace_code_block, self.buf[:cut])
+        self.buf = self.buf[cut:]
+        return out
+
+
+class _InlineCodeStage:
+    """第 2 步：`...` 行内代码（作用于第 1 步的输出）
+
+    已匹配的行内代码同样不受后续输入影响；其后第一个可能开启新匹配的反引号（下一个字符不是反引号）之后需要等待。
+    """
+
+    def __init__(self):
+        self.buf = ""
+        self.scan = 0  # buf 以等待闭合的反引号开头时，下次查找闭合反引号的起点
+
+    def feed(self, text: str, final: bool = False) -> str:
+        self.buf += text
+        if final:
+            out, self.buf, self.scan = _INLINE_CODE_RE.sub(_replace_inline_code, self.buf), "", 0
+            return out
+        if self.scan and self.buf.find('`', self.scan) == -1:
+            self.scan = len(self.buf)
+            return ""
+
+        last_end = 0
+        for match in _INLINE_CODE_RE.finditer(self.buf):
+            last_end = match.end()
+        cut = len(self.buf)
+        pos = self.buf.find('`', last_end)
+        while pos != -1:
+            if self.buf[pos + 1:pos + 2] != '`':
+                cut = pos
+                break
+            pos = self.buf.find('`', pos + 1)
+        out = _INLINE_CODE_RE.sub(_replace_inline_code, self.buf[:cut])
+        self.buf = self.buf[cut:]
+        self.scan = len(self.buf) if len(self.buf) > 1 else 0
+        return out
+
+
+class _OptionLineStage:
+    """第 3 步：选择题选项行（作用于第 2 步的输出）
+
+    普通行随输入直接输出，选项行（以 A. / B) 等开头）缓冲到行尾再处理。
+    """
+
+    def __init__(self):
+        self.buf = ""
+        self.at_line_start = True
+        self.in_option = False  # buf 是一行尚未结束的选项
+
+    def feed(self, text: str, final: bool = False) -> str:
+        self.buf += text
+        out: List[str] = []
+
+        # 先结束上次未完成的一行
+        if not self.at_line_start or self.in_option:
+            newline = self.buf.find('\n')
+            if newline == -1:
+                if self.in_option and not final:
+                    return ""
+                out.append(_OPTION_LINE_RE.sub(_fix_option_line, self.buf) if self.in_option else self.buf)
+                self.buf = ""
+                self.in_option = False
+                return "".join(out)
+            line = self.buf[:newline + 1]
+            out.append(_OPTION_LINE_RE.sub(_fix_option_line, line) if self.in_option else line)
+            self.buf = self.buf[newline + 1:]
+            self.at_line_start = True
+            self.in_option = False
+
+        # 完整的行一次性处理
+        last_newline = self.buf.rfind('\n')
+        if last_newline != -1:
+            out.append(_OPTION_LINE_RE.sub(_fix_option_line, self.buf[:last_newline + 1]))
+            self.buf = self.buf[last_newline + 1:]
+
+        # 剩余的是新一行的开头
+        if final:
+            out.append(_OPTION_LINE_RE.sub(_fix_option_line, self.buf))
+            self.buf = ""
+        elif self.buf:
+            head = self.buf[:2]
+            if head[0] in "ABCD" and (len(head) < 2 or head[1] in ".)"):
+                # 可能或已经是选项行，等待行尾
+                self.in_option = len(head) == 2
+            else:
+                out.append(self.buf)
+                self.buf = ""
+                self.at_line_start = False
+        return "".join(out)
+
+
+class LatexNormalizer:
+    """增量 LaTeX 格式修复器：feed() 输入任意切分的文本片段，返回当前可以安全输出的已修复文本
+
+    用法:
+        normalizer = LatexNormalizer()
+        for token in stream:
+            piece = normalizer.feed(token)
+            ...
+        tail = normalizer.flush()
+    """
+
+    def __init__(self):
+        self._code_blocks = _CodeBlockStage()
+        self._inline_code = _InlineCodeStage()
+        self._option_lines = _OptionLineStage()
+
+    def feed(self, text: str) -> str:
+        text = self._code_blocks.feed(text)
+        text = self._inline_code.feed(text) if text else ""
+        return self._option_lines.feed(text) if text else ""
+
+    def flush(self) -> str:
+        """输入结束，输出剩余缓冲"""
+        text = self._code_blocks.feed("", final=True)
+        text = self._inline_code.feed(text, final=True)
+        return self._option_lines.feed(text, final=True)
+
+
+def normalize_latex(text: str) -> str:
+    """对完整文本做 LaTeX 格式修复"""
+    normalizer = LatexNormalizer()
+    return normalizer.feed(text) + normalizer.flush()
@@ -0,0 +1,860 @@
+"""
+错题后台处理：图片识别 -> 题型判断 -> 解题生成 -> 写入结果
+
+添加错题时只写入一条 status='processing' 的占位记录，并把处理任务加入 job_queue，
+由固定数量的后台线程执行。失败按退避重试，应用重启后未完成的任务继续处理，处理中的题目可以取消。
+
+流水线模式 (MISTAKE_PIPELINE)：
+    staged:   图片识别、题型判断、解题生成各一次模型调用
+    combined: 图片识别时同时输出题型；文字题先用本地规则判断题型，规则无法确定时才调用模型判断
+每个任务记录模型调用次数与 token 用量，pipeline_report() 按模式汇总，便于对比两种模式。
+"""
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+import config
+from database import get_read_connection
+from image_preprocess import image_data_url
+from image_store import load_image_b64, store_image_value
+from job_queue import JobContext, JobQueue, PermanentJobError, register_handler, start_workers
+from question_db import QuestionDB
+
+JOB_KIND = "mistake"
+PIPELINE_MODES = ("combined", "staged")
+
+# 界面上显示的各阶段名称
+STAGE_LABELS = {
+    "queued": "排队等待",
+    "ocr": "图片识别",
+    "classify": "题型判断",
+    "solve": "解题生成",
+    "save": "写入结果",
+}
+
+
+class MistakeProcessError(Exception):
+    """处理失败，title/detail 会写回错题记录，提示用户失败原因"""
+
+    def __init__(self, title: str, detail: str):
+        super().__init__(detail)
+        self.title = title
+        self.detail = detail
+
+
+class MistakeInputError(MistakeProcessError, PermanentJobError):
+    """缺少配置或输入，重试也无法成功"""
+
+
+# Helper function to clean JSON responses
+def clean_json_string(s):
+    if not s: return "{}"
+    s = s.strip()
+    # Remove markdown code blocks
+    s = re.sub(r'^```json\s*', '', s, flags=re.MULTILINE)
+    s = re.sub(r'^```\s*', '', s, flags=re.MULTILINE)
+    s = re.sub(r'\s*```$', '', s, flags=re.MULTILINE)
+    # Extract JSON object
+    start = s.find('{')
+    end = s.rfind('}')
+    if start != -1 and end != -1:
+        s = s[start:end+1]
+    
+    # CRITICAL FIX for LaTeX in JSON:
+    # Problem: \nabla -> \n (newline) + "abla", \rho -> \r + "ho", \frac -> \f + "rac"
+    # Solution: Escape ALL backslashes, then restore only intended newlines
+    
+    # Step 1: Escape ALL backslashes (turn \ into \\)
+    s = s.replace('\\', '\\\\')
+    
+    # Step 2: Restore intended escape sequences:
+    # - \\n followed by digit, space, punctuation, or quote → real newline (\n)
+    # - \\n followed by letter → LaTeX command like \nabla, keep as \\n
+    # Same logic for \\r, \\t, etc.
+    
+    # Restore \\n → \n only when NOT followed by a letter (i.e., it's a real newline)
+    s = re.sub(r'\\\\n(?![a-zA-Z])', r'\\n', s)
+    # Restore \\r → \r only when NOT followed by a letter
+    s = re.sub(r'\\\\r(?![a-zA-Z])', r'\\r', s)
+    # Restore \\t → \t only when NOT followed by a letter  
+    s = re.sub(r'\\\\t(?![a-zA-Z])', r'\\t', s)
+    # Restore \\\\ → \\ (escaped backslash for JSON)
+    s = s.replace('\\\\\\\\', '\\\\')
+    # Restore \\" → \" (escaped quote)
+    s = s.replace('\\\\"', '\\"')
+    
+    return s
+
+
+OCR_PROMPT = r"""
+你是一个OCR识别专家。请将图片中的文字完整提取出来。
+
+**格式要求**：
+- 数学公式使用 LaTeX，必须用 $...$ 或 $$...$$ 包裹
+- 示例：$\sqrt{\dfrac{a^2}{b}}$ 而不是 √a²/b
+- 保持原有换行和列表格式
+- 不要添加任何解释或分析
+
+直接输出文字内容即可，不需要JSON格式。
+"""
+
+CLASSIFY_PROMPT = r"""
+分析以下题目文本，判断题型并输出JSON。
+
+**题型定义**：
+- multiple_choice: 单选题（ABCD选项）
+- multi_select: 多选题（多个正确答案）
+- boolean: 判断题（对错）
+- fill_in_blank: 填空题（有空格待填）
+- short_answer: 解答题/计算题
+- proof: 证明题/推导题
+- mixed: 混合题型（包含多个小题，且涉及不同类型）
+
+输出格式：{"type": "...", "confidence": "high/medium/low"}
+"""
+
+# --- Prompt Construction ---
+# 1. Base Instruction (Shared)
+BASE_PROMPT = r"""
+你是一位资深的数学解题专家。你的任务是解答题目并输出标准JSON。
+
+**绝对格式规则**：
+1. **公式格式**：必须且只能使用 $...$ (行内) 或 $$...$$ (行间) 包裹。严禁使用 \[ \] 或 \( \)。
+   - ❌ [错误]: √ a^2/b 或 \[\sqrt{\dfrac{a^2}{b}}\] 或 \(\sqrt{\dfrac{a^2}{b}}\)
+   - ✅ [正确]: $\sqrt{\dfrac{a^2}{b}}$
+2. **排版格式**：`explanation` 必须分行显示，使用 `\n` 换行。
+   - ✅ [正确]: "解：\n1. 第一步...\n2. 第二步..."
+3. **必填项**：`answers` 和 `explanation` 绝不能为空。
+
+请输出 JSON:
+{
+    "summary": "知识点摘要",
+    "question": "规范化后的题目文本",
+    "explanation": "详细解析（分步骤）",
+    "answers": ["结果1", "结果2"],  // 最终答案数组。选择题留空。
+    "options": [],                // 仅选择题填写，否则为空数组 []
+    "correct_answer": ""          // 仅选择题填写，否则为空字符串
+}
+"""
+
+# 2. Type-Specific Examples
+TYPE_PROMPTS = {
+    "multiple_choice": r"""
+**当前任务**：处理【单项选择题】。
+请提取选项列表，并给出正确选项。
+
+【示例】
+Type: multiple_choice
+Text: 1+1=? A.1 B.2
+Output:
+{
+    "summary": "基础加法",
+    "question": "1+1=?",
+    "explanation": "1+1=2，所以选B。",
+    "answers": [],
+    "options": ["A. 1", "B. 2"],
+    "correct_answer": "B"
+}
+""",
+    "multi_select": r"""
+**当前任务**：处理【多项选择题】。
+请提取选项列表，并给出所有正确选项（例如 "AC"）。
+
+【示例】
+Type: multi_select
+Text: 已知集合 $A=\{1, 2, 3\}$，则下列结论正确的是？
+A. $1 \in A$
+B. $4 \in A$
+C. $\{1, 2\} \subseteq A$
+D. $\emptyset \in A$
+Output:
+{
+    "summary": "集合的性质",
+    "question": "已知集合 $A=\{1, 2, 3\}$，则下列结论正确的是？",
+    "explanation": "解：\n1. 元素1在集合A中，故A正确。\n2. 元素4不在集合A中，故B错误。\n3. $\{1, 2\}$是A的子集，故C正确。\n4. 空集是任意集合的子集，但不是A的元素，故D错误。\n综上选AC。",
+    "answers": [],
+    "options": ["A. $1 \\in A$", "B. $4 \\in A$", "C. $\{1, 2\} \\subseteq A$", "D. $\\emptyset \\in A$"],
+    "correct_answer": "AC"
+}
+""",
+    "boolean": r"""
+**当前任务**：处理【判断题】。
+请判断对错。正确填"True"，错误填"False"（作为 correct_answer）。
+
+【示例】
+Type: boolean
+Text: 函数 $f(x) = x^2$ 是奇函数。
+Output:
+{
+    "summary": "函数奇偶性",
+    "question": "函数 $f(x) = x^2$ 是奇函数。",
+    "explanation": "解：\n1. 定义域为 R。\n2. 计算 $f(-x) = (-x)^2 = x^2 = f(x)$。\n3. 满足偶函数定义，故不是奇函数。\n4. 题干说法错误。",
+    "answers": [],
+    "options": [],
+    "correct_answer": "False"
+}
+""",
+    "mixed": r"""
+**当前任务**：处理【混合题型】。
+此类题目通常包含填空、选择、计算等多个部分，或者结构复杂。
+请生成完整的题目文本和详细解析。
+`answers` 字段请填 `["见解析"]`。
+
+【示例】
+Type: mixed
+Text: (1)填空：... (2)计算：...
+Output:
+{
+    "summary": "综合练习",
+    "question": "完整题目...",
+    "explanation": "详解...",
+    "answers": ["见解析"],
+    "options": [],
+    "correct_answer": ""
+}
+""",
+    "fill_in_blank": r"""
+**当前任务**：处理【填空题】。
+请计算出结果填入 `answers` 数组。
+
+**答案格式规则**：
+1. **数学公式必须用LaTeX**：用 $...$ 包裹，如 `$x^2+1$`
+
+2. **多个空格**：每个空格一个数组元素，用换行区分
+   - 示例：`["第一空答案", "第二空答案"]`
+
+3. **多解（任选一个）**：用 | 或 ｜ 分隔备选答案
+   - 示例：`["答案A｜答案B｜答案C"]` （用户填任何一个都算对）
+
+4. **一个答案包含多个部分**：直接作为整体写入
+   - 示例：`["$x=1, y=2$"]` 或 `["$\\alpha=30°, \\beta=60°$"]`
+
+【示例1：单空题】
+Type: fill_in_blank
+Text: 勾股定理公式是____。
+Output:
+{
+    "summary": "勾股定理",
+    "question": "勾股定理公式是____。",
+    "explanation": "直角三角形两条直角边的平方和等于斜边的平方。",
+    "answers": ["$a^2+b^2=c^2$"],
+    "options": [],
+    "correct_answer": ""
+}
+
+【示例2：多空题】
+Type: fill_in_blank
+Text: 求解方程组：(1) x+y=5的一组解是x=____，y=____。(2) 2x=10，则x=____。
+Output:
+{
+    "summary": "方程组求解",
+    "question": "求解方程组：(1) x+y=5的一组解是x=____，y=____。(2) 2x=10，则x=____。",
+    "explanation": "解：\n1. (1)可以是x=1,y=4或x=2,y=3等\n2. (2)解得x=5",
+    "answers": ["1｜2｜3", "4｜3｜2", "5"],
+    "options": [],
+    "correct_answer": ""
+}
+
+【示例3：一个空多个值都要写】
+Type: fill_in_blank
+Text: 方程$x^2-1=0$的解为____。
+Output:
+{
+    "summary": "一元二次方程",
+    "question": "方程$x^2-1=0$的解为____。",
+    "explanation": "解：$x^2=1$，故$x=\\pm 1$，即$x_1=1, x_2=-1$",
+    "answers": ["$x_1=1, x_2=-1$｜$x=\\pm 1$"],
+    "options": [],
+    "correct_answer": ""
+}
+""",
+    "short_answer": r"""
+**当前任务**：处理【解答题/计算题】。
+请给出详细推导过程和**最终答案**。
+
+**答案格式规则**：
+1. **数学公式必须用LaTeX**：用 $...$ 包裹，如 `$x^2+1$`
+
+2. **多个小题**：每一问一个数组元素 `["第一问", "第二问"]`
+
+3. **多解（任选一个）**：用 | 或 ｜ 分隔 `["答案A｜答案B"]`
+
+4. **一个答案包含多个部分**：作为整体 `["$x=1, y=2$"]`
+
+**重要**：`answers`数组必须包含最终结果，不能为空！如果有多问，每一问都要填入。
+
+【示例】
+Type: short_answer
+Text: 解方程 $x^2 - 1 = 0$
+Output:
+{
+    "summary": "一元二次方程求解",
+    "question": "解方程 $x^2 - 1 = 0$",
+    "explanation": "解：\n1. 移项得 $x^2=1$。\n2. 开平方得 $x=\pm 1$。\n3. 即 $x_1=1, x_2=-1$。",
+    "answers": ["$x=\\pm 1$｜$x_1=1, x_2=-1$"],
+    "options": [],
+    "correct_answer": ""
+}
+""",
+    "proof": r"""
+**当前任务**：处理【证明题】。
+请仅生成解析，`answers` 填 `["见解析"]`。
+
+【示例】
+Type: proof
+Text: 求证：对顶角相等。
+Output:
+{
+    "summary": "几何基础",
+    "question": "求证：对顶角相等。",
+    "explanation": "证明：设直线AB、CD相交于O...\n所以 $\angle AOC = \angle BOD$。",
+    "answers": ["见解析"],
+    "options": [],
+    "correct_answer": ""
+}
+"""
+}
+
+COMBINED_OCR_PROMPT = OCR_PROMPT.replace("直接输出文字内容即可，不需要JSON格式。", r"""**输出格式**：
+第一行输出题型，格式为 `题型: <type>`，type 只能是以下之一：
+multiple_choice（单选题）、multi_select（多选题）、boolean（判断题）、fill_in_blank（填空题）、
+short_answer（解答题/计算题）、proof（证明题/推导题）、mixed（包含多个不同类型小题的混合题）
+从第二行开始直接输出题目文字，不需要JSON格式。""")
+
+_TYPE_LINE_RE = re.compile(r'^\s*(?:题型|type)\s*[:：]\s*`?([a-z_]+)`?\s*$', re.IGNORECASE)
+
+# 本地题型判断规则
+_OPTION_MARK_RE = re.compile(r'(?:^|[\s（(])([A-D])\s*[\.．、\)）:：]', re.MULTILINE)
+_BLANK_RE = re.compile(r'_{2,}|＿{2,}')
+_SUB_QUESTION_RE = re.compile(r'[（(]\s*[2２Ⅱⅱ]\s*[）)]')
+_PROOF_RE = re.compile(r'证明|求证')
+_MULTI_SELECT_RE = re.compile(r'多选|不定项')
+_BOOLEAN_RE = re.compile(r'判断.{0,8}(对错|正误|是否正确)|[（(]\s*[√×]\s*[）)]')
+
+COMPLETION_REMINDER = """
+【重要】你必须输出完整的JSON，包含所有字段：
+- summary (必填)
+- question (必填)  
+- explanation (必填，不能为空，必须有详细步骤)
+- answers (必填，不能为空数组)
+- options
+- correct_answer
+
+不要在生成question后就停止！必须继续生成explanation和answers！
+"""
+
+
+def _load_clients():
+    """按当前设置创建客户端（设置可能在运行中被修改，因此每个任务重新读取）"""
+    # 强制重新加载环境变量
+    load_dotenv(override=True)
+
+    # Fetch credentials
+    vl_key = os.getenv("VL_API_KEY") or os.getenv("OPENAI_API_KEY")
+    vl_base = os.getenv("VL_API_BASE") or os.getenv("OPENAI_API_BASE")
+    vl_model = os.getenv("VL_MODEL_NAME", "gpt-4o")
+
+    text_key = os.getenv("OPENAI_API_KEY") or vl_key
+    text_base = os.getenv("OPENAI_API_BASE") or vl_base
+    text_model = os.getenv("MODEL_NAME", vl_model)
+
+    if not vl_key:
+        raise MistakeInputError("❌ API Key 未配置", "后台进程无法读取 API Key。请在设置中配置。")
+
+    # 客户端底层的 HTTP 连接池在进程内共享
+    vl_client = config.get_openai_client(api_key=vl_key, base_url=vl_base)
+    text_client = config.get_openai_client(api_key=text_key, base_url=text_base)
+    return vl_client, vl_model, text_client, text_model
+
+
+def _recognize(vl_client, vl_model: str, ocr_b64: str, ctx: JobContext, with_type: bool = False) -> Tuple[str, Optional[str]]:
+    """STAGE 1: PURE OCR，返回 (题目文字, 题型)
+
+    with_type 为 True 时在同一次调用中让模型输出题型（combined 模式），否则题型为 None。
+    """
+    print("Starting Stage 1: Pure OCR...")
+    try:
+        ocr_resp = vl_client.chat.completions.create(
+            model=vl_model,
+            messages=[
+                {"role": "system", "content": COMBINED_OCR_PROMPT if with_type else OCR_PROMPT},
+                {"role": "user", "content": [
+                    {"type": "text", "text": "请提取这张图片中的文字："},
+                    {"type": "image_url", "image_url": {"url": image_data_url(ocr_b64)}}
+                ]}
+            ],
+            temperature=0.1,
+            max_tokens=2048
+        )
+        ctx.record_usage(ocr_resp)
+        source_text = ocr_resp.choices[0].message.content.strip()
+        print(f"Stage 1 OCR Output: {source_text[:100]}...")
+    except Exception as e:
+        print(f"Stage 1 OCR Error: {e}")
+        raise MistakeProcessError("❌ OCR识别失败", f"图像识别错误: {str(e)}") from e
+
+    if not with_type:
+        return source_text, None
+    return _split_type_line(source_text)
+
+
+def _split_type_line(output: str) -> Tuple[str, Optional[str]]:
+    """拆出 combined 识别结果第一行的题型；格式不符时整段视为题目文字、题型为 None"""
+    first_line, _, rest = output.partition('\n')
+    match = _TYPE_LINE_RE.match(first_line)
+    if not match:
+        return output, None
+    detected_type = match.group(1).lower()
+    return rest.strip(), detected_type if detected_type in TYPE_PROMPTS else None
+
+
+def guess_question_type(text: str) -> Optional[str]:
+    """本地规则判断题型，只在特征明确时返回题型，否则返回 None（交给模型判断）"""
+    if _SUB_QUESTION_RE.search(text):
+        # 多个小题可能是混合题型，规则无法可靠判断
+        return None
+    if _PROOF_RE.search(text):
+        return "proof"
+    if _BOOLEAN_RE.search(text):
+        return "boolean"
+    letters = set(_OPTION_MARK_RE.findall(text))
+    if {"A", "B"} <= letters and len(letters) >= 3:
+        return "multi_select" if _MULTI_SELECT_RE.search(text) else "multiple_choice"
+    if letters:
+        # 只有零星的字母标记，可能是题干中的点名/标号
+        return None
+    if _BLANK_RE.search(text):
+        return "fill_in_blank"
+    return None
+
+
+def _classify(text_client, text_model: str, source_text: str, ctx: JobContext) -> str:
+    """STAGE 2: CLASSIFICATION，失败时按解答题处理"""
+    print("Starting Stage 2: Question Type Classification...")
+    try:
+        classify_resp = text_client.chat.completions.create(
+            model=text_model,
+            messages=[
+                {"role": "system", "content": CLASSIFY_PROMPT},
+                {"role": "user", "content": f"题目文本：\n{source_text}"}
+            ],
+            temperature=0,
+            max_tokens=100
+        )
+        ctx.record_usage(classify_resp)
+        classify_raw = classify_resp.choices[0].message.content
+        classify_res = json.loads(clean_json_string(classify_raw), strict=False)
+        detected_type = classify_res.get("type", "short_answer")
+        print(f"Stage 2 Classification: {detected_type} (confidence: {classify_res.get('confidence', 'unknown')})")
+        return detected_type
+    except Exception as e:
+        print(f"Stage 2 Classification Error: {e}, defaulting to short_answer")
+        return "short_answer"
+
+
+def _solve(vl_client, vl_model: str, source_text: str, detected_type: str, q_correct: str, attachment_b64: Optional[str], ctx: JobContext) -> Dict:
+    """STAGE 3: SOLVING & GENERATION"""
+    print(f"Starting Stage 3: Solving question (Type: {detected_type})...")
+
+    # 3. Assemble Prompt
+    # Default to short_answer if type unknown
+    specific_prompt = TYPE_PROMPTS.get(detected_type, TYPE_PROMPTS["short_answer"])
+    sys_prompt_2 = BASE_PROMPT + "\n" + specific_prompt
+    user_content = f"【题目文本】:\n{source_text}\n\n【题型】: {detected_type}\n"
+    if q_correct:
+        user_content += f"【用户提供的答案】: {q_correct}\n"
+
+    msgs_2 = [{"role": "system", "content": sys_prompt_2}]
+    payload_2 = [{"type": "text", "text": user_content}]
+    if attachment_b64: # Context image
+        payload_2.append({"type": "image_url", "image_url": {"url": image_data_url(attachment_b64)}})
+
+    msgs_2.append({"role": "user", "content": payload_2}) # type: ignore
+    # CRITICAL: Force complete generation
+    msgs_2.append({"role": "user", "content": COMPLETION_REMINDER})
+
+    # Retry mechanism for Stage 3
+    max_retries = 3
+    res_2 = {}
+    last_error = None
+    
+    for attempt in range(max_retries):
+        try:
+            print(f"Stage 3 Generation (Attempt {attempt+1}/{max_retries})...")
+            resp_2 = vl_client.chat.completions.create(
+                model=vl_model,
+                messages=msgs_2, # type: ignore
+                temperature=0.3 + (attempt * 0.1),
+                max_tokens=4096
+                # Removed response_format to avoid premature termination
+            )
+            ctx.record_usage(resp_2)
+            raw_2 = resp_2.choices[0].message.content
+            print(f"Stage 3 Raw Output (first 200 chars): {raw_2[:200]}...")
+            print(f"Stage 3 Raw Output (last 200 chars): ...{raw_2[-200:]}")
+            print(f"Stage 3 Output length: {len(raw_2)} characters") 
+            
+            try:
+                cleaned = clean_json_string(raw_2)
+                print(f"Cleaned JSON (first 300 chars): {cleaned[:300]}")
+                curr_res = json.loads(cleaned, strict=False)
+                print(f"Parse SUCCESS! Keys: {list(curr_res.keys())}")
+                print(f"explanation present: {bool(curr_res.get('explanation'))}")
+                print(f"answers present: {bool(curr_res.get('answers'))}")
+            except Exception as parse_err:
+                print(f"JSON Parse Error: {parse_err}")
+                curr_res = {}
+            
+            # --- Validation Logic ---
+            is_valid = True
+            missing_fields = []
+            
+            # 1. Check Explanation (Required for all types)
+            if not curr_res.get("explanation") or len(str(curr_res.get("explanation", ""))) < 5:
+                # 对于 proof 题，explanation 是核心；对于其他题也很重要
+                is_valid = False
+                missing_fields.append("explanation")
+                print(f"Explanation validation failed. Value: {curr_res.get('explanation', 'N/A')[:50]}")
+            
+            # 2. Check Answer based on type
+            dt = detected_type
+            if dt in ["multiple_choice", "multi_select", "boolean"]:
+                if not curr_res.get("correct_answer"):
+                    is_valid = False
+                    missing_fields.append("correct_answer")
+            elif dt in ["fill_in_blank", "short_answer"]:
+                # Must have answers array
+                ans = curr_res.get("answers")
+                if not ans or not isinstance(ans, list) or len(ans) == 0:
+                     is_valid = False
+                     missing_fields.append("answers")
+                     print(f"Answers validation failed. Value: {ans}")
+            # proof / mixed types check skipped for answers
+            
+            if is_valid:
+                res_2 = curr_res
+                print("Stage 3 Validation Passed.")
+                break
+            else:
+                print(f"Stage 3 Validation Failed. Missing: {missing_fields}")
+                res_2 = curr_res # Keep it anyway in case we run out of retries
+                
+                if attempt < max_retries - 1:
+                    # Add feedback for next retry
+                    feedback_msg = f"上一次生成缺失了以下必须字段: {', '.join(missing_fields)}。请务必补充完整。"
+                    # Append textual feedback to history
+                    msgs_2.append({"role": "assistant", "content": raw_2}) 
+                    msgs_2.append({"role": "user", "content": f"请重新生成。注意：{feedback_msg}"})
+        
+        except Exception as e:
+            print(f"Stage 3 Error (Attempt {attempt+1}): {e}")
+            res_2 = {} # Clear on crash
+            last_error = e
+
+    # 每次请求都出错（而不是输出不完整）时交给任务队列整体重试
+    if not res_2 and last_error is not None:
+        raise last_error
+    return res_2
+
+
+def _build_question_data(res_2: Dict, detected_type: str, source_text: str, q_c: str, q_o: str, q_correct: str, q_e: str, attachment_image: Optional[str]) -> Tuple[Dict, str]:
+    """合并用户输入与模型输出，返回 (question_data, summary)"""
+    # --- Post-Processing ---
+    final_question = q_c if q_c else res_2.get("question", source_text)
+    final_explanation = q_e if q_e else res_2.get("explanation", "")
+    
+    ai_options = res_2.get("options", [])
+    
+    # Options Logic
+    if q_o:
+        final_options = q_o
+    else:
+        if detected_type in ["multiple_choice", "multi_select", "boolean"] and ai_options:
+            final_options = "\n".join(ai_options)
+        elif detected_type == "fill_in_blank" and ai_options: 
+             final_options = "\n".join(ai_options)
+             detected_type = "multiple_choice"
+        elif detected_type == "boolean":
+             # Ensure standard True/False options if missing
+             final_options = "True\nFalse"
+        else:
+            final_options = ""
+
+    # Helper for mapping various formats to Uppercase Letters
+    def _map_to_letter(s):
+        s = s.strip()
+        mapping = {
+            '1': 'A', '１': 'A', 'I': 'A', '甲': 'A', '对': 'T', 'T': 'T', 'True': 'T', 'TRUE': 'T', '√': 'T',
+            '2': 'B', '２': 'B', 'II': 'B', '乙': 'B', '错': 'F', 'F': 'F', 'False': 'F', 'FALSE': 'F', '×': 'F',
+            '3': 'C', '３': 'C', 'III': 'C', '丙': 'C',
+            '4': 'D', '４': 'D', 'IV': 'D', '丁': 'D',
+            '5': 'E', '５': 'E', 'V': 'E', '戊': 'E'
+        }
+        # Special Boolean handling if detected type is boolean
+        if detected_type == "boolean":
+            if s in ['A', 'T', 't', '1', '对', '√', 'True', 'TRUE']: return "True"
+            if s in ['B', 'F', 'f', '0', '错', '×', 'False', 'FALSE']: return "False"
+        
+        return mapping.get(s, s.upper())
+
+    # Answer Logic
+    # Answer Logic
+    final_correct = ""
+    ans_list = []
+    
+    # Determine final_correct string based on user input or AI output
+    if q_correct:
+        raw_correct = q_correct
+    else:
+        raw_correct = res_2.get("correct_answer", "")
+        
+    # Special handling for fill_in_blank encoding
+    if detected_type == "fill_in_blank":
+         if q_correct:
+             # If user provided answer manually, split by any newline type (hard or soft)
+             # splitlines() handles \n, \r, \r\n, \u2028 (Line Separator), etc.
+             cleaned = q_correct.strip()
+             # Check if there are multiple lines
+             lines = [line.strip() for line in cleaned.splitlines() if line.strip()]
+             
+             if len(lines) > 1:
+                 ans_list = lines
+             else:
+                 ans_list = [cleaned]
+         else:
+             # Use AI generated answers array
+             ans_list = res_2.get("answers", [])
+             # Fallback to correct_answer string if answers array is empty
+             if not ans_list and raw_correct:
+                 ans_list = [raw_correct]
+         
+         # Encode into final_options/correct_answer using the protocol
+         if ans_list:
+             final_options = "FILL_IN_BLANK:" + json.dumps(ans_list, ensure_ascii=False)
+             final_correct = "FILL_IN_BLANK"
+         else:
+             final_options = ""
+             final_correct = ""
+    
+    else:
+        # For other types (MC, boolean, short_answer, etc.)
+        final_correct = raw_correct
+        if detected_type in ["multiple_choice", "boolean"]:
+              final_correct = _map_to_letter(final_correct)
+    
+    # Multi-select normalization fallback
+    # Note: Use final_correct (not q_correct) to normalize AI-generated answers too
+    if detected_type == "multi_select" and final_correct:
+         cleaned = final_correct.replace('，', ',').replace('|', ',').replace(' ', ',')
+         # Check if it looks like "13" (digits string) or just comma separated
+         if ',' not in cleaned and len(cleaned) > 1:
+            # Treat "13" as "1", "3"
+            final_parts = [_map_to_letter(c) for c in cleaned]
+         else:
+            parts = [p.strip() for p in cleaned.split(',') if p.strip()]
+            final_parts = [_map_to_letter(p) for p in parts]
+         
+         final_correct = ", ".join(sorted(list(set(final_parts)))) # Sort and Dedup
+
+    # Save
+    q_data = {
+        "question_type": detected_type,
+        "question": final_question,
+        "options": final_options.split('\n') if final_options and "FILL_IN_BLANK" not in final_options else [],
+        "answers": json.loads(final_options[14:]) if final_options and "FILL_IN_BLANK" in final_options else (res_2.get("answers", []) if detected_type in ["short_answer", "fill_in_blank"] else None),
+        "correct_answer": final_correct if "FILL_IN_BLANK" not in str(final_correct) else None,
+        "explanation": final_explanation
+    }
+    if attachment_image: q_data["image"] = attachment_image
+
+    final_summary = res_2.get("summary", final_question[:20])
+    return q_data, final_summary
+
+
+def run_pipeline(payload: Dict[str, Any], ctx: JobContext, mode: Optional[str] = None) -> Tuple[Dict, str]:
+    """识别、判断题型并解题，返回 (question_data, summary)，不写数据库
+
+    mode 为 None 时使用设置中的 MISTAKE_PIPELINE。payload 见 enqueue_mistake。
+    """
+    q_c = payload.get("question") or ""
+    q_o = payload.get("options") or ""
+    q_correct = payload.get("correct_answer") or ""
+    q_e = payload.get("explanation") or ""
+    # 图片在入队时已存入 image_store，payload 中只有引用（旧任务中可能仍是 Base64）
+    ocr_b64 = load_image_b64(payload.get("ocr_image"))
+    attachment_b64 = load_image_b64(payload.get("attachment_image"))
+
+    vl_client, vl_model, text_client, text_model = _load_clients()
+    mode = mode or os.getenv("MISTAKE_PIPELINE", config.MISTAKE_PIPELINE)
+    if mode not in PIPELINE_MODES:
+        mode = "combined"
+    ctx.metrics["pipeline"] = mode
+
+    detected_type = payload.get("question_type")
+    type_source = "user" if detected_type else None
+
+    source_text = q_c
+    if ocr_b64 and not source_text:
+        with ctx.stage("ocr"):
+            source_text, ocr_type = _recognize(vl_client, vl_model, ocr_b64, ctx, with_type=(mode == "combined" and not detected_type))
+        if ocr_type:
+            detected_type, type_source = ocr_type, "ocr"
+    if not source_text:
+        print("No source text available")
+        raise MistakeInputError("❌ 未提供内容", "请输入题目内容或上传图片")
+
+    if not detected_type and mode == "combined":
+        detected_type = guess_question_type(source_text)
+        type_source = "rule" if detected_type else None
+    if not detected_type:
+        with ctx.stage("classify"):
+            detected_type = _classify(text_client, text_model, source_text, ctx)
+        type_source = "llm"
+    ctx.metrics["type_source"] = type_source
+    ctx.metrics["question_type"] = detected_type
+
+    with ctx.stage("solve"):
+        res_2 = _solve(vl_client, vl_model, source_text, detected_type, q_correct, attachment_b64, ctx)
+
+    return _build_question_data(res_2, detected_type, source_text, q_c, q_o, q_correct, q_e, payload.get("attachment_image"))
+
+
+def process_mistake(payload: Dict[str, Any], ctx: JobContext) -> None:
+    """任务处理函数"""
+    q_data, final_summary = run_pipeline(payload, ctx)
+    with ctx.stage("save"):
+        ctx.check_cancelled()
+        QuestionDB().update_question_status(
+            record_id=payload["record_id"], question_data=q_data, summary=final_summary,
+            status="completed", mistake_book=payload["mistake_book"]
+        )
+
+
+def _mark_failed(payload: Dict[str, Any], error: Exception) -> None:
+    """最后一次尝试失败后，把失败原因写回错题记录"""
+    if isinstance(error, MistakeProcessError):
+        title, detail = error.title, error.detail
+    else:
+        title, detail = "❌ 处理失败", f"处理出错: {str(error)}"
+    QuestionDB().update_result(payload["record_id"], payload["mistake_book"], {
+        "status": "failed",
+        "question": title,
+        "explanation": detail
+    })
+
+
+register_handler(JOB_KIND, process_mistake, on_failed=_mark_failed)
+
+
+def enqueue_mistake(
+    record_id: str,
+    mistake_book: str,
+    question: str = "",
+    options: str = "",
+    correct_answer: str = "",
+    explanation: str = "",
+    ocr_image: Optional[str] = None,
+    attachment_image: Optional[str] = None,
+    question_type: Optional[str] = None
+) -> int:
+    """为一条 processing 状态的错题加入处理任务，图片为 Base64 字符串，返回任务 ID
+
+    图片先存入 image_store，任务 payload 中只保存引用。
+    """
+    job_id = JobQueue().enqueue(JOB_KIND, record_id, {
+        "record_id": record_id,
+        "mistake_book": mistake_book,
+        "question": question,
+        "options": options,
+        "correct_answer": correct_answer,
+        "explanation": explanation,
+        "ocr_image": store_image_value(ocr_image),
+        "attachment_image": store_image_value(attachment_image),
+        "question_type": question_type,
+    })
+    # 先入队再启动，避免启动时把这条记录当作中断的旧记录
+    ensure_workers()
+    return job_id
+
+
+def cancel_mistake(record_id: str, mistake_book: Optional[str] = None) -> bool:
+    """取消一道错题的处理，题目保留为失败状态，可在详情中手动编辑"""
+    cancelled = JobQueue().cancel_ref(JOB_KIND, record_id) > 0
+    QuestionDB().update_question_status(record_id=record_id, summary="⏹ 已取消处理", status="failed", mistake_book=mistake_book)
+    return cancelled
+
+
+def _fail_orphaned() -> int:
+    """没有对应任务的 processing 记录（旧版本中随进程退出而中断的线程）标记为失败"""
+    with get_read_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id FROM questions WHERE status = 'processing' AND id NOT IN (
+                SELECT ref_id FROM jobs WHERE kind = ? AND status IN ('queued', 'running')
+            )
+        ''', (JOB_KIND,))
+        orphaned = [row['id'] for row in cursor.fetchall()]
+    question_db = QuestionDB()
+    for record_id in orphaned:
+        question_db.update_question_status(record_id=record_id, summary="⚠️ 处理中断，请重新添加或手动编辑", status="failed")
+    return len(orphaned)
+
+
+_workers_started = False
+
+
+def ensure_workers() -> None:
+    """启动后台 worker（每个进程一次），恢复上次退出时未完成的错题处理，并安排答题记录的定期归档"""
+    global _workers_started
+    if _workers_started:
+        return
+    import history_archive  # 注册归档任务的处理函数
+    start_workers()
+    _workers_started = True
+    try:
+        _fail_orphaned()
+    except Exception as e:
+        print(f"清理中断的错题记录失败: {e}")
+    try:
+        history_archive.schedule_maintenance()
+    except Exception as e:
+        print(f"安排答题记录归档失败: {e}")
+
+
+def queue_status() -> Dict[str, Any]:
+    """界面显示用：{"queued", "running", "stages": [(阶段名, 次数, 平均秒数, 最大秒数), ...]}"""
+    queue = JobQueue()
+    depth = queue.depth(JOB_KIND)
+    latency = queue.stage_latency(JOB_KIND)
+    stages = [
+        (label, latency[stage]["count"], latency[stage]["avg"], latency[stage]["max"])
+        for stage, label in STAGE_LABELS.items() if stage in latency
+    ]
+    return {**depth, "stages": stages}
+
+
+def pipeline_report(limit: int = 100) -> List[Dict[str, Any]]:
+    """最近完成的错题按流水线模式汇总：每题的端到端耗时、处理耗时、模型调用次数与 token 用量（均为平均值）"""
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for job in JobQueue().recent_finished(JOB_KIND, limit):
+        groups.setdefault(job["metrics"].get("pipeline", "staged"), []).append(job)
+
+    report = []
+    for mode, jobs in groups.items():
+        n = len(jobs)
+        report.append({
+            "pipeline": mode,
+            "count": n,
+            "end_to_end": sum(job["finished_at"] - job["created_at"] for job in jobs) / n,
+            "processing": sum(
+                sum(seconds for stage, seconds in job["stage_timings"].items() if stage != "queued") for job in jobs
+            ) / n,
+            "llm_calls": sum(job["metrics"].get("llm_calls", 0) for job in jobs) / n,
+            "prompt_tokens": sum(job["metrics"].get("prompt_tokens", 0) for job in jobs) / n,
+            "completion_tokens": sum(job["metrics"].get("completion_tokens", 0) for job in jobs) / n,
+            "classify_skipped": sum(1 for job in jobs if job["metrics"].get("type_source") in ("rule", "ocr")) / n,
+        })
+    return report
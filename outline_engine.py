@@ -0,0 +1,318 @@
+"""
+Map-Reduce Outline Engine.
+
+Instead of retrieving a fixed number of chunks and truncating them, the
+outline is built from the whole knowledge base:
+
+1. map:    every file is cut into page groups of at most OUTLINE_MAP_INPUT_CHARS
+           characters and each group is summarized (in parallel, bounded by
+           OUTLINE_MAP_CONCURRENCY). Summaries are cached in SQLite by the hash
+           of the group's text, so unchanged files are never summarized twice.
+2. reduce: summaries are packed into batches of at most OUTLINE_REDUCE_INPUT_CHARS
+           and merged level by level until they fit into a single final call
+           that writes the outline. Merge results are cached the same way, so
+           after a KB change only the affected files and the batches that
+           contain them are sent to the model again.
+"""
+import asyncio
+import hashlib
+import threading
+import time
+import concurrent.futures
+from typing import Any, Callable, Dict, List, Optional
+
+from config import OUTLINE_MAP_CONCURRENCY, OUTLINE_MAP_INPUT_CHARS, OUTLINE_REDUCE_INPUT_CHARS
+from database import get_connection, get_read_connection, init_db
+
+# 修改摘要提示词后递增，使旧缓存失效
+SUMMARY_PROMPT_VERSION = "1"
+# 合并阶段平均每 N 份摘要切一个箱子（见 OutlineEngine.pack）
+MERGE_BOUNDARY_MODULUS = 4
+
+
+class OutlineSummaryCache:
+    """按内容哈希缓存的分段摘要"""
+
+    def __init__(self):
+        init_db()
+
+    def get_many(self, content_hashes: List[str]) -> Dict[str, str]:
+        if not content_hashes:
+            return {}
+        result = {}
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            # 分批查询，避免超过 SQLite 参数数量上限
+            for i in range(0, len(content_hashes), 500):
+                batch = content_hashes[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                cursor.execute(f'SELECT content_hash, summary FROM outline_summaries WHERE content_hash IN ({placeholders})', batch)
+                for row in cursor.fetchall():
+                    result[row['content_hash']] = row['summary']
+        return result
+
+    def put(self, content_hash: str, source_label: str, summary: str) -> None:
+        with get_connection() as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO outline_summaries (content_hash, source_label, summary, created_at)
+                VALUES (?, ?, ?, ?)
+            ''', (content_hash, source_label, summary, time.time()))
+
+
+class OutlineEngine:
+    def __init__(self, agent, progress_callback: Optional[Callable[[str], None]] = None):
+        """
+        Args:
+            agent: RAGAgent，提供 client、model、vector_store 与 _outline_max_tokens
+            progress_callback: 可选，接收进度描述文本
+        """
+        self.agent = agent
+        self.progress_callback = progress_callback
+        self.cache = OutlineSummaryCache()
+
+    def _report(self, message: str) -> None:
+        print(f" [大纲] {message}")
+        if self.progress_callback:
+            self.progress_callback(message)
+
+    # ---------- 切分 ----------
+
+    def collect_units(self) -> List[Dict[str, Any]]:
+        """按文件、页码顺序把知识库切成若干摘要单元"""
+        grouped = self.agent.vector_store.get_documents_by_file()
+        units = []
+        for filepath in sorted(grouped, key=lambda p: grouped[p][0]["filename"]):
+            chunks = grouped[filepath]
+            filename = chunks[0]["filename"]
+            current, current_len, first_page, last_page = [], 0, None, None
+            for chunk in chunks:
+                if current and current_len + len(chunk["content"]) > OUTLINE_MAP_INPUT_CHARS:
+                    units.append(self._make_unit(filename, first_page, last_page, current))
+                    current, current_len, first_page = [], 0, None
+                if first_page is None:
+                    first_page = chunk["page_number"]
+                last_page = chunk["page_number"]
+                current.append(chunk["content"])
+                current_len += len(chunk["content"])
+            if current:
+                units.append(self._make_unit(filename, first_page, last_page, current))
+        return units
+
+    def _make_unit(self, filename: str, first_page: int, last_page: int, contents: List[str]) -> Dict[str, Any]:
+        text = "\n".join(contents)
+        if first_page == last_page:
+            label = f"{filename} 第{first_page}页" if first_page else filename
+        else:
+            label = f"{filename} 第{first_page}-{last_page}页"
+        return {
+            "filename": filename,
+            "label": label,
+            "text": text,
+            "hash": self._hash("map", text),
+        }
+
+    # ---------- 提示词 ----------
+
+    def build_map_messages(self, unit: Dict[str, Any]) -> List[Dict]:
+        prompt = f"""
+请为以下课程资料片段（{unit['label']}）写一份结构化摘要，供之后汇总为复习大纲。
+=== 资料 ===
+{unit['text']}
+=== 结束 ===
+
+要求：
+1. 使用 Markdown 多级列表，保留原有的章节结构。
+2. 覆盖所有核心概念、定义、定理和重点公式（公式用 $...$ 包裹）。
+3. 只总结资料中出现的内容，不要补充资料以外的知识。
+4. 篇幅与资料信息量相匹配，不要写开场白。
+"""
+        return [
+            {"role": "system", "content": "你是一个课程助教，擅长提炼课程资料要点。"},
+            {"role": "user", "content": prompt}
+        ]
+
+    def build_merge_messages(self, summaries: List[str]) -> List[Dict]:
+        joined = "\n\n".join(summaries)
+        prompt = f"""
+以下是同一门课程若干部分资料的摘要，请把它们合并为一份摘要。
+=== 摘要 ===
+{joined}
+=== 结束 ===
+
+要求：
+1. 使用 Markdown 多级列表，按原有顺序组织。
+2. 合并重复内容，但保留所有不同的知识点、定义、定理和公式。
+3. 不要写开场白。
+"""
+        return [
+            {"role": "system", "content": "你是一个课程助教，擅长整理课程要点。"},
+            {"role": "user", "content": prompt}
+        ]
+
+    def build_final_messages(self, summaries: List[str], file_count: int) -> List[Dict]:
+        joined = "\n\n".join(summaries)
+        prompt = f"""
+请根据以下课程资料摘要（覆盖知识库中全部 {file_count} 个文件），整理生成一份**非常详细**的复习大纲。
+=== 资料摘要 ===
+{joined}
+=== 结束 ===
+
+要求：
+1. 使用 Markdown 格式。
+2. 结构清晰，分章节或知识模块。
+3. **内容详实**：包含核心概念、定义、定理和重点公式（如有）。不要只列标题。
+4. 篇幅应与资料量相匹配，尽可能覆盖所有重要知识点。
+"""
+        return [
+            {"role": "system", "content": "你是一个课程助教，擅长总结大纲。"},
+            {"role": "user", "content": prompt}
+        ]
+
+    def pack(self, summaries: List[str]) -> List[List[str]]:
+        """把摘要按顺序装箱，每箱总长度不超过 OUTLINE_REDUCE_INPUT_CHARS
+
+        箱子的边界由摘要内容的哈希决定（而不是单纯按长度贪心），
+        这样增删一个文件只会改变相邻的一两个箱子，其余箱子的合并结果仍能命中缓存。
+        """
+        batches, current, current_len = [], [], 0
+        for summary in summaries:
+            if current and current_len + len(summary) > OUTLINE_REDUCE_INPUT_CHARS:
+                batches.append(current)
+                current, current_len = [], 0
+            current.append(summary)
+            current_len += len(summary)
+            if len(current) > 1 and int(self._hash("boundary", summary)[:8], 16) % MERGE_BOUNDARY_MODULUS == 0:
+                batches.append(current)
+                current, current_len = [], 0
+        if current:
+            batches.append(current)
+        return batches
+
+    def _hash(self, kind: str, text: str) -> str:
+        key = f"{kind}|{SUMMARY_PROMPT_VERSION}|{self.agent.model}|{text}"
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    # ---------- 执行 ----------
+
+    def _complete(self, messages: List[Dict], max_tokens: int, temperature: float = 0.3) -> str:
+        response = self.agent.client.chat.completions.create(
+            model=self.agent.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+        return response.choices[0].message.content
+
+    def _parallel(self, func: Callable, items: List[Any]) -> List[Any]:
+        """在有界线程池中按顺序执行 func(item)"""
+        if not items:
+            return []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(items), OUTLINE_MAP_CONCURRENCY)) as executor:
+            return list(executor.map(func, items))
+
+    def summarize_units(self, units: List[Dict[str, Any]]) -> List[str]:
+        """map 阶段：返回与 units 一一对应的摘要（命中缓存的不再调用模型）"""
+        cached = self.cache.get_many([u["hash"] for u in units])
+        missing = [u for u in units if u["hash"] not in cached]
+        self._report(f"共 {len(units)} 个资料片段，缓存命中 {len(units) - len(missing)} 个，需要新生成 {len(missing)} 个摘要")
+
+        done = [0]
+        lock = threading.Lock()
+
+        def summarize(unit):
+            summary = self._complete(self.build_map_messages(unit), max_tokens=1500)
+            self.cache.put(unit["hash"], unit["label"], summary)
+            with lock:
+                done[0] += 1
+                self._report(f"摘要进度 {done[0]}/{len(missing)}：{unit['label']}")
+            return summary
+
+        for unit, summary in zip(missing, self._parallel(summarize, missing)):
+            cached[unit["hash"]] = summary
+        return self._label_summaries(units, cached)
+
+    def _label_summaries(self, units: List[Dict[str, Any]], summaries_by_hash: Dict[str, str]) -> List[str]:
+        return [f"### {u['label']}\n{summaries_by_hash[u['hash']]}" for u in units]
+
+    def _merge(self, batch: List[str]) -> str:
+        """合并一箱摘要；输入未变化的箱子直接复用缓存结果"""
+        merge_hash = self._hash("merge", "\n\n".join(batch))
+        cached = self.cache.get_many([merge_hash])
+        if merge_hash in cached:
+            return cached[merge_hash]
+        merged = self._complete(self.build_merge_messages(batch), max_tokens=2000)
+        self.cache.put(merge_hash, f"合并 {len(batch)} 份摘要", merged)
+        return merged
+
+    def reduce(self, summaries: List[str], file_count: int) -> str:
+        """reduce 阶段：逐层合并直到能放进一次最终调用"""
+        level = 1
+        while len(summaries) > 1 and sum(len(s) for s in summaries) > OUTLINE_REDUCE_INPUT_CHARS:
+            batches = self.pack(summaries)
+            if len(batches) == len(summaries):
+                # 单份摘要已超出预算，继续合并也无法缩短，直接进入最终调用
+                break
+            self._report(f"第 {level} 轮合并：{len(summaries)} 份摘要 -> {len(batches)} 份")
+            summaries = self._parallel(self._merge, batches)
+            level += 1
+
+        self._report("正在生成最终大纲")
+        return self._complete(self.build_final_messages(summaries, file_count), max_tokens=self.agent._outline_max_tokens(), temperature=0.5)
+
+    def generate(self) -> str:
+        units = self.collect_units()
+        if not units:
+            return "知识库中没有已索引的内容，请先上传并处理文档。"
+        summaries = self.summarize_units(units)
+        file_count = len({u["filename"] for u in units})
+        return self.reduce(summaries, file_count)
+
+    # ---------- 异步版本（AsyncRAGAgent 使用） ----------
+
+    async def _acomplete(self, semaphore: asyncio.Semaphore, messages: List[Dict], max_tokens: int, temperature: float = 0.3) -> str:
+        async with semaphore:
+            return await self.agent._acomplete(
+                model=self.agent.model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens
+            )
+
+    async def _amerge(self, semaphore: asyncio.Semaphore, batch: List[str]) -> str:
+        merge_hash = self._hash("merge", "\n\n".join(batch))
+        cached = await asyncio.to_thread(self.cache.get_many, [merge_hash])
+        if merge_hash in cached:
+            return cached[merge_hash]
+        merged = await self._acomplete(semaphore, self.build_merge_messages(batch), max_tokens=2000)
+        await asyncio.to_thread(self.cache.put, merge_hash, f"合并 {len(batch)} 份摘要", merged)
+        return merged
+
+    async def agenerate(self) -> str:
+        """generate 的异步版本：读库与缓存放在线程池中，模型调用并发数不超过 OUTLINE_MAP_CONCURRENCY"""
+        units = await asyncio.to_thread(self.collect_units)
+        if not units:
+            return "知识库中没有已索引的内容，请先上传并处理文档。"
+
+        semaphore = asyncio.Semaphore(OUTLINE_MAP_CONCURRENCY)
+        cached = await asyncio.to_thread(self.cache.get_many, [u["hash"] for u in units])
+        missing = [u for u in units if u["hash"] not in cached]
+        self._report(f"共 {len(units)} 个资料片段，缓存命中 {len(units) - len(missing)} 个，需要新生成 {len(missing)} 个摘要")
+
+        async def summarize(unit):
+            summary = await self._acomplete(semaphore, self.build_map_messages(unit), max_tokens=1500)
+            await asyncio.to_thread(self.cache.put, unit["hash"], unit["label"], summary)
+            return summary
+
+        for unit, summary in zip(missing, await asyncio.gather(*[summarize(u) for u in missing])):
+            cached[unit["hash"]] = summary
+        summaries = self._label_summaries(units, cached)
+
+        while len(summaries) > 1 and sum(len(s) for s in summaries) > OUTLINE_REDUCE_INPUT_CHARS:
+            batches = self.pack(summaries)
+            if len(batches) == len(summaries):
+                break
+            summaries = list(await asyncio.gather(*[self._amerge(semaphore, batch) for batch in batches]))
+
+        max_tokens = await asyncio.to_thread(self.agent._outline_max_tokens)
+        file_count = len({u["filename"] for u in units})
+        return await self._acomplete(semaphore, self.build_final_messages(summaries, file_count), max_tokens=max_tokens, temperature=0.5)
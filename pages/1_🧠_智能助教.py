@@ -3,6 +3,7 @@ import time
 import base64
 import os
 import sys
+import image_preprocess
 
 # --- DEBUG LOGGING START ---
 import pkg_resources
@@ -216,13 +217,12 @@ with st.sidebar:
         key=f"uploader_{st.session_state.get('uploader_key', 0)}" 
     )
     
-    image_base64 = None
     if uploaded_file:
         st.image(uploaded_file, caption="已添加图片", use_container_width=True)
-        image_base64 = base64.b64encode(uploaded_file.getvalue()).decode('utf-8')
     
     st.markdown("---")
     if st.button("🗑️ 清空对话历史"):
+        agent.memory.reset()
         st.session_state.messages = [
             {"role": "assistant", "content": f"对话已重置。我是基于 **{selected_kb}** 的智能助教。"}
         ]
@@ -245,8 +245,9 @@ for message in st.session_state.messages:
 if prompt := st.chat_input("请输入问题..."):
     # User message
     user_msg = {"role": "user", "content": prompt}
-    if image_base64:
-        user_msg["image_base64"] = image_base64
+    if uploaded_file:
+        # 只在发送时预处理一次，避免侧边栏每次重绘都重新编码
+        user_msg["image_base64"] = image_preprocess.prepare_image_b64(uploaded_file.getvalue(), purpose="chat")
     st.session_state.messages.append(user_msg)
     
     if uploaded_file:
@@ -265,84 +266,24 @@ if st.session_state.messages and st.session_state.messages[-1]["role"] == "user"
         full_response = ""
         
         try:
-            # 检查是否是简单的选择题回答
-            is_simple_answer = len(prompt) < 10 and "选" in prompt
-            
-            # 如果不是简单回答，先检索上下文用于显示参考资料
             docs = []
-            if not is_simple_answer:
-                context_str, docs = agent.retrieve_context(prompt)
-            
-            # 使用流式输出
             with st.spinner("思考中..."):
-                # 构建消息
-                from rag_agent import RAGAgent
-                
-                # 准备上下文
-                if is_simple_answer:
-                    context = ""
-                else:
-                    context, _ = agent.retrieve_context(prompt)
-                
-                # 构建消息
-                messages = [{"role": "system", "content": agent.system_prompt}]
-                
-                # 添加历史记录（不包括当前消息）
-                if st.session_state.messages[:-1]:
-                    clean_history = []
-                    for msg in st.session_state.messages[:-1][-5:]:  # 只取最近 5 条
-                        content = msg.get("content", "")
-                        role = msg.get("role", "user")
-                        clean_history.append({"role": role, "content": content})
-                    messages.extend(clean_history)
-                
-                # 构建用户消息
-                if is_simple_answer:
-                    user_text = f"""(用户正在回答上一轮的选择题)
-学生回答：{prompt}
-请执行【作业批改】：判断对错并解析。
-"""
-                else:
-                    user_text = f"""请阅读资料回答问题。
-=== 课程资料 ===
-{context if context else "（未检索到资料，尝试基于常识回答）"}
-=== 结束 ===
-学生问题：{prompt}
-"""
-                
-                # 多模态支持
-                if current_image_data:
-                    content_payload = [
-                        {"type": "text", "text": user_text},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{current_image_data}"}}
-                    ]
-                    current_model = agent.vl_model
-                else:
-                    content_payload = user_text
-                    current_model = agent.model
-                
-                messages.append({"role": "user", "content": content_payload})
-                
-                # 流式调用 API
-                stream = agent.client.chat.completions.create(
-                    model=current_model,
-                    messages=messages,
-                    temperature=0.3,
-                    max_tokens=1500,
-                    stream=True  # 启用流式输出
+                # 单次检索：同一轮的参考资料与提示词共用一次检索结果
+                turn = agent.chat_turn(
+                    prompt,
+                    chat_history=st.session_state.messages[:-1],  # 不包括当前消息
+                    image_data=current_image_data
                 )
+                docs = turn["sources"]
                 
-                # 逐字显示
-                for chunk in stream:
-                    if not chunk.choices:
-                        continue
-                    if chunk.choices[0].delta.content is not None:
-                        full_response += chunk.choices[0].delta.content
-                        message_placeholder.markdown(full_response + "▌")
+                # 逐字显示（stream 已按行增量修复 LaTeX 格式）
+                for piece in turn["stream"]:
+                    full_response += piece
+                    message_placeholder.markdown(full_response + "▌")
                 
-                # 应用 LaTeX 格式修复
-                full_response = agent.fix_latex_format(full_response)
                 message_placeholder.markdown(full_response)
+                if turn["stats"].get("cache_hit"):
+                    st.caption(f"⚡ 复用了相似问题的回答 (相似度 {turn['stats']['similarity']:.2f})")
             
             # 显示参考资料
             if docs:
@@ -11,10 +11,12 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 import streamlit.components.v1 as components
 from rag_agent import RAGAgent
-from config import EXERCISE_TOP_K, EXERCISE_TOP_K_TOPIC
+from config import EXERCISE_TOP_K, EXERCISE_TOP_K_TOPIC, ENABLE_QUIZ_POOL, QUIZ_POOL_TARGET_DEPTH
 import ui_components
+import task_manager
 from kb_manager import KBManager
 from question_db import QuestionDB
+from quiz_pool import QuizPool, pool_variant
 
 # Inject JS for keyboard shortcut (Cmd/Ctrl + ,)
 components.html("""
@@ -135,6 +137,7 @@ st.title("📝 智能做题练习") # Title stays same
 # Initialize Managers
 kb_manager = KBManager()
 question_db = QuestionDB()
+quiz_pool = QuizPool()
 kbs = kb_manager.list_kbs()
 
 if not kbs:
@@ -187,25 +190,6 @@ if st.session_state.quiz_state == "config":
         submitted = st.form_submit_button("🚀 开始练习", type="primary")
         
         if submitted:
-            # Check KB status before starting
-            with st.spinner("正在检查知识库状态..."):
-                temp_agent = RAGAgent(kb_name=selected_kb)
-                count = temp_agent.vector_store.get_collection_count()
-                
-                # Auto-vectorization check
-                if count == 0:
-                    files = kb_manager.list_files(selected_kb)
-                    if files:
-                        st.info(f"📚 检测到知识库 '{selected_kb}' 尚未向量化，正在首次处理，请稍候...")
-                        progress_text = st.empty()
-                        kb_manager.rebuild_kb_index(selected_kb)
-                        st.success("✅ 向量化完成！")
-                        # Re-init agent
-                        temp_agent = RAGAgent(kb_name=selected_kb)
-                    else:
-                        st.error("⚠️ 该知识库为空，请先在【知识库管理】中上传文档。")
-                        st.stop()
-
             st.session_state.quiz_config = {
                 "kb": selected_kb,
                 "type": q_type_str,
@@ -215,32 +199,68 @@ if st.session_state.quiz_state == "config":
                 "blanks": num_blanks,
                 "topic": topic_refinement if topic_refinement else "Core Concepts and Key Principles"
             }
-            
-            # Initialize Agent
-            with st.spinner("正在加载智能助教..."):
-                agent = RAGAgent(kb_name=selected_kb)
+
+            # 未指定主题时优先从后台预生成的题目池取题，不足部分再现场生成
+            questions = []
+            use_pool = ENABLE_QUIZ_POOL and not topic_refinement
+            if use_pool:
+                questions = quiz_pool.take(
+                    selected_kb, format_str, q_type_str,
+                    pool_variant(format_str, num_options, num_blanks),
+                    num_questions,
+                    kb_manager.get_kb_fingerprint(selected_kb)
+                )
+
+            if len(questions) < num_questions:
+                # Check KB status before starting
+                with st.spinner("正在检查知识库状态..."):
+                    temp_agent = RAGAgent(kb_name=selected_kb)
+                    count = temp_agent.vector_store.get_collection_count()
+                    
+                    # Auto-vectorization check
+                    if count == 0:
+                        files = kb_manager.list_files(selected_kb)
+                        if files:
+                            st.info(f"📚 检测到知识库 '{selected_kb}' 尚未向量化，正在首次处理，请稍候...")
+                            progress_text = st.empty()
+                            kb_manager.rebuild_kb_index(selected_kb)
+                            st.success("✅ 向量化完成！")
+                            # Re-init agent
+                            temp_agent = RAGAgent(kb_name=selected_kb)
+                        else:
+                            st.error("⚠️ 该知识库为空，请先在【知识库管理】中上传文档。")
+                            st.stop()
+
+                agent = temp_agent
                 st.session_state.quiz_agent = agent
-            
-            # Generate Questions
-            status_text = st.empty()
-            format_name = "选择题" if format_str == "multiple_choice" else "填空题"
-            status_text.text(f"正在并行生成 {num_questions} 道{format_name}，请稍候...")
-            
-            # Use batch generation with randomization and parallelism
-            if topic_refinement:
-                 current_pool_size = EXERCISE_TOP_K_TOPIC
-            else:
-                 current_pool_size = EXERCISE_TOP_K
-                 
-            questions = agent.generate_quiz_batch(
-                count=num_questions, 
-                topic=st.session_state.quiz_config["topic"], 
-                q_type=st.session_state.quiz_config["type"],
-                question_format=format_str,
-                num_options=num_options,
-                num_blanks=num_blanks,
-                pool_size=current_pool_size
-            )
+                
+                # Generate Questions
+                remaining = num_questions - len(questions)
+                status_text = st.empty()
+                format_name = "选择题" if format_str == "multiple_choice" else "填空题"
+                status_text.text(f"正在并行生成 {remaining} 道{format_name}，请稍候...")
+                
+                # Use batch generation with randomization and parallelism
+                if topic_refinement:
+                     current_pool_size = EXERCISE_TOP_K_TOPIC
+                else:
+                     current_pool_size = EXERCISE_TOP_K
+                     
+                questions += agent.generate_quiz_batch(
+                    count=remaining, 
+                    topic=st.session_state.quiz_config["topic"], 
+                    q_type=st.session_state.quiz_config["type"],
+                    question_format=format_str,
+                    num_options=num_options,
+                    num_blanks=num_blanks,
+                    pool_size=current_pool_size
+                )
+
+            if use_pool:
+                # 后台补满题目池，下次开始练习时可直接取题
+                task_manager.start_quiz_pool_refill_task(
+                    selected_kb, format_str, q_type_str, num_options, num_blanks, QUIZ_POOL_TARGET_DEPTH
+                )
             
             if not questions:
                 st.error("生成题目失败，请重试或检查知识库内容。")
@@ -315,6 +335,14 @@ elif st.session_state.quiz_state == "quizzing":
                     
                     if is_correct:
                         st.session_state.score += 1
+                        # 答对也写入答题记录，用于正确率统计
+                        question_db.add_result(
+                            kb_name=st.session_state.quiz_config["kb"],
+                            question_data=question_data,
+                            user_answer=str(user_inputs),
+                            is_correct=True,
+                            summary=question_data.get('summary')
+                        )
                     else:
                         # Use pre-generated summary if available
                         summary = question_data.get('summary')
@@ -409,6 +437,14 @@ elif st.session_state.quiz_state == "quizzing":
                     }
                     if is_correct:
                         st.session_state.score += 1
+                        # 答对也写入答题记录，用于正确率统计
+                        question_db.add_result(
+                            kb_name=st.session_state.quiz_config["kb"],
+                            question_data=question_data,
+                            user_answer=opt,
+                            is_correct=True,
+                            summary=question_data.get('summary')
+                        )
                     else:
                         # Use pre-generated summary if available (best quality + no delay)
                         summary = question_data.get('summary')
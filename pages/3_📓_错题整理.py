@@ -1,8 +1,6 @@
 import streamlit as st
 import time
 import json
-import threading
-import base64
 import os
 import sys
 
@@ -12,6 +10,11 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 import streamlit.components.v1 as components
 from question_db import QuestionDB
+import mistake_processor
+import image_preprocess
+import image_store
+import review_scheduler
+import progress_stats
 from openai import OpenAI
 from config import OPENAI_API_KEY, OPENAI_API_BASE, VL_MODEL_NAME, MODEL_NAME
 import ui_components
@@ -190,6 +193,35 @@ st.markdown("""
 
 question_db = QuestionDB()
 
+# 排序选项 -> QuestionDB 的排序方式
+SORT_KEYS = {
+    "📅 添加时间(最新)": "newest",
+    "📅 添加时间(最早)": "oldest",
+    "🔥 陌生度(高→低)": "familiarity_desc",
+    "✨ 陌生度(低→高)": "familiarity_asc",
+    "⏰ 复习到期时间": "due"
+}
+# 列表每页题数
+PAGE_SIZE = 50
+# 错题本卡片上"错题练习"每次最多取出的到期题数
+REVIEW_SESSION_SIZE = 30
+# 学习统计显示的天数
+STATS_DAYS = 30
+# 筛选用的题型与状态
+FILTER_TYPES = {
+    "全部题型": None,
+    "单选题": "multiple_choice",
+    "多选题": "multi_select",
+    "判断题": "boolean",
+    "填空题": "fill_in_blank",
+    "解答题": "short_answer",
+    "证明题": "proof",
+    "混合题": "mixed"
+}
+FILTER_STATUSES = {"全部状态": None, "已完成": "completed", "处理中": "processing", "失败": "failed"}
+# 陌生度筛选滑块的上限，取到上限表示不限
+FAMILIARITY_SLIDER_MAX = 10
+
 # Session State 初始化
 if "view_mode" not in st.session_state:
     st.session_state.view_mode = "list"  # list: 错题本列表, detail: 错题详情
@@ -208,601 +240,6 @@ if "selected_questions" not in st.session_state:
 
 # --- Global Helper Functions & Dialogs ---
 
-def process_question_async(rid, book_name, q_c, q_o, q_correct, q_e, ocr_b64, attachment_b64, f_type):
-    try:
-        from openai import OpenAI
-        import json
-        import os
-        import re
-        from dotenv import load_dotenv
-        from question_db import QuestionDB
-        import config 
-        
-        # 强制重新加载环境变量
-        load_dotenv(override=True)
-        
-        # Fetch credentials
-        vl_key = os.getenv("VL_API_KEY") or os.getenv("OPENAI_API_KEY")
-        vl_base = os.getenv("VL_API_BASE") or os.getenv("OPENAI_API_BASE")
-        vl_model = os.getenv("VL_MODEL_NAME", "gpt-4o")
-        
-        text_key = os.getenv("OPENAI_API_KEY") or vl_key
-        text_base = os.getenv("OPENAI_API_BASE") or vl_base
-        text_model = os.getenv("MODEL_NAME", vl_model)
-
-        # Check API Key
-        if not vl_key:
-             print("Process Error: Missing API Key")
-             try:
-                 qk = QuestionDB()
-                 qk.update_result(rid, book_name, {
-                     "status": "failed", 
-                     "question": "❌ API Key 未配置", 
-                     "explanation": "后台进程无法读取 API Key。请在设置中配置。"
-                 })
-             except Exception as db_e:
-                 print(f"Failed to update DB: {db_e}")
-             return
-
-        # Initialize clients
-        vl_client = config.get_openai_client(api_key=vl_key, base_url=vl_base)
-        text_client = config.get_openai_client(api_key=text_key, base_url=text_base)
-        
-        # Helper function to clean JSON responses
-        def clean_json_string(s):
-            if not s: return "{}"
-            s = s.strip()
-            # Remove markdown code blocks
-            s = re.sub(r'^```json\s*', '', s, flags=re.MULTILINE)
-            s = re.sub(r'^```\s*', '', s, flags=re.MULTILINE)
-            s = re.sub(r'\s*```$', '', s, flags=re.MULTILINE)
-            # Extract JSON object
-            start = s.find('{')
-            end = s.rfind('}')
-            if start != -1 and end != -1:
-                s = s[start:end+1]
-            
-            # CRITICAL FIX for LaTeX in JSON:
-            # Problem: \nabla -> \n (newline) + "abla", \rho -> \r + "ho", \frac -> \f + "rac"
-            # Solution: Escape ALL backslashes, then restore only intended newlines
-            
-            # Step 1: Escape ALL backslashes (turn \ into \\)
-            s = s.replace('\\', '\\\\')
-            
-            # Step 2: Restore intended escape sequences:
-            # - \\n followed by digit, space, punctuation, or quote → real newline (\n)
-            # - \\n followed by letter → LaTeX command like \nabla, keep as \\n
-            # Same logic for \\r, \\t, etc.
-            
-            # Restore \\n → \n only when NOT followed by a letter (i.e., it's a real newline)
-            s = re.sub(r'\\\\n(?![a-zA-Z])', r'\\n', s)
-            # Restore \\r → \r only when NOT followed by a letter
-            s = re.sub(r'\\\\r(?![a-zA-Z])', r'\\r', s)
-            # Restore \\t → \t only when NOT followed by a letter  
-            s = re.sub(r'\\\\t(?![a-zA-Z])', r'\\t', s)
-            # Restore \\\\ → \\ (escaped backslash for JSON)
-            s = s.replace('\\\\\\\\', '\\\\')
-            # Restore \\" → \" (escaped quote)
-            s = s.replace('\\\\"', '\\"')
-            
-            return s
-
-        # ========== STAGE 1: PURE OCR ==========
-        print("Starting Stage 1: Pure OCR...")
-        source_text = q_c if q_c else ""
-        
-        if ocr_b64 and not source_text:
-            # Simple OCR-only prompt
-            ocr_prompt = r"""
-你是一个OCR识别专家。请将图片中的文字完整提取出来。
-
-**格式要求**：
-- 数学公式使用 LaTeX，必须用 $...$ 或 $$...$$ 包裹
-- 示例：$\sqrt{\dfrac{a^2}{b}}$ 而不是 √a²/b
-- 保持原有换行和列表格式
-- 不要添加任何解释或分析
-
-直接输出文字内容即可，不需要JSON格式。
-"""
-            try:
-                ocr_resp = vl_client.chat.completions.create(
-                    model=vl_model,
-                    messages=[
-                        {"role": "system", "content": ocr_prompt},
-                        {"role": "user", "content": [
-                            {"type": "text", "text": "请提取这张图片中的文字："},
-                            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{ocr_b64}"}}
-                        ]}
-                    ],
-                    temperature=0.1,
-                    max_tokens=2048
-                )
-                source_text = ocr_resp.choices[0].message.content.strip()
-                print(f"Stage 1 OCR Output: {source_text[:100]}...")
-            except Exception as e:
-                print(f"Stage 1 OCR Error: {e}")
-                qk = QuestionDB()
-                qk.update_result(rid, book_name, {
-                    "status": "failed",
-                    "question": "❌ OCR识别失败",
-                    "explanation": f"图像识别错误: {str(e)}"
-               })
-                return
-        
-        if not source_text:
-            print("No source text available")
-            # Update status to failed with helpful message
-            qk = QuestionDB()
-            qk.update_question_status(
-                record_id=rid,
-                question_data={"question": "❌ 未提供内容", "explanation": "请输入题目内容或上传图片"},
-                summary="❌ 未提供内容",
-                status="failed",
-                mistake_book=book_name
-            )
-            return
-
-        # ========== STAGE 2: CLASSIFICATION ==========
-        print("Starting Stage 2: Question Type Classification...")
-        detected_type = f_type if f_type else None
-        
-        if not detected_type:
-            classify_prompt = r"""
-分析以下题目文本，判断题型并输出JSON。
-
-**题型定义**：
-- multiple_choice: 单选题（ABCD选项）
-- multi_select: 多选题（多个正确答案）
-- boolean: 判断题（对错）
-- fill_in_blank: 填空题（有空格待填）
-- short_answer: 解答题/计算题
-- proof: 证明题/推导题
-- mixed: 混合题型（包含多个小题，且涉及不同类型）
-
-输出格式：{"type": "...", "confidence": "high/medium/low"}
-"""
-            try:
-                classify_resp = text_client.chat.completions.create(
-                    model=text_model,
-                    messages=[
-                        {"role": "system", "content": classify_prompt},
-                        {"role": "user", "content": f"题目文本：\n{source_text}"}
-                    ],
-                    temperature=0,
-                    max_tokens=100
-                )
-                classify_raw = classify_resp.choices[0].message.content
-                classify_res = json.loads(clean_json_string(classify_raw), strict=False)
-                detected_type = classify_res.get("type", "short_answer")
-                print(f"Stage 2 Classification: {detected_type} (confidence: {classify_res.get('confidence', 'unknown')})")
-            except Exception as e:
-                print(f"Stage 2 Classification Error: {e}, defaulting to short_answer")
-                detected_type = "short_answer"
-        
-        # ========== STAGE 3: SOLVING & GENERATION ==========
-        print(f"Starting Stage 3: Solving question (Type: {detected_type})...")
-        
-        # --- Prompt Construction ---
-        # 1. Base Instruction (Shared)
-        base_prompt = r"""
-你是一位资深的数学解题专家。你的任务是解答题目并输出标准JSON。
-
-**绝对格式规则**：
-1. **公式格式**：必须且只能使用 $...$ (行内) 或 $$...$$ (行间) 包裹。严禁使用 \[ \] 或 \( \)。
-   - ❌ [错误]: √ a^2/b 或 \[\sqrt{\dfrac{a^2}{b}}\] 或 \(\sqrt{\dfrac{a^2}{b}}\)
-   - ✅ [正确]: $\sqrt{\dfrac{a^2}{b}}$
-2. **排版格式**：`explanation` 必须分行显示，使用 `\n` 换行。
-   - ✅ [正确]: "解：\n1. 第一步...\n2. 第二步..."
-3. **必填项**：`answers` 和 `explanation` 绝不能为空。
-
-请输出 JSON:
-{
-    "summary": "知识点摘要",
-    "question": "规范化后的题目文本",
-    "explanation": "详细解析（分步骤）",
-    "answers": ["结果1", "结果2"],  // 最终答案数组。选择题留空。
-    "options": [],                // 仅选择题填写，否则为空数组 []
-    "correct_answer": ""          // 仅选择题填写，否则为空字符串
-}
-"""
-
-        # 2. Type-Specific Examples
-        type_prompts = {
-            "multiple_choice": r"""
-**当前任务**：处理【单项选择题】。
-请提取选项列表，并给出正确选项。
-
-【示例】
-Type: multiple_choice
-Text: 1+1=? A.1 B.2
-Output:
-{
-    "summary": "基础加法",
-    "question": "1+1=?",
-    "explanation": "1+1=2，所以选B。",
-    "answers": [],
-    "options": ["A. 1", "B. 2"],
-    "correct_answer": "B"
-}
-""",
-            "multi_select": r"""
-**当前任务**：处理【多项选择题】。
-请提取选项列表，并给出所有正确选项（例如 "AC"）。
-
-【示例】
-Type: multi_select
-Text: 已知集合 $A=\{1, 2, 3\}$，则下列结论正确的是？
-A. $1 \in A$
-B. $4 \in A$
-C. $\{1, 2\} \subseteq A$
-D. $\emptyset \in A$
-Output:
-{
-    "summary": "集合的性质",
-    "question": "已知集合 $A=\{1, 2, 3\}$，则下列结论正确的是？",
-    "explanation": "解：\n1. 元素1在集合A中，故A正确。\n2. 元素4不在集合A中，故B错误。\n3. $\{1, 2\}$是A的子集，故C正确。\n4. 空集是任意集合的子集，但不是A的元素，故D错误。\n综上选AC。",
-    "answers": [],
-    "options": ["A. $1 \\in A$", "B. $4 \\in A$", "C. $\{1, 2\} \\subseteq A$", "D. $\\emptyset \\in A$"],
-    "correct_answer": "AC"
-}
-""",
-            "boolean": r"""
-**当前任务**：处理【判断题】。
-请判断对错。正确填"True"，错误填"False"（作为 correct_answer）。
-
-【示例】
-Type: boolean
-Text: 函数 $f(x) = x^2$ 是奇函数。
-Output:
-{
-    "summary": "函数奇偶性",
-    "question": "函数 $f(x) = x^2$ 是奇函数。",
-    "explanation": "解：\n1. 定义域为 R。\n2. 计算 $f(-x) = (-x)^2 = x^2 = f(x)$。\n3. 满足偶函数定义，故不是奇函数。\n4. 题干说法错误。",
-    "answers": [],
-    "options": [],
-    "correct_answer": "False"
-}
-""",
-            "mixed": r"""
-**当前任务**：处理【混合题型】。
-此类题目通常包含填空、选择、计算等多个部分，或者结构复杂。
-请生成完整的题目文本和详细解析。
-`answers` 字段请填 `["见解析"]`。
-
-【示例】
-Type: mixed
-Text: (1)填空：... (2)计算：...
-Output:
-{
-    "summary": "综合练习",
-    "question": "完整题目...",
-    "explanation": "详解...",
-    "answers": ["见解析"],
-    "options": [],
-    "correct_answer": ""
-}
-""",
-            "fill_in_blank": r"""
-**当前任务**：处理【填空题】。
-请计算出结果填入 `answers` 数组。
-
-**答案格式规则**：
-1. **数学公式必须用LaTeX**：用 $...$ 包裹，如 `$x^2+1$`
-
-2. **多个空格**：每个空格一个数组元素，用换行区分
-   - 示例：`["第一空答案", "第二空答案"]`
-
-3. **多解（任选一个）**：用 | 或 ｜ 分隔备选答案
-   - 示例：`["答案A｜答案B｜答案C"]` （用户填任何一个都算对）
-
-4. **一个答案包含多个部分**：直接作为整体写入
-   - 示例：`["$x=1, y=2$"]` 或 `["$\\alpha=30°, \\beta=60°$"]`
-
-【示例1：单空题】
-Type: fill_in_blank
-Text: 勾股定理公式是____。
-Output:
-{
-    "summary": "勾股定理",
-    "question": "勾股定理公式是____。",
-    "explanation": "直角三角形两条直角边的平方和等于斜边的平方。",
-    "answers": ["$a^2+b^2=c^2$"],
-    "options": [],
-    "correct_answer": ""
-}
-
-【示例2：多空题】
-Type: fill_in_blank
-Text: 求解方程组：(1) x+y=5的一组解是x=____，y=____。(2) 2x=10，则x=____。
-Output:
-{
-    "summary": "方程组求解",
-    "question": "求解方程组：(1) x+y=5的一组解是x=____，y=____。(2) 2x=10，则x=____。",
-    "explanation": "解：\n1. (1)可以是x=1,y=4或x=2,y=3等\n2. (2)解得x=5",
-    "answers": ["1｜2｜3", "4｜3｜2", "5"],
-    "options": [],
-    "correct_answer": ""
-}
-
-【示例3：一个空多个值都要写】
-Type: fill_in_blank
-Text: 方程$x^2-1=0$的解为____。
-Output:
-{
-    "summary": "一元二次方程",
-    "question": "方程$x^2-1=0$的解为____。",
-    "explanation": "解：$x^2=1$，故$x=\\pm 1$，即$x_1=1, x_2=-1$",
-    "answers": ["$x_1=1, x_2=-1$｜$x=\\pm 1$"],
-    "options": [],
-    "correct_answer": ""
-}
-""",
-            "short_answer": r"""
-**当前任务**：处理【解答题/计算题】。
-请给出详细推导过程和**最终答案**。
-
-**答案格式规则**：
-1. **数学公式必须用LaTeX**：用 $...$ 包裹，如 `$x^2+1$`
-
-2. **多个小题**：每一问一个数组元素 `["第一问", "第二问"]`
-
-3. **多解（任选一个）**：用 | 或 ｜ 分隔 `["答案A｜答案B"]`
-
-4. **一个答案包含多个部分**：作为整体 `["$x=1, y=2$"]`
-
-**重要**：`answers`数组必须包含最终结果，不能为空！如果有多问，每一问都要填入。
-
-【示例】
-Type: short_answer
-Text: 解方程 $x^2 - 1 = 0$
-Output:
-{
-    "summary": "一元二次方程求解",
-    "question": "解方程 $x^2 - 1 = 0$",
-    "explanation": "解：\n1. 移项得 $x^2=1$。\n2. 开平方得 $x=\pm 1$。\n3. 即 $x_1=1, x_2=-1$。",
-    "answers": ["$x=\\pm 1$｜$x_1=1, x_2=-1$"],
-    "options": [],
-    "correct_answer": ""
-}
-""",
-            "proof": r"""
-**当前任务**：处理【证明题】。
-请仅生成解析，`answers` 填 `["见解析"]`。
-
-【示例】
-Type: proof
-Text: 求证：对顶角相等。
-Output:
-{
-    "summary": "几何基础",
-    "question": "求证：对顶角相等。",
-    "explanation": "证明：设直线AB、CD相交于O...\n所以 $\angle AOC = \angle BOD$。",
-    "answers": ["见解析"],
-    "options": [],
-    "correct_answer": ""
-}
-"""
-        }
-
-        # 3. Assemble Prompt
-        # Default to short_answer if type unknown
-        specific_prompt = type_prompts.get(detected_type, type_prompts["short_answer"])
-        sys_prompt_2 = base_prompt + "\n" + specific_prompt
-        user_content = f"【题目文本】:\n{source_text}\n\n【题型】: {detected_type}\n"
-        if q_correct:
-            user_content += f"【用户提供的答案】: {q_correct}\n"
-        
-        msgs_2 = [{"role": "system", "content": sys_prompt_2}]
-        payload_2 = [{"type": "text", "text": user_content}]
-        if attachment_b64: # Context image
-            payload_2.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{attachment_b64}"}})
-        
-        msgs_2.append({"role": "user", "content": payload_2}) # type: ignore
-        # CRITICAL: Force complete generation
-        msgs_2.append({"role": "user", "content": """
-【重要】你必须输出完整的JSON，包含所有字段：
-- summary (必填)
-- question (必填)  
-- explanation (必填，不能为空，必须有详细步骤)
-- answers (必填，不能为空数组)
-- options
-- correct_answer
-
-不要在生成question后就停止！必须继续生成explanation和answers！
-"""})
-
-        # Retry mechanism for Stage 3
-        max_retries = 3
-        res_2 = {}
-        
-        for attempt in range(max_retries):
-            try:
-                print(f"Stage 3 Generation (Attempt {attempt+1}/{max_retries})...")
-                resp_2 = vl_client.chat.completions.create(
-                    model=vl_model,
-                    messages=msgs_2, # type: ignore
-                    temperature=0.3 + (attempt * 0.1),
-                    max_tokens=4096
-                    # Removed response_format to avoid premature termination
-                )
-                raw_2 = resp_2.choices[0].message.content
-                print(f"Stage 3 Raw Output (first 200 chars): {raw_2[:200]}...")
-                print(f"Stage 3 Raw Output (last 200 chars): ...{raw_2[-200:]}")
-                print(f"Stage 3 Output length: {len(raw_2)} characters") 
-                
-                try:
-                    cleaned = clean_json_string(raw_2)
-                    print(f"Cleaned JSON (first 300 chars): {cleaned[:300]}")
-                    curr_res = json.loads(cleaned, strict=False)
-                    print(f"Parse SUCCESS! Keys: {list(curr_res.keys())}")
-                    print(f"explanation present: {bool(curr_res.get('explanation'))}")
-                    print(f"answers present: {bool(curr_res.get('answers'))}")
-                except Exception as parse_err:
-                    print(f"JSON Parse Error: {parse_err}")
-                    curr_res = {}
-                
-                # --- Validation Logic ---
-                is_valid = True
-                missing_fields = []
-                
-                # 1. Check Explanation (Required for all types)
-                if not curr_res.get("explanation") or len(str(curr_res.get("explanation", ""))) < 5:
-                    # 对于 proof 题，explanation 是核心；对于其他题也很重要
-                    is_valid = False
-                    missing_fields.append("explanation")
-                    print(f"Explanation validation failed. Value: {curr_res.get('explanation', 'N/A')[:50]}")
-                
-                # 2. Check Answer based on type
-                dt = detected_type
-                if dt in ["multiple_choice", "multi_select", "boolean"]:
-                    if not curr_res.get("correct_answer"):
-                        is_valid = False
-                        missing_fields.append("correct_answer")
-                elif dt in ["fill_in_blank", "short_answer"]:
-                    # Must have answers array
-                    ans = curr_res.get("answers")
-                    if not ans or not isinstance(ans, list) or len(ans) == 0:
-                         is_valid = False
-                         missing_fields.append("answers")
-                         print(f"Answers validation failed. Value: {ans}")
-                # proof / mixed types check skipped for answers
-                
-                if is_valid:
-                    res_2 = curr_res
-                    print("Stage 3 Validation Passed.")
-                    break
-                else:
-                    print(f"Stage 3 Validation Failed. Missing: {missing_fields}")
-                    res_2 = curr_res # Keep it anyway in case we run out of retries
-                    
-                    if attempt < max_retries - 1:
-                        # Add feedback for next retry
-                        feedback_msg = f"上一次生成缺失了以下必须字段: {', '.join(missing_fields)}。请务必补充完整。"
-                        # Append textual feedback to history
-                        msgs_2.append({"role": "assistant", "content": raw_2}) 
-                        msgs_2.append({"role": "user", "content": f"请重新生成。注意：{feedback_msg}"})
-            
-            except Exception as e:
-                print(f"Stage 3 Error (Attempt {attempt+1}): {e}")
-                res_2 = {} # Clear on crash
-
-        # --- Post-Processing ---
-        final_question = q_c if q_c else res_2.get("question", source_text)
-        final_explanation = q_e if q_e else res_2.get("explanation", "")
-        
-        ai_options = res_2.get("options", [])
-        
-        # Options Logic
-        if q_o:
-            final_options = q_o
-        else:
-            if detected_type in ["multiple_choice", "multi_select", "boolean"] and ai_options:
-                final_options = "\n".join(ai_options)
-            elif detected_type == "fill_in_blank" and ai_options: 
-                 final_options = "\n".join(ai_options)
-                 detected_type = "multiple_choice"
-            elif detected_type == "boolean":
-                 # Ensure standard True/False options if missing
-                 final_options = "True\nFalse"
-            else:
-                final_options = ""
-
-        # Helper for mapping various formats to Uppercase Letters
-        def _map_to_letter(s):
-            s = s.strip()
-            mapping = {
-                '1': 'A', '１': 'A', 'I': 'A', '甲': 'A', '对': 'T', 'T': 'T', 'True': 'T', 'TRUE': 'T', '√': 'T',
-                '2': 'B', '２': 'B', 'II': 'B', '乙': 'B', '错': 'F', 'F': 'F', 'False': 'F', 'FALSE': 'F', '×': 'F',
-                '3': 'C', '３': 'C', 'III': 'C', '丙': 'C',
-                '4': 'D', '４': 'D', 'IV': 'D', '丁': 'D',
-                '5': 'E', '５': 'E', 'V': 'E', '戊': 'E'
-            }
-            # Special Boolean handling if detected type is boolean
-            if detected_type == "boolean":
-                if s in ['A', 'T', 't', '1', '对', '√', 'True', 'TRUE']: return "True"
-                if s in ['B', 'F', 'f', '0', '错', '×', 'False', 'FALSE']: return "False"
-            
-            return mapping.get(s, s.upper())
-
-        # Answer Logic
-        # Answer Logic
-        final_correct = ""
-        ans_list = []
-        
-        # Determine final_correct string based on user input or AI output
-        if q_correct:
-            raw_correct = q_correct
-        else:
-            raw_correct = res_2.get("correct_answer", "")
-            
-        # Special handling for fill_in_blank encoding
-        if detected_type == "fill_in_blank":
-             if q_correct:
-                 # If user provided answer manually, split by any newline type (hard or soft)
-                 # splitlines() handles \n, \r, \r\n, \u2028 (Line Separator), etc.
-                 cleaned = q_correct.strip()
-                 # Check if there are multiple lines
-                 lines = [line.strip() for line in cleaned.splitlines() if line.strip()]
-                 
-                 if len(lines) > 1:
-                     ans_list = lines
-                 else:
-                     ans_list = [cleaned]
-             else:
-                 # Use AI generated answers array
-                 ans_list = res_2.get("answers", [])
-                 # Fallback to correct_answer string if answers array is empty
-                 if not ans_list and raw_correct:
-                     ans_list = [raw_correct]
-             
-             # Encode into final_options/correct_answer using the protocol
-             if ans_list:
-                 final_options = "FILL_IN_BLANK:" + json.dumps(ans_list, ensure_ascii=False)
-                 final_correct = "FILL_IN_BLANK"
-             else:
-                 final_options = ""
-                 final_correct = ""
-        
-        else:
-            # For other types (MC, boolean, short_answer, etc.)
-            final_correct = raw_correct
-            if detected_type in ["multiple_choice", "boolean"]:
-                  final_correct = _map_to_letter(final_correct)
-        
-        # Multi-select normalization fallback
-        # Note: Use final_correct (not q_correct) to normalize AI-generated answers too
-        if detected_type == "multi_select" and final_correct:
-             cleaned = final_correct.replace('，', ',').replace('|', ',').replace(' ', ',')
-             # Check if it looks like "13" (digits string) or just comma separated
-             if ',' not in cleaned and len(cleaned) > 1:
-                # Treat "13" as "1", "3"
-                final_parts = [_map_to_letter(c) for c in cleaned]
-             else:
-                parts = [p.strip() for p in cleaned.split(',') if p.strip()]
-                final_parts = [_map_to_letter(p) for p in parts]
-             
-             final_correct = ", ".join(sorted(list(set(final_parts)))) # Sort and Dedup
-
-        # Save
-        q_data = {
-            "question_type": detected_type,
-            "question": final_question,
-            "options": final_options.split('\n') if final_options and "FILL_IN_BLANK" not in final_options else [],
-            "answers": json.loads(final_options[14:]) if final_options and "FILL_IN_BLANK" in final_options else (res_2.get("answers", []) if detected_type in ["short_answer", "fill_in_blank"] else None),
-            "correct_answer": final_correct if "FILL_IN_BLANK" not in str(final_correct) else None,
-            "explanation": final_explanation
-        }
-        if attachment_b64: q_data["image"] = attachment_b64
-        
-        final_summary = res_2.get("summary", final_question[:20])
-        question_db.update_question_status(record_id=rid, question_data=q_data, summary=final_summary, status="completed", mistake_book=book_name)
-        
-    except Exception as e:
-        print(f"Process Error: {e}")
-        error_msg = str(e)
-        if "os" in error_msg: error_msg = "System Error (Import)"
-        question_db.update_question_status(record_id=rid, status="failed", mistake_book=book_name)
-
 @st.dialog("重命名错题本", width="small")
 def rename_book_dialog(old_name):
     st.markdown(f"✍️ 正在重命名: **{old_name}**")
@@ -883,12 +320,8 @@ def mistake_detail_dialog(item, book_name, is_archived):
         st.markdown(f"### 题目")
         if q.get("image"):
             try:
-                # Decide if base64 or url (assuming base64 for now as per adder)
-                img_data = q.get("image")
-                if img_data.startswith("http"):
-                    st.image(img_data)
-                else:
-                    st.image(base64.b64decode(img_data))
+                # Stored reference, URL or legacy inline base64
+                st.image(image_store.resolve_image(q.get("image")))
             except:
                 st.warning("图片加载失败")
                 
@@ -944,7 +377,7 @@ def mistake_detail_dialog(item, book_name, is_archived):
         curr_img = q.get("image")
         if curr_img:
             st.markdown("current image:")
-            try: st.image(base64.b64decode(curr_img), width=200)
+            try: st.image(image_store.resolve_image(curr_img, thumbnail=True), width=200)
             except: st.text("Image Error")
             if st.button("🗑️ 删除图片", key=f"del_img_{item['id']}"):
                 q["image"] = None
@@ -953,7 +386,7 @@ def mistake_detail_dialog(item, book_name, is_archived):
         new_img_file = st.file_uploader("更换/上传图片", type=["png", "jpg", "jpeg"], key=f"up_img_edit_{item['id']}")
         new_img_b64 = curr_img
         if new_img_file:
-             new_img_b64 = base64.b64encode(new_img_file.getvalue()).decode('utf-8')
+             new_img_b64 = image_preprocess.prepare_image_b64(new_img_file.getvalue(), purpose="attachment")
         
         if new_type in ["multiple_choice", "multi_select", "boolean"]:
             # If switching, handle missing options
@@ -1045,9 +478,7 @@ def batch_view_dialog(items):
         # Batch View Image Support
         if q.get("image"):
              try:
-                b_img = q.get("image")
-                if b_img.startswith("http"): st.image(b_img, width=300)
-                else: st.image(base64.b64decode(b_img), width=300)
+                st.image(image_store.resolve_image(q.get("image"), thumbnail=True), width=300)
              except: st.error("图片加载错")
 
         st.info(q.get("question", "（无内容）"))
@@ -1074,6 +505,33 @@ def batch_view_dialog(items):
         st.session_state.active_dialog_type = None
         st.rerun()
 
+@st.dialog("🛠️ 批量操作", width="small")
+def batch_manage_dialog(record_ids, book_name):
+    st.markdown(f"已选择 **{len(record_ids)}** 道题目")
+
+    st.markdown("##### 📂 移动到其他错题本")
+    other_books = [name for name in question_db.list_mistake_books(include_archived=False) if name != book_name]
+    if other_books:
+        target = st.selectbox("目标错题本", other_books, key="bm_target")
+        if st.button("移动", use_container_width=True, key="bm_move"):
+            moved = question_db.bulk_move(record_ids, target)
+            st.session_state.selected_questions = set()
+            st.toast(f"已移动 {moved} 道题目到「{target}」")
+            time.sleep(0.5)
+            st.rerun()
+    else:
+        st.caption("没有其他未归档的错题本")
+
+    st.divider()
+    st.markdown("##### 📊 重置陌生度")
+    score = st.slider("陌生度", min_value=0, max_value=5, value=2, key="bm_score")
+    if st.button("重置", use_container_width=True, key="bm_reset"):
+        updated = question_db.bulk_reset_score(record_ids, score)
+        st.session_state.selected_questions = set()
+        st.toast(f"已将 {updated} 道题目的陌生度设为 {score}")
+        time.sleep(0.5)
+        st.rerun()
+
 @st.dialog("➕ 添加错题", width="large")
 def add_mistake_dialog(selected_book):
     # Custom CSS to center file uploaders and adjust layout
@@ -1127,8 +585,8 @@ def add_mistake_dialog(selected_book):
             
             i_d = {"question": i_q, "explanation": q_e if q_e else "（处理中...）"}
             
-            ocr_b64 = base64.b64encode(u_ocr.getvalue()).decode('utf-8') if u_ocr else None
-            fig_b64 = base64.b64encode(u_fig.getvalue()).decode('utf-8') if u_fig else None
+            ocr_b64 = image_preprocess.prepare_image_b64(u_ocr.getvalue(), purpose="ocr") if u_ocr else None
+            fig_b64 = image_preprocess.prepare_image_b64(u_fig.getvalue(), purpose="attachment") if u_fig else None
             
             # Request 1: Only use figure if explicitly provided (No fallback to OCR)
             final_attachment = fig_b64 
@@ -1140,14 +598,16 @@ def add_mistake_dialog(selected_book):
                 user_answer="（手动添加）",
                 is_correct=False,
                 summary=i_q[:20],
-                mistake_book=target
+                mistake_book=target,
+                status="processing"
             )
             
-            # Auto detection mode (None)
-            f_type = None 
-            
-            # Pass normalized answer to backend
-            threading.Thread(target=process_question_async, args=(rid, target, q_c, q_o, normalized_answer, q_e, ocr_b64, final_attachment, f_type), daemon=True).start()
+            # Pass normalized answer to backend (question type: auto detection)
+            mistake_processor.enqueue_mistake(
+                rid, target,
+                question=q_c, options=q_o, correct_answer=normalized_answer, explanation=q_e,
+                ocr_image=ocr_b64, attachment_image=final_attachment
+            )
             st.session_state.active_dialog_type = None  # Clear dialog state
             st.success("✅ 已添加，正在处理..."); time.sleep(1.0); st.rerun()
         else: st.error("请提供内容或图片")
@@ -1175,6 +635,46 @@ if st.session_state.view_mode == "list":
         if st.button(btn_label, use_container_width=True):
             st.session_state.show_archived_books = not st.session_state.show_archived_books
             st.rerun()
+    
+    # 学习统计（读按天汇总的统计表，不扫描答题记录）
+    with st.expander(f"📈 学习统计（近 {STATS_DAYS} 天）"):
+        since = progress_stats.stat_day(time.time() - (STATS_DAYS - 1) * 86400)
+        practice_by_day = {r["day"]: r for r in question_db.get_practice_stats(since=since)}
+        review_by_day = {r["day"]: r for r in question_db.get_review_stats(since=since)}
+        attempts = sum(r["attempts"] for r in practice_by_day.values())
+        correct = sum(r["correct"] for r in practice_by_day.values())
+        reviews = sum(r["reviews"] for r in review_by_day.values())
+        review_correct = sum(r["correct"] for r in review_by_day.values())
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("练习作答", attempts, help="做题练习中提交的答案数")
+        m2.metric("练习正确率", f"{correct / attempts:.0%}" if attempts else "-")
+        m3.metric("错题复习", reviews, help=f"其中答对 {review_correct} 次")
+        m4.metric("新增错题", sum(r["added"] for r in review_by_day.values()))
+        if practice_by_day or review_by_day:
+            days = sorted(set(practice_by_day) | set(review_by_day))
+            st.bar_chart(
+                {
+                    "日期": days,
+                    "练习": [practice_by_day.get(d, {}).get("attempts", 0) for d in days],
+                    "复习": [review_by_day.get(d, {}).get("reviews", 0) for d in days],
+                },
+                x="日期", y=["练习", "复习"]
+            )
+            type_labels = {v: k for k, v in FILTER_TYPES.items() if v}
+            st.dataframe(
+                [
+                    {
+                        "题型": type_labels.get(r["question_type"], r["question_type"] or "未知"),
+                        "作答": r["attempts"],
+                        "正确率": f"{r['correct'] / r['attempts']:.0%}" if r["attempts"] else "-",
+                    }
+                    for r in question_db.get_practice_stats(since=since, group_by="question_type")
+                ],
+                use_container_width=True,
+                hide_index=True
+            )
+        else:
+            st.caption("暂无记录")
             
     show_archived = st.session_state.show_archived_books
     
@@ -1209,10 +709,9 @@ if st.session_state.view_mode == "list":
                             st.markdown(f"<div style='text-align: center; font-size: 1.25rem; margin-bottom: 5px;'><b>{icon} {book_name}</b></div>", unsafe_allow_html=True)
         
                             # Row 2: Statistics
-                            questions = question_db.get_wrong_questions(mistake_book=book_name)
-                            active_count = len([q for q in questions if not q.get("archived", False)])
-                            archived_count = len([q for q in questions if q.get("archived", False)])
-                            st.markdown(f"<div style='text-align: center; color: #666; font-size: 0.85rem; margin-bottom: 12px;'>📝 未归档: <b>{active_count}</b> &nbsp;|&nbsp; 📦 已归档: <b>{archived_count}</b></div>", unsafe_allow_html=True)
+                            counts = question_db.get_book_counts(book_name)
+                            active_count, archived_count, due_count = counts["active"], counts["archived"], counts["due"]
+                            st.markdown(f"<div style='text-align: center; color: #666; font-size: 0.85rem; margin-bottom: 12px;'>📝 未归档: <b>{active_count}</b> &nbsp;|&nbsp; 📦 已归档: <b>{archived_count}</b> &nbsp;|&nbsp; ⏰ 待复习: <b>{due_count}</b></div>", unsafe_allow_html=True)
                             
                             st.divider()
                             
@@ -1229,15 +728,12 @@ if st.session_state.view_mode == "list":
                                         st.session_state.active_dialog_type = None
                                         st.rerun()
                                 with c_quiz:
-                                    if st.button("错题练习", key=f"review_{book_name}", use_container_width=True):
+                                    if st.button("错题练习", key=f"review_{book_name}", use_container_width=True, help="按复习计划练习已到期的错题"):
                                         st.session_state.selected_mistake_book = book_name
                                         st.session_state.view_mode = "detail"
                                         st.session_state.mistake_mode = "quiz"
                                         st.session_state.mistake_index = 0
-                                        _all = question_db.get_wrong_questions(mistake_book=book_name)
-                                        _active = [q for q in _all if not q.get("archived", False)]
-                                        _active = _active[::-1] 
-                                        st.session_state.quiz_ids = [q['id'] for q in _active]
+                                        st.session_state.quiz_ids = question_db.list_due_ids(book_name, limit=REVIEW_SESSION_SIZE)
                                         for k in list(st.session_state.keys()):
                                             if k.startswith(("mistake_answered_", "mistake_blanks_", "mq_radio_", "score_res_")):
                                                 del st.session_state[k]
@@ -1293,20 +789,15 @@ elif st.session_state.view_mode == "detail":
         
         # Row 2: Title and Stats
         selected_book = st.session_state.selected_mistake_book
-        # 获取错题数据用于统计
-        wrong_questions = question_db.get_wrong_questions(mistake_book=selected_book)
-        st.markdown(f"#### 📚 当前错题本：{selected_book} | 共 {len(wrong_questions)} 道错题")
+        # 只查询统计数字，题目按页加载
+        book_counts = question_db.get_book_counts(selected_book)
+        st.markdown(f"#### 📚 当前错题本：{selected_book} | 共 {book_counts['total']} 道错题")
     else:
         selected_book = st.session_state.selected_mistake_book
-        wrong_questions = question_db.get_wrong_questions(mistake_book=selected_book)
+        book_counts = question_db.get_book_counts(selected_book)
     
     # 检查是否有处理中的题目
-    has_processing = False
-    if wrong_questions:
-        has_processing = any(item.get("status", "completed") == "processing" for item in wrong_questions)
-
-    if wrong_questions:
-        has_processing = any(item.get("status", "completed") == "processing" for item in wrong_questions)
+    has_processing = book_counts["processing"] > 0
 
 # Callbacks for Batch Actions (Defined here to access closure variables effectively if needed, 
 # or use st.session_state)
@@ -1326,8 +817,8 @@ def cb_ba_cancel():
     st.session_state.active_dialog_type = None
 
 def cb_ba_archive(sel_qs_arg, book_arg):
-    for qid in sel_qs_arg: 
-        question_db.toggle_archive(qid, mistake_book=book_arg)
+    # Selection comes from one view: archive it in the normal view, restore it in the archive view
+    question_db.bulk_set_archived(sel_qs_arg, archived=not st.session_state.get("view_archived", False))
     st.session_state.selected_questions = set()
     st.session_state.active_dialog_id = None
     st.session_state.active_dialog_type = None
@@ -1354,8 +845,7 @@ if st.session_state.view_mode == "detail" and st.session_state.mistake_mode == "
     elif active_type == "batch" and active_id == "batch_view":
         # Batch View Mode
         sel_qs = st.session_state.get('selected_questions', set())
-        cur_all_qs = question_db.get_wrong_questions(mistake_book=selected_book)
-        _selected_items = [q for q in cur_all_qs if q['id'] in sel_qs]
+        _selected_items = question_db.get_questions(sel_qs)
         if _selected_items:
             batch_view_dialog(_selected_items)
         else:
@@ -1365,7 +855,7 @@ if st.session_state.view_mode == "detail" and st.session_state.mistake_mode == "
             
     elif active_id: # Default to single if ID exists and type is None or 'single'
          # Single Detail Mode
-        target_item = next((q for q in wrong_questions if q['id'] == active_id), None)
+        target_item = question_db.get_question(active_id)
         if target_item:
             v_arch = st.session_state.get("view_archived", False)
             mistake_detail_dialog(target_item, selected_book, v_arch)
@@ -1376,19 +866,47 @@ if st.session_state.view_mode == "detail" and st.session_state.mistake_mode == "
             
     # 如果有处理中的题目，显示提示和刷新按钮
     if has_processing:
+        queue_info = mistake_processor.queue_status()
         col_info, col_refresh = st.columns([3, 1])
         with col_info:
-            st.info("⏳ 检测到有题目正在后台处理中，请稍候...")
+            st.info(f"⏳ 检测到有题目正在后台处理中，请稍候... （处理中 {queue_info['running']} 道，排队 {queue_info['queued']} 道）")
         with col_refresh:
             if st.button("🔄 刷新状态", key="refresh_processing_top"):
                 st.rerun()
+        if queue_info["stages"]:
+            with st.expander("⏱️ 各阶段耗时（最近完成的题目）"):
+                st.dataframe(
+                    [
+                        {"阶段": label, "次数": count, "平均(s)": round(avg, 1), "最长(s)": round(longest, 1)}
+                        for label, count, avg, longest in queue_info["stages"]
+                    ],
+                    use_container_width=True,
+                    hide_index=True
+                )
+                st.caption("按流水线模式统计（每题平均）")
+                st.dataframe(
+                    [
+                        {
+                            "模式": r["pipeline"],
+                            "题数": r["count"],
+                            "端到端(s)": round(r["end_to_end"], 1),
+                            "处理(s)": round(r["processing"], 1),
+                            "调用次数": round(r["llm_calls"], 1),
+                            "输入token": round(r["prompt_tokens"]),
+                            "输出token": round(r["completion_tokens"]),
+                            "免判断题型": f"{r['classify_skipped']:.0%}",
+                        }
+                        for r in mistake_processor.pipeline_report()
+                    ],
+                    use_container_width=True,
+                    hide_index=True
+                )
     
     # 获取归档错题数量
-    archived_questions = question_db.get_archived_questions(mistake_book=selected_book)
-    archived_count = len(archived_questions)
+    archived_count = book_counts["archived"]
     
     # 如果错题本为空，显示提示信息
-    if not wrong_questions:
+    if book_counts["total"] == 0:
         st.info(f"🎉 太棒了！错题本「{selected_book}」是空的。可以手动添加错题或去【做题练习】！")
         if archived_count > 0:
             st.info(f"📦 该错题本有 {archived_count} 道已归档的题目")
@@ -1405,7 +923,7 @@ if st.session_state.view_mode == "detail" and st.session_state.mistake_mode == "
         st.markdown("---")
 
     else:
-        st.markdown(f"### 共 {len(wrong_questions)} 道错题")
+        st.markdown(f"### 共 {book_counts['total']} 道错题")
         # Row 3: Control Buttons (Same style/size)
         c_r3_1, c_r3_2, c_r3_3, c_r3_4 = st.columns(4)
         with c_r3_1:
@@ -1414,17 +932,9 @@ if st.session_state.view_mode == "detail" and st.session_state.mistake_mode == "
                 st.session_state.active_dialog_id = None  # Clear dialog state
                 
                 # Initialize Quiz Queue
-                _all = question_db.get_wrong_questions(mistake_book=selected_book)
-                _active = [q for q in _all if not q.get("archived", False)]
-                
                 # Apply current sort order
                 s_opt = st.session_state.get("quiz_sort_order", "📅 添加时间(最新)")
-                # Database returns DESC (newest first), so "最早" needs reverse
-                if s_opt == "📅 添加时间(最早)": _active = _active[::-1]
-                elif s_opt == "🔥 陌生度(高→低)": _active.sort(key=lambda x: x.get("familiarity_score", 0), reverse=True)
-                elif s_opt == "✨ 陌生度(低→高)": _active.sort(key=lambda x: x.get("familiarity_score", 0))
-                
-                st.session_state.quiz_ids = [q['id'] for q in _active]
+                st.session_state.quiz_ids = question_db.list_question_ids(selected_book, sort=SORT_KEYS.get(s_opt, "newest"), archived=False)
                 
                 # Reset quiz states
                 for k in list(st.session_state.keys()):
@@ -1432,12 +942,12 @@ if st.session_state.view_mode == "detail" and st.session_state.mistake_mode == "
                         del st.session_state[k]
                 st.rerun()
         with c_r3_2:
-            sort_modes = ["📅 时间(最新)", "📅 时间(最早)", "🔥 陌生(高→低)", "✨ 陌生(低→高)"]
+            sort_modes = ["📅 时间(最新)", "📅 时间(最早)", "🔥 陌生(高→低)", "✨ 陌生(低→高)", "⏰ 到期时间"]
             if "sort_idx" not in st.session_state: st.session_state.sort_idx = 0
             if st.button(f"🔄 顺序: {sort_modes[st.session_state.sort_idx]}", use_container_width=True, key="tb_sort"):
                 st.session_state.active_dialog_id = None  # Clear dialog state
                 st.session_state.sort_idx = (st.session_state.sort_idx + 1) % len(sort_modes)
-                st.session_state.quiz_sort_order = ["📅 添加时间(最新)", "📅 添加时间(最早)", "🔥 陌生度(高→低)", "✨ 陌生度(低→高)"][st.session_state.sort_idx]
+                st.session_state.quiz_sort_order = list(SORT_KEYS)[st.session_state.sort_idx]
                 st.rerun()
         with c_r3_3:
             v_arch = st.session_state.get("view_archived", False)
@@ -1453,10 +963,9 @@ if st.session_state.view_mode == "detail" and st.session_state.mistake_mode == "
                     if not sel:
                         st.toast("⚠️ 请先勾选要删除的题目")
                     else:
-                        for qid in list(sel):
-                            question_db.remove_wrong_question(qid, mistake_book=selected_book)
+                        deleted = question_db.bulk_delete(sel)
                         st.session_state.selected_questions = set()
-                        st.success(f"已删除 {len(sel)} 道题目")
+                        st.success(f"已删除 {deleted} 道题目")
                         time.sleep(1.0)
                         st.rerun()
             else:
@@ -1467,18 +976,33 @@ if st.session_state.view_mode == "detail" and st.session_state.mistake_mode == "
                     st.rerun() 
 
 
+        # Current filters (archive view + filter panel), applied in SQL; search text goes through full-text search
+        v_arch = st.session_state.get("view_archived", False)
+        search_text = st.session_state.get("search_text", "").strip()
+        list_filters = {"archived": v_arch}
+        flt_fam = st.session_state.get("flt_fam", (0, FAMILIARITY_SLIDER_MAX))
+        list_filters.update({
+            "question_type": FILTER_TYPES.get(st.session_state.get("flt_type")),
+            "status": FILTER_STATUSES.get(st.session_state.get("flt_status")),
+            "min_familiarity": flt_fam[0] or None,
+            "max_familiarity": flt_fam[1] if flt_fam[1] < FAMILIARITY_SLIDER_MAX else None,
+        })
+
         # Row 4: Batch Actions (Below, same style/size)
-        c_r4_1, c_r4_2, c_r4_3, c_r4_4 = st.columns(4)
-        if v_arch: cur_list = [q for q in wrong_questions if q.get("archived", False)]
-        else: cur_list = [q for q in wrong_questions if not q.get("archived", False)]
+        c_r4_1, c_r4_2, c_r4_3, c_r4_4, c_r4_5 = st.columns(5)
         
         sel_qs = st.session_state.get('selected_questions', set())
         sel_cnt = len(sel_qs)
         
         with c_r4_1:
             if st.button("✅ 全选", use_container_width=True, key="ba_all"):
-                # Handle Select All directly
-                all_ids = {it["id"] for it in cur_list if it.get("status") != "processing"}
+                # Handle Select All directly (IDs only, processing items excluded)
+                processing_ids = set(question_db.list_question_ids(selected_book, status="processing"))
+                if search_text:
+                    matches, _ = question_db.search_questions(search_text, selected_book, limit=None, **list_filters)
+                    all_ids = {it["id"] for it in matches} - processing_ids
+                else:
+                    all_ids = set(question_db.list_question_ids(selected_book, **list_filters)) - processing_ids
                 st.session_state.selected_questions = all_ids
                 for qid in all_ids:
                     st.session_state[f"it_chk_{qid}"] = True
@@ -1505,81 +1029,131 @@ if st.session_state.view_mode == "detail" and st.session_state.mistake_mode == "
             btn_exp_label = f"📖 展开选中 ({sel_cnt})" if sel_cnt > 0 else "📖 展开选中"
             if st.button(btn_exp_label, use_container_width=True, disabled=(sel_cnt == 0), key="ba_exp", on_click=cb_ba_expand):
                 pass
+
+        with c_r4_5:
+            if st.button(f"🛠️ 更多 ({sel_cnt})" if sel_cnt > 0 else "🛠️ 更多", use_container_width=True, disabled=(sel_cnt == 0), key="ba_more"):
+                batch_manage_dialog(list(sel_qs), selected_book)
+        
+        # Search Box & Filter Panel
+        st.text_input("搜索", placeholder="🔍 搜索题目、选项、解析或摘要，按相关度排序", key="search_text", label_visibility="collapsed")
+        filters_active = bool(search_text) or any(v is not None for k, v in list_filters.items() if k != "archived")
+        with st.expander("⚙️ 筛选", expanded=any(v is not None for k, v in list_filters.items() if k != "archived")):
+            c_f1, c_f2 = st.columns(2)
+            with c_f1: st.selectbox("题型", list(FILTER_TYPES.keys()), key="flt_type")
+            with c_f2: st.selectbox("状态", list(FILTER_STATUSES.keys()), key="flt_status")
+            st.slider("陌生度范围", 0, FAMILIARITY_SLIDER_MAX, value=(0, FAMILIARITY_SLIDER_MAX), key="flt_fam", help=f"取到 {FAMILIARITY_SLIDER_MAX} 表示不设上限")
         
         st.divider()
 
-        # Final Filtering & Rendering
-        if wrong_questions:
-            v_arch = st.session_state.get("view_archived", False)
-            if v_arch: cur_list = [q for q in wrong_questions if q.get("archived", False)]
-            else: cur_list = [q for q in wrong_questions if not q.get("archived", False)]
-            s_opt = st.session_state.get("quiz_sort_order", "📅 添加时间(最新)")
-            # Database returns DESC (newest first), so "最早" needs reverse
-            if s_opt == "📅 添加时间(最早)": cur_list = cur_list[::-1]
-            elif s_opt == "🔥 陌生度(高→低)": cur_list.sort(key=lambda x: x.get("familiarity_score", 0), reverse=True)
-            elif s_opt == "✨ 陌生度(低→高)": cur_list.sort(key=lambda x: x.get("familiarity_score", 0))
-            
-            if not cur_list:
-                st.info("暂无归档题目" if v_arch else "暂无待复习题目")
+        # Final Filtering & Rendering (one page at a time, page cursors kept per search/filter/sort combination)
+        s_opt = st.session_state.get("quiz_sort_order", "📅 添加时间(最新)")
+        list_key = (selected_book, s_opt, search_text, tuple(sorted(list_filters.items())))
+        if st.session_state.get("list_page_key") != list_key:
+            st.session_state.list_page_key = list_key
+            st.session_state.list_page_cursors = [None]
+        page_cursors = st.session_state.list_page_cursors
+        page_no = len(page_cursors) - 1
+        if search_text:
+            # Ranked results: the cursor is an offset
+            offset = page_cursors[-1] or 0
+            cur_list, filtered_count = question_db.search_questions(search_text, selected_book, limit=PAGE_SIZE, offset=offset, **list_filters)
+            next_cursor = offset + PAGE_SIZE if offset + PAGE_SIZE < filtered_count else None
+        else:
+            cur_list, next_cursor = question_db.list_questions(
+                selected_book, sort=SORT_KEYS.get(s_opt, "newest"), limit=PAGE_SIZE, after=page_cursors[-1], **list_filters
+            )
+            filtered_count = question_db.count_questions(selected_book, **list_filters)
+        
+        if not cur_list and page_no > 0:
+            # 本页的题目都被移走了，回到上一页
+            page_cursors.pop()
+            st.rerun()
+        if not cur_list:
+            if filtered_count == 0 and filters_active:
+                st.info("没有符合搜索或筛选条件的题目")
             else:
-                for i, item in enumerate(cur_list):
-                    with st.container(border=True):
-                        q = item["question"]
-                        question_text = q.get('question', "（未知题目）")
-                        status = item.get("status", "completed")
-                        is_processing = status == "processing"
-                        
-                        if not question_text and q.get("image"):
-                            question_text = "（🖼️ 图片题目）"
-                        elif not question_text:
-                            question_text = "（📝 无内容）"
-                        
-                        summary_text = item.get("summary") or (question_text[:25] + "..." if len(question_text) > 25 else question_text)
-                        if is_processing: summary_text = f"⏳ 处理中... {summary_text}"
-                        
-                        # Layout: Checkbox | Question Summary | Score | Details Button
-                        c_check, c_summ, c_score, c_btn = st.columns([0.05, 0.78, 0.05, 0.12], vertical_alignment="center")
-                        
-                        selected_ids = st.session_state.get('selected_questions', set())
-                        is_checked = item["id"] in selected_ids
-                        
-                        with c_check:
-                            chk_key = f"it_chk_{item['id']}"
-                            # Sync session state with external source of truth (selected_questions)
-                            if chk_key not in st.session_state:
-                                st.session_state[chk_key] = is_checked
-                            elif st.session_state[chk_key] != is_checked:
-                                st.session_state[chk_key] = is_checked
+                st.info("暂无归档题目" if v_arch else "暂无待复习题目")
+        else:
+            if page_no > 0 or next_cursor is not None:
+                st.caption(f"共 {filtered_count} 道，第 {page_no + 1} / {(filtered_count + PAGE_SIZE - 1) // PAGE_SIZE} 页")
+            for i, item in enumerate(cur_list, start=page_no * PAGE_SIZE):
+                with st.container(border=True):
+                    q = item["question"]
+                    question_text = q.get('question', "（未知题目）")
+                    status = item.get("status", "completed")
+                    is_processing = status == "processing"
+                    
+                    if not question_text and q.get("image"):
+                        question_text = "（🖼️ 图片题目）"
+                    elif not question_text:
+                        question_text = "（📝 无内容）"
+                    
+                    summary_text = item.get("summary") or (question_text[:25] + "..." if len(question_text) > 25 else question_text)
+                    if is_processing: summary_text = f"⏳ 处理中... {summary_text}"
+                    
+                    # Layout: Checkbox | Question Summary | Score | Details Button
+                    c_check, c_summ, c_score, c_btn = st.columns([0.05, 0.78, 0.05, 0.12], vertical_alignment="center")
+                    
+                    selected_ids = st.session_state.get('selected_questions', set())
+                    is_checked = item["id"] in selected_ids
+                    
+                    with c_check:
+                        chk_key = f"it_chk_{item['id']}"
+                        # Sync session state with external source of truth (selected_questions)
+                        if chk_key not in st.session_state:
+                            st.session_state[chk_key] = is_checked
+                        elif st.session_state[chk_key] != is_checked:
+                            st.session_state[chk_key] = is_checked
+                            
+                        def _on_check_change(k=chk_key, iid=item["id"]):
+                            if st.session_state[k]:
+                                st.session_state.selected_questions.add(iid)
+                            else:
+                                st.session_state.selected_questions.discard(iid)
                                 
-                            def _on_check_change(k=chk_key, iid=item["id"]):
-                                if st.session_state[k]:
-                                    st.session_state.selected_questions.add(iid)
-                                else:
-                                    st.session_state.selected_questions.discard(iid)
-                                    
-                            st.checkbox(
-                                f"选择题目 {item['id']}", 
-                                key=chk_key, 
-                                label_visibility="collapsed", 
-                                disabled=is_processing,
-                                on_change=_on_check_change
-                            )
-                        
-                        with c_summ:
-                            # Use plain Markdown to ensure ** and LaTeX are parsed correctly
-                            # Vertical alignment is handled by st.columns(..., vertical_alignment="center")
-                            st.markdown(f"**{i+1}.** {summary_text}")
+                        st.checkbox(
+                            f"选择题目 {item['id']}", 
+                            key=chk_key, 
+                            label_visibility="collapsed", 
+                            disabled=is_processing,
+                            on_change=_on_check_change
+                        )
+                    
+                    with c_summ:
+                        # Use plain Markdown to ensure ** and LaTeX are parsed correctly
+                        # Vertical alignment is handled by st.columns(..., vertical_alignment="center")
+                        st.markdown(f"**{i+1}.** {summary_text}")
+                        # 纯图片题目显示缩略图（写入时已生成，不加载原图）
+                        if not q.get('question') and q.get("image"):
+                            thumb = image_store.resolve_image(q.get("image"), thumbnail=True)
+                            if thumb: st.image(thumb, width=120)
+
+                    with c_score:
+                        f_score = item.get("familiarity_score", 2)
+                        # 使用 st.markdown 保持一致，CSS会处理对齐
+                        st.markdown(f"{f_score}")
                         
-                        with c_score:
-                            f_score = item.get("familiarity_score", 2)
-                            # 使用 st.markdown 保持一致，CSS会处理对齐
-                            st.markdown(f"{f_score}")
-                            
-                        with c_btn:
-                            if st.button("🔍 详情", key=f"view_det_{item['id']}", use_container_width=True):
-                                st.session_state.active_dialog_id = item["id"]
-                                st.session_state.active_dialog_type = "single"
+                    with c_btn:
+                        if is_processing:
+                            if st.button("⏹ 取消", key=f"cancel_proc_{item['id']}", use_container_width=True):
+                                mistake_processor.cancel_mistake(item["id"], selected_book)
                                 st.rerun()
+                        elif st.button("🔍 详情", key=f"view_det_{item['id']}", use_container_width=True):
+                            st.session_state.active_dialog_id = item["id"]
+                            st.session_state.active_dialog_type = "single"
+                            st.rerun()
+
+            # Pagination
+            if page_no > 0 or next_cursor is not None:
+                c_prev, _, c_next = st.columns([1, 2, 1])
+                with c_prev:
+                    if st.button("⬅️ 上一页", use_container_width=True, disabled=(page_no == 0), key="page_prev"):
+                        page_cursors.pop()
+                        st.rerun()
+                with c_next:
+                    if st.button("下一页 ➡️", use_container_width=True, disabled=(next_cursor is None), key="page_next"):
+                        page_cursors.append(next_cursor)
+                        st.rerun()
 
 # --- Mode: Quiz View ---
 elif st.session_state.view_mode == "detail" and st.session_state.mistake_mode == "quiz":
@@ -1605,9 +1179,7 @@ elif st.session_state.view_mode == "detail" and st.session_state.mistake_mode ==
     current_qid = quiz_ids[idx]
     
     # Fetch fresh data for this ID
-    # Use optimized fetch if possible, here filtering list
-    all_qs = question_db.get_wrong_questions(mistake_book=st.session_state.selected_mistake_book)
-    item = next((q for q in all_qs if q['id'] == current_qid), None)
+    item = question_db.get_question(current_qid)
     
     if not item:
         # Item might be deleted? Skip
@@ -1642,9 +1214,7 @@ elif st.session_state.view_mode == "detail" and st.session_state.mistake_mode ==
     # Question Body
     if q.get("image"):
         try:
-             quiz_img = q.get("image")
-             if quiz_img.startswith("http"): st.image(quiz_img)
-             else: st.image(base64.b64decode(quiz_img))
+             st.image(image_store.resolve_image(q.get("image")))
         except: st.warning("图片加载失败")
 
     q_text = q.get('question', '')
@@ -1889,7 +1459,8 @@ elif st.session_state.view_mode == "detail" and st.session_state.mistake_mode ==
         if res:
             is_correct, old_score, new_score, archived = res
             arrow = "↘️" if new_score < old_score else ("↗️" if new_score > old_score else "➡️")
-            score_txt = f" (陌生度: {old_score} {arrow} {new_score}{', 已自动归档' if archived else ''})"
+            next_review = '已自动归档' if archived else f"下次复习: {review_scheduler.describe_due(item.get('due_at'))}"
+            score_txt = f" (陌生度: {old_score} {arrow} {new_score}，{next_review})"
             
             if is_correct: st.success(f"✅ 回答正确！{score_txt}")
             else: st.error(f"❌ 回答错误！{score_txt}")
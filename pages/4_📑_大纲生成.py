@@ -65,15 +65,21 @@ def run_background_generate(kb_name):
     try:
         # 使用独立的 DB 和 Agent 实例
         db = QuestionDB()
+        # 生成前记录知识库状态：生成期间若文件再有变化，大纲会被标记为过期
+        manager = KBManager()
+        file_signatures = manager.get_kb_file_signatures(kb_name)
+        kb_fingerprint = manager.get_kb_fingerprint(kb_name, file_signatures)
         agent = RAGAgent(kb_name=kb_name)
         # 记录开始处理
         db.save_outline(kb_name, "（大纲正在后台生成中，请耐心等待...）", status="processing")
         
-        # 执行生成
-        outline_md = agent.generate_outline()
+        # 执行生成（进度写入数据库，页面刷新时可见）
+        def report_progress(message):
+            db.save_outline(kb_name, f"（大纲正在后台生成中：{message}）", status="processing")
+        outline_md = agent.generate_outline(progress_callback=report_progress)
         
         # 记录完成
-        db.save_outline(kb_name, outline_md, status="completed")
+        db.save_outline(kb_name, outline_md, status="completed", kb_fingerprint=kb_fingerprint, file_signatures=file_signatures)
     except Exception as e:
         # 记录失败
         db = QuestionDB()
@@ -85,7 +91,8 @@ current_status = existing_outline.get("status") if existing_outline else None
 
 # Handle UI based on status
 if current_status == "processing":
-    st.info("⏳ **大纲正在生成/修改中...** 您可以先去其他页面看看，处理过程可能需要 30-60 秒。")
+    st.info("⏳ **大纲正在生成/修改中...** 您可以先去其他页面看看，知识库较大时需要逐个文件生成摘要，可能需要几分钟。")
+    st.caption(existing_outline["content"])
     if st.button("🔄 刷新查看状态", use_container_width=True):
         st.rerun()
     st.stop()
@@ -97,6 +104,25 @@ if existing_outline and current_status == "completed" and "outline_result" not i
 if current_status == "failed":
     st.error(existing_outline["content"])
 
+# 检查大纲是否过期（生成之后知识库文件有变化）
+if existing_outline and current_status == "completed":
+    if not existing_outline.get("kb_fingerprint"):
+        st.caption("ℹ️ 该大纲生成于旧版本，无法判断是否与当前知识库一致。")
+    elif existing_outline["kb_fingerprint"] != kb_manager.get_kb_fingerprint(selected_kb):
+        added, removed, modified = KBManager.diff_file_signatures(
+            existing_outline.get("file_signatures"), kb_manager.get_kb_file_signatures(selected_kb)
+        )
+        changes = []
+        if added: changes.append(f"新增 {len(added)} 个文件")
+        if removed: changes.append(f"删除 {len(removed)} 个文件")
+        if modified: changes.append(f"修改 {len(modified)} 个文件")
+        detail = "、".join(changes) if changes else "切分参数已变化"
+        st.warning(f"⚠️ 知识库在大纲生成后发生了变化（{detail}），大纲可能已过期。重新生成时只会为变化的文件重新生成摘要。")
+        with st.expander("查看变化的文件"):
+            for f in added: st.markdown(f"- ➕ {f}")
+            for f in removed: st.markdown(f"- ➖ {f}")
+            for f in modified: st.markdown(f"- ✏️ {f}")
+
 col_gen, _ = st.columns([1, 1])
 with col_gen:
     btn_label = "🚀 生成/重新生成大纲" if current_status != "completed" else "🔄 重新生成大纲"
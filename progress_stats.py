@@ -0,0 +1,119 @@
+"""
+Incrementally Maintained Progress Statistics.
+
+Two small summary tables are updated in the same transaction as the writes
+they describe, so dashboards never scan or JSON-decode `history`:
+
+    practice_stats  (day, kb_name, question_type) -> attempts, correct
+                    one row per answer given in practice (QuestionDB.add_result)
+    review_stats    (day, book_id, question_type) -> added, reviews, correct, archived
+                    mistakes added to a book, mistake-review answers
+                    (QuestionDB.update_familiarity_score) and questions
+                    archived, automatically by review or by hand
+
+Days are local calendar dates ('YYYY-MM-DD'); an unknown question type is ''.
+Counters are never recomputed from the source rows (the only adjustment
+moves a processed mistake's 'added' count to its recognized question type),
+so the tables stay correct when old history rows are archived or questions
+are deleted. `backfill_stats` fills them from existing data once, when the
+tables are created (schema migration).
+"""
+import time
+from typing import Optional
+
+REVIEW_COLUMNS = ("added", "reviews", "correct", "archived")
+
+# 旧数据中手动添加的错题只能通过页面写入的占位答案识别（不算作答题）
+MANUAL_ANSWER = "（手动添加）"
+
+
+def stat_day(timestamp: Optional[float] = None) -> str:
+    return time.strftime("%Y-%m-%d", time.localtime(time.time() if timestamp is None else timestamp))
+
+
+def create_tables(cursor) -> None:
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS practice_stats (
+            day TEXT NOT NULL,
+            kb_name TEXT NOT NULL,
+            question_type TEXT NOT NULL,
+            attempts INTEGER DEFAULT 0,
+            correct INTEGER DEFAULT 0,
+            PRIMARY KEY (day, kb_name, question_type)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS review_stats (
+            day TEXT NOT NULL,
+            book_id INTEGER NOT NULL,
+            question_type TEXT NOT NULL,
+            added INTEGER DEFAULT 0,
+            reviews INTEGER DEFAULT 0,
+            correct INTEGER DEFAULT 0,
+            archived INTEGER DEFAULT 0,
+            PRIMARY KEY (day, book_id, question_type)
+        )
+    ''')
+
+
+def _increment(cursor, table: str, keys: dict, counts: dict) -> None:
+    counts = {column: n for column, n in counts.items() if n}
+    if not counts:
+        return
+    columns = list(keys) + list(counts)
+    cursor.execute(f'''
+        INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})
+        ON CONFLICT({', '.join(keys)}) DO UPDATE SET
+            {', '.join(f'{column} = {column} + excluded.{column}' for column in counts)}
+    ''', list(keys.values()) + list(counts.values()))
+
+
+def record_practice(cursor, timestamp: float, kb_name: Optional[str], question_type: Optional[str], is_correct: bool) -> None:
+    """Count one practice answer (call inside the transaction that writes the history row)."""
+    _increment(
+        cursor, "practice_stats",
+        {"day": stat_day(timestamp), "kb_name": kb_name or "", "question_type": question_type or ""},
+        {"attempts": 1, "correct": 1 if is_correct else 0}
+    )
+
+
+def record_review_event(cursor, timestamp: float, book_id: int, question_type: Optional[str], **counts: int) -> None:
+    """Add to the review_stats counters (added / reviews / correct / archived) of one book and day."""
+    unknown = set(counts) - set(REVIEW_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown review_stats columns: {sorted(unknown)}")
+    _increment(
+        cursor, "review_stats",
+        {"day": stat_day(timestamp), "book_id": book_id, "question_type": question_type or ""},
+        counts
+    )
+
+
+def backfill_stats(cursor) -> None:
+    """Fill empty stats tables from history and questions.
+
+    Past reviews were not logged individually, so only 'added' can be rebuilt
+    for review_stats; reviews are counted from the moment the tables exist.
+    """
+    cursor.execute('SELECT (SELECT COUNT(*) FROM practice_stats) + (SELECT COUNT(*) FROM review_stats) AS n')
+    if cursor.fetchone()['n']:
+        return
+    cursor.execute('''
+        INSERT INTO practice_stats (day, kb_name, question_type, attempts, correct)
+        SELECT date(timestamp, 'unixepoch', 'localtime'),
+               COALESCE(kb_name, ''),
+               COALESCE(json_extract(question_data, '$.question_type'), ''),
+               COUNT(*), SUM(is_correct = 1)
+        FROM history
+        WHERE timestamp IS NOT NULL AND COALESCE(user_answer, '') != ?
+        GROUP BY 1, 2, 3
+    ''', (MANUAL_ANSWER,))
+    practice_rows = cursor.rowcount
+    cursor.execute('''
+        INSERT INTO review_stats (day, book_id, question_type, added)
+        SELECT date(timestamp, 'unixepoch', 'localtime'), book_id, COALESCE(question_type, ''), COUNT(*)
+        FROM questions
+        WHERE timestamp IS NOT NULL AND book_id IS NOT NULL
+        GROUP BY 1, 2, 3
+    ''')
+    print(f"Backfilled progress statistics: {practice_rows} practice rows, {cursor.rowcount} review rows")
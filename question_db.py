@@ -10,10 +10,24 @@ import os
 import uuid
 import time
 import sqlite3
-from database import get_connection, init_db, serialize_options, deserialize_options, serialize_question_data, deserialize_question_data
+from database import get_connection, get_read_connection, init_db, serialize_options, deserialize_options, serialize_question_data, deserialize_question_data
+from image_store import store_image_value
+from progress_stats import record_practice, record_review_event
+from review_scheduler import next_state, grade_for
+from text_search import build_match_query
 
 DB_FILE = "data/user_progress.db"
 
+# Sort orders for list_questions / list_question_ids: (SQL expression, direction) pairs.
+# The trailing id makes every order total, which keyset pagination relies on.
+SORT_ORDERS = {
+    "newest": [("q.timestamp", "DESC"), ("q.id", "DESC")],
+    "oldest": [("q.timestamp", "ASC"), ("q.id", "ASC")],
+    "familiarity_desc": [("COALESCE(q.familiarity_score, 0)", "DESC"), ("q.timestamp", "DESC"), ("q.id", "DESC")],
+    "familiarity_asc": [("COALESCE(q.familiarity_score, 0)", "ASC"), ("q.timestamp", "DESC"), ("q.id", "DESC")],
+    "due": [("q.due_at", "ASC"), ("q.id", "ASC")],
+}
+
 
 class QuestionDB:
     def __init__(self):
@@ -47,7 +61,8 @@ class QuestionDB:
             'options': deserialize_options(row['options']),
             'answers': deserialize_options(row['answers']),
             'correct_answer': row['correct_answer'],
-            'explanation': row['explanation']
+            'explanation': row['explanation'],
+            'image': row['image_ref']
         }
         # Clean up None values
         question_data = {k: v for k, v in question_data.items() if v is not None}
@@ -64,7 +79,10 @@ class QuestionDB:
             'familiarity_score': row['familiarity_score'],
             'archived': bool(row['is_archived']),
             'last_reviewed': row['last_reviewed'],
-            'review_count': row['review_count']
+            'review_count': row['review_count'],
+            'due_at': row['due_at'],
+            'interval_days': row['interval_days'],
+            'ease': row['ease']
         }
     
     def _history_row_to_dict(self, row):
@@ -83,6 +101,13 @@ class QuestionDB:
             'status': row['status']
         }
 
+    @staticmethod
+    def _store_images(question_data):
+        """Move an inline base64 image into the image store, keeping only its reference."""
+        if not question_data or not question_data.get('image'):
+            return question_data
+        return {**question_data, 'image': store_image_value(question_data['image'])}
+
     def list_mistake_books(self, include_archived=True):
         """获取错题本列表
         
@@ -93,7 +118,7 @@ class QuestionDB:
             list of (book_name, is_archived) tuples if include_archived is True,
             else list of book_name strings (only unarchived)
         """
-        with get_connection() as conn:
+        with get_read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT name, is_archived FROM mistake_books')
             rows = cursor.fetchall()
@@ -197,6 +222,7 @@ class QuestionDB:
         """
         record_id = str(uuid.uuid4())
         timestamp = time.time()
+        question_data = self._store_images(question_data)
         
         with get_connection() as conn:
             cursor = conn.cursor()
@@ -215,6 +241,9 @@ class QuestionDB:
                 summary,
                 status
             ))
+            # 手动添加的错题（处理中）不算作答题
+            if status == "completed":
+                record_practice(cursor, timestamp, kb_name, question_data.get('question_type') if question_data else None, is_correct)
             
             # If wrong, add to mistake book
             if not is_correct:
@@ -234,18 +263,20 @@ class QuestionDB:
                 q_answers = question_data.get('answers') if question_data else None
                 q_answer = question_data.get('correct_answer') if question_data else None
                 q_explanation = question_data.get('explanation') if question_data else None
+                q_image = question_data.get('image') if question_data else None
                 
                 cursor.execute('''
                     INSERT INTO questions (
                         id, book_id, timestamp, kb_name, question_type, question_text,
                         options, answers, correct_answer, explanation, user_answer, is_correct,
-                        summary, status, familiarity_score, is_archived, last_reviewed, review_count
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        summary, status, familiarity_score, is_archived, last_reviewed, review_count, image_ref, due_at
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 ''', (
                     record_id, book_id, timestamp, kb_name, q_type, q_text,
                     serialize_options(q_options), serialize_options(q_answers), q_answer, q_explanation,
-                    user_answer, 0, summary, status, 2, 0, None, 0
+                    user_answer, 0, summary, status, 2, 0, None, 0, q_image, timestamp
                 ))
+                record_review_event(cursor, timestamp, book_id, q_type, added=1)
         
         return record_id
     
@@ -259,6 +290,7 @@ class QuestionDB:
             status: 处理状态
             mistake_book: 错题本名称（可选，如果不指定则搜索所有错题本）
         """
+        question_data = self._store_images(question_data)
         with get_connection() as conn:
             cursor = conn.cursor()
             
@@ -273,7 +305,8 @@ class QuestionDB:
                     'options = ?',
                     'answers = ?',
                     'correct_answer = ?',
-                    'explanation = ?'
+                    'explanation = ?',
+                    'image_ref = ?'
                 ])
                 params.extend([
                     question_data.get('question_type'),
@@ -281,7 +314,8 @@ class QuestionDB:
                     serialize_options(question_data.get('options')),
                     serialize_options(question_data.get('answers')),
                     question_data.get('correct_answer'),
-                    question_data.get('explanation')
+                    question_data.get('explanation'),
+                    question_data.get('image')
                 ])
             
             if summary is not None:
@@ -290,6 +324,14 @@ class QuestionDB:
             
             params.append(record_id)
             
+            if question_data:
+                # 识别出题型后，错题本统计中的"新增"计入新题型
+                cursor.execute('SELECT book_id, timestamp, question_type FROM questions WHERE id = ?', (record_id,))
+                row = cursor.fetchone()
+                if row and row['book_id'] is not None and (row['question_type'] or '') != (question_data.get('question_type') or ''):
+                    record_review_event(cursor, row['timestamp'], row['book_id'], row['question_type'], added=-1)
+                    record_review_event(cursor, row['timestamp'], row['book_id'], question_data.get('question_type'), added=1)
+            
             cursor.execute(f'''
                 UPDATE questions SET {', '.join(updates)} WHERE id = ?
             ''', params)
@@ -340,28 +382,40 @@ class QuestionDB:
                 UPDATE questions SET correct_answer = ? WHERE id = ?
             ''', (new_correct_answer, record_id))
 
-    def save_outline(self, kb_name, outline_content, status="completed"):
-        """Save generated outline for a specific knowledge base."""
+    def save_outline(self, kb_name, outline_content, status="completed", kb_fingerprint=None, file_signatures=None):
+        """Save generated outline for a specific knowledge base.
+
+        kb_fingerprint / file_signatures describe the KB the outline was generated from.
+        When omitted (progress updates, refinements) the previously stored values are kept.
+        """
         with get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                INSERT OR REPLACE INTO outlines (kb_name, content, status, timestamp)
-                VALUES (?, ?, ?, ?)
-            ''', (kb_name, outline_content, status, time.time()))
+                INSERT INTO outlines (kb_name, content, status, timestamp, kb_fingerprint, file_signatures)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(kb_name) DO UPDATE SET
+                    content = excluded.content,
+                    status = excluded.status,
+                    timestamp = excluded.timestamp,
+                    kb_fingerprint = COALESCE(excluded.kb_fingerprint, outlines.kb_fingerprint),
+                    file_signatures = COALESCE(excluded.file_signatures, outlines.file_signatures)
+            ''', (kb_name, outline_content, status, time.time(), kb_fingerprint, serialize_question_data(file_signatures)))
 
     def get_outline(self, kb_name):
         """Retrieve stored outline for a specific knowledge base."""
-        with get_connection() as conn:
+        with get_read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                SELECT content, status, timestamp FROM outlines WHERE kb_name = ?
+                SELECT content, status, timestamp, kb_fingerprint, file_signatures FROM outlines WHERE kb_name = ?
             ''', (kb_name,))
             row = cursor.fetchone()
             if row:
                 return {
                     'content': row['content'],
                     'status': row['status'],
-                    'timestamp': row['timestamp']
+                    'timestamp': row['timestamp'],
+                    'kb_fingerprint': row['kb_fingerprint'],
+                    'file_signatures': deserialize_question_data(row['file_signatures'])
                 }
             return None
 
@@ -372,7 +426,7 @@ class QuestionDB:
             kb_name: 知识库名称（已废弃，保留兼容性）
             mistake_book: 错题本名称，如果不指定则返回默认错题本
         """
-        with get_connection() as conn:
+        with get_read_connection() as conn:
             cursor = conn.cursor()
             
             if mistake_book is None:
@@ -390,7 +444,7 @@ class QuestionDB:
 
     def get_all_wrong_questions(self):
         """获取所有错题本的所有错题"""
-        with get_connection() as conn:
+        with get_read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT q.*, mb.name as book_name
@@ -400,6 +454,335 @@ class QuestionDB:
             ''')
             return [self._question_row_to_dict(row) for row in cursor.fetchall()]
 
+    def _question_filters(self, mistake_book, archived=None, status=None, question_type=None,
+                          min_familiarity=None, max_familiarity=None, text=None, due_before=None):
+        """Build the WHERE clause shared by the listing and counting queries (mistake_book None: all books)."""
+        clauses = ['1 = 1']
+        params = []
+        if mistake_book is not None:
+            clauses.append('mb.name = ?')
+            params.append(mistake_book)
+        if archived is not None:
+            clauses.append('q.is_archived = ?')
+            params.append(1 if archived else 0)
+        if status is not None:
+            statuses = [status] if isinstance(status, str) else list(status)
+            clauses.append(f"COALESCE(q.status, 'completed') IN ({', '.join('?' * len(statuses))})")
+            params.extend(statuses)
+        if question_type is not None:
+            clauses.append('q.question_type = ?')
+            params.append(question_type)
+        if min_familiarity is not None:
+            clauses.append('COALESCE(q.familiarity_score, 0) >= ?')
+            params.append(min_familiarity)
+        if max_familiarity is not None:
+            clauses.append('COALESCE(q.familiarity_score, 0) <= ?')
+            params.append(max_familiarity)
+        if text:
+            pattern = '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            clauses.append("(q.question_text LIKE ? ESCAPE '\\' OR q.summary LIKE ? ESCAPE '\\')")
+            params.extend([pattern, pattern])
+        if due_before is not None:
+            clauses.append('q.due_at <= ?')
+            params.append(due_before)
+        return ' AND '.join(clauses), params
+
+    @staticmethod
+    def _keyset_clause(order, after):
+        """WHERE condition selecting rows strictly after the cursor in the given order."""
+        alternatives = []
+        params = []
+        for i, (expr, direction) in enumerate(order):
+            equal = [f'{prev_expr} = ?' for prev_expr, _ in order[:i]]
+            op = '<' if direction == 'DESC' else '>'
+            alternatives.append('(' + ' AND '.join(equal + [f'{expr} {op} ?']) + ')')
+            params.extend(after[:i + 1])
+        return '(' + ' OR '.join(alternatives) + ')', params
+
+    def list_questions(self, mistake_book, sort="newest", limit=50, after=None, **filters):
+        """分页获取错题（keyset 分页，筛选和排序都在 SQL 中完成）
+
+        Args:
+            mistake_book: 错题本名称
+            sort: SORT_ORDERS 中的排序方式
+            limit: 每页数量
+            after: 上一页返回的游标，None 表示第一页
+            **filters: archived / status / question_type / min_familiarity / max_familiarity / text / due_before
+
+        Returns:
+            (items, next_cursor): 本页错题与下一页游标，没有下一页时游标为 None
+        """
+        order = SORT_ORDERS[sort]
+        where, params = self._question_filters(mistake_book, **filters)
+        if after is not None:
+            keyset, keyset_params = self._keyset_clause(order, after)
+            where += ' AND ' + keyset
+            params += keyset_params
+        sort_columns = ', '.join(f'{expr} AS sort_{i}' for i, (expr, _) in enumerate(order))
+        order_by = ', '.join(f'{expr} {direction}' for expr, direction in order)
+
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT q.*, mb.name as book_name, {sort_columns}
+                FROM questions q
+                JOIN mistake_books mb ON q.book_id = mb.id
+                WHERE {where}
+                ORDER BY {order_by}
+                LIMIT ?
+            ''', params + [limit + 1])
+            rows = cursor.fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = [rows[-1][f'sort_{i}'] for i in range(len(order))]
+        return [self._question_row_to_dict(row, mistake_book) for row in rows], next_cursor
+
+    def list_question_ids(self, mistake_book, sort="newest", limit=None, **filters):
+        """按筛选条件和排序返回题目 ID（不反序列化题目内容，用于练习队列、全选），limit 为 None 时返回全部"""
+        where, params = self._question_filters(mistake_book, **filters)
+        order_by = ', '.join(f'{expr} {direction}' for expr, direction in SORT_ORDERS[sort])
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT q.id FROM questions q
+                JOIN mistake_books mb ON q.book_id = mb.id
+                WHERE {where}
+                ORDER BY {order_by}
+                LIMIT ?
+            ''', params + [-1 if limit is None else limit])
+            return [row['id'] for row in cursor.fetchall()]
+
+    def count_questions(self, mistake_book, **filters):
+        """按筛选条件统计题目数量"""
+        where, params = self._question_filters(mistake_book, **filters)
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT COUNT(*) as count FROM questions q
+                JOIN mistake_books mb ON q.book_id = mb.id
+                WHERE {where}
+            ''', params)
+            return cursor.fetchone()['count']
+
+    def get_due_questions(self, mistake_book=None, limit=20, now=None):
+        """复习队列：已到期的未归档错题，最早到期的在前（mistake_book 为 None 时跨所有错题本）"""
+        items, _ = self.list_questions(
+            mistake_book, sort="due", limit=limit,
+            archived=False, status="completed", due_before=time.time() if now is None else now
+        )
+        return items
+
+    def list_due_ids(self, mistake_book=None, limit=None, now=None):
+        """复习队列的题目 ID，顺序同 get_due_questions"""
+        return self.list_question_ids(
+            mistake_book, sort="due", limit=limit,
+            archived=False, status="completed", due_before=time.time() if now is None else now
+        )
+
+    def count_due(self, mistake_book=None, now=None):
+        """已到期待复习的题目数量"""
+        return self.count_questions(
+            mistake_book, archived=False, status="completed", due_before=time.time() if now is None else now
+        )
+
+    def get_practice_stats(self, kb_name=None, since=None, group_by="day"):
+        """答题统计（读汇总表 practice_stats）
+
+        Args:
+            kb_name: 只统计该知识库，None 表示全部
+            since: 起始日期 'YYYY-MM-DD'（含），None 表示全部
+            group_by: "day" / "kb_name" / "question_type"
+
+        Returns:
+            [{group_by: 值, "attempts", "correct"}]，按分组值升序
+        """
+        if group_by not in ("day", "kb_name", "question_type"):
+            raise ValueError(f"Unknown group_by: {group_by}")
+        clauses, params = ['1 = 1'], []
+        if kb_name is not None:
+            clauses.append('kb_name = ?')
+            params.append(kb_name)
+        if since is not None:
+            clauses.append('day >= ?')
+            params.append(since)
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT {group_by}, SUM(attempts) as attempts, SUM(correct) as correct
+                FROM practice_stats
+                WHERE {' AND '.join(clauses)}
+                GROUP BY {group_by} ORDER BY {group_by}
+            ''', params)
+            return [dict(row) for row in cursor.fetchall()]
+
+    def get_review_stats(self, mistake_book=None, since=None, group_by="day"):
+        """错题本统计（读汇总表 review_stats）
+
+        Args:
+            mistake_book: 只统计该错题本，None 表示全部
+            since: 起始日期 'YYYY-MM-DD'（含），None 表示全部
+            group_by: "day" / "book" / "question_type"
+
+        Returns:
+            [{group_by: 值, "added", "reviews", "correct", "archived"}]，按分组值升序
+        """
+        group_columns = {"day": "rs.day", "book": "mb.name", "question_type": "rs.question_type"}
+        if group_by not in group_columns:
+            raise ValueError(f"Unknown group_by: {group_by}")
+        clauses, params = ['1 = 1'], []
+        if mistake_book is not None:
+            clauses.append('mb.name = ?')
+            params.append(mistake_book)
+        if since is not None:
+            clauses.append('rs.day >= ?')
+            params.append(since)
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT {group_columns[group_by]} as {group_by},
+                       SUM(rs.added) as added, SUM(rs.reviews) as reviews,
+                       SUM(rs.correct) as correct, SUM(rs.archived) as archived
+                FROM review_stats rs
+                JOIN mistake_books mb ON rs.book_id = mb.id
+                WHERE {' AND '.join(clauses)}
+                GROUP BY 1 ORDER BY 1
+            ''', params)
+            return [dict(row) for row in cursor.fetchall()]
+
+    def search_questions(self, query, mistake_book=None, limit=20, offset=0, **filters):
+        """全文搜索错题（题目、选项、解析、摘要），按相关度排序
+
+        Args:
+            query: 搜索词，中文按词切分，所有词都需出现
+            mistake_book: 错题本名称，None 表示搜索所有错题本
+            limit / offset: 分页，limit 为 None 时返回全部结果
+            **filters: 同 list_questions
+
+        Returns:
+            (items, total): 本页结果与匹配总数
+        """
+        match = build_match_query(query)
+        if match is None:
+            return [], 0
+        where, params = self._question_filters(mistake_book, **filters)
+        try:
+            with get_read_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    SELECT COUNT(*) as count FROM questions_fts
+                    JOIN questions q ON q.rowid = questions_fts.rowid
+                    JOIN mistake_books mb ON q.book_id = mb.id
+                    WHERE questions_fts MATCH ? AND {where}
+                ''', [match] + params)
+                total = cursor.fetchone()['count']
+                # Matches in the question text weigh most, then the summary
+                cursor.execute(f'''
+                    SELECT q.*, mb.name as book_name
+                    FROM questions_fts
+                    JOIN questions q ON q.rowid = questions_fts.rowid
+                    JOIN mistake_books mb ON q.book_id = mb.id
+                    WHERE questions_fts MATCH ? AND {where}
+                    ORDER BY bm25(questions_fts, 4.0, 1.0, 1.0, 2.0), q.timestamp DESC
+                    LIMIT ? OFFSET ?
+                ''', [match] + params + [-1 if limit is None else limit, offset])
+                rows = cursor.fetchall()
+        except sqlite3.OperationalError as e:
+            # SQLite without FTS5: plain substring match, newest first
+            print(f"Full-text search failed, using LIKE: {e}")
+            filters['text'] = query
+            total = self.count_questions(mistake_book, **filters)
+            ids = self.list_question_ids(mistake_book, **filters)
+            ids = ids[offset:] if limit is None else ids[offset:offset + limit]
+            return self.get_questions(ids), total
+        return [self._question_row_to_dict(row, row['book_name']) for row in rows], total
+
+    def search_history(self, query, kb_name=None, limit=20, offset=0):
+        """全文搜索答题记录，按相关度排序，返回 (items, total)"""
+        match = build_match_query(query)
+        if match is None:
+            return [], 0
+        where, params = ('AND h.kb_name = ?', [kb_name]) if kb_name else ('', [])
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT COUNT(*) as count FROM history_fts
+                JOIN history h ON h.rowid = history_fts.rowid
+                WHERE history_fts MATCH ? {where}
+            ''', [match] + params)
+            total = cursor.fetchone()['count']
+            cursor.execute(f'''
+                SELECT h.* FROM history_fts
+                JOIN history h ON h.rowid = history_fts.rowid
+                WHERE history_fts MATCH ? {where}
+                ORDER BY bm25(history_fts, 4.0, 1.0, 1.0, 2.0), h.timestamp DESC
+                LIMIT ? OFFSET ?
+            ''', [match] + params + [limit, offset])
+            return [self._history_row_to_dict(row) for row in cursor.fetchall()], total
+
+    def iter_history(self, kb_name=None, include_archived=True):
+        """按时间顺序遍历全部答题记录（用于导出），包括已移入归档文件的旧记录"""
+        if include_archived:
+            from history_archive import iter_archived_history
+            yield from iter_archived_history(kb_name=kb_name)
+        where, params = ('WHERE kb_name = ?', [kb_name]) if kb_name else ('', [])
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'SELECT * FROM history {where} ORDER BY timestamp, id', params)
+            rows = cursor.fetchall()
+        for row in rows:
+            yield self._history_row_to_dict(row)
+
+    def get_book_counts(self, mistake_book):
+        """错题本的题目统计：{"total", "active", "archived", "processing", "due"}"""
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT
+                    COUNT(q.id) as total,
+                    COALESCE(SUM(q.is_archived = 0), 0) as active,
+                    COALESCE(SUM(q.is_archived = 1), 0) as archived,
+                    COALESCE(SUM(q.status = 'processing'), 0) as processing,
+                    COALESCE(SUM(q.is_archived = 0 AND COALESCE(q.status, 'completed') = 'completed' AND q.due_at <= ?), 0) as due
+                FROM mistake_books mb
+                LEFT JOIN questions q ON q.book_id = mb.id
+                WHERE mb.name = ?
+            ''', (time.time(), mistake_book))
+            return dict(cursor.fetchone())
+
+    def get_question(self, record_id):
+        """按 ID 获取单道错题，不存在时返回 None"""
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT q.*, mb.name as book_name
+                FROM questions q
+                JOIN mistake_books mb ON q.book_id = mb.id
+                WHERE q.id = ?
+            ''', (record_id,))
+            row = cursor.fetchone()
+            return self._question_row_to_dict(row, row['book_name']) if row else None
+
+    def get_questions(self, record_ids):
+        """按 ID 批量获取错题，按传入顺序返回（忽略不存在的 ID）"""
+        record_ids = list(record_ids)
+        items = {}
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            # Chunked to stay under SQLite's bound-parameter limit
+            for start in range(0, len(record_ids), 500):
+                chunk = record_ids[start:start + 500]
+                cursor.execute(f'''
+                    SELECT q.*, mb.name as book_name
+                    FROM questions q
+                    JOIN mistake_books mb ON q.book_id = mb.id
+                    WHERE q.id IN ({', '.join('?' * len(chunk))})
+                ''', chunk)
+                for row in cursor.fetchall():
+                    items[row['id']] = self._question_row_to_dict(row, row['book_name'])
+        return [items[record_id] for record_id in record_ids if record_id in items]
+
     def remove_wrong_question(self, record_id, mistake_book=None):
         """从错题本中删除题目"""
         with get_connection() as conn:
@@ -416,6 +799,8 @@ class QuestionDB:
           - <8 分：-1 分
         - 陌生分数 = 0 时自动归档
         
+        同时按 review_scheduler 更新下次复习时间。
+        
         Args:
             record_id: 记录 ID
             is_correct: 是否答对
@@ -429,7 +814,7 @@ class QuestionDB:
             
             # Get current score
             cursor.execute('''
-                SELECT familiarity_score, is_archived FROM questions WHERE id = ?
+                SELECT book_id, question_type, familiarity_score, is_archived, interval_days, ease, repetitions FROM questions WHERE id = ?
             ''', (record_id,))
             row = cursor.fetchone()
             
@@ -450,12 +835,25 @@ class QuestionDB:
             # Auto-archive if score is 0
             is_archived = 1 if new_score == 0 else row['is_archived']
             
+            now = time.time()
+            schedule = next_state(row['interval_days'], row['ease'], row['repetitions'], grade_for(is_correct), now)
+            
             # Update
             cursor.execute('''
                 UPDATE questions 
-                SET familiarity_score = ?, is_archived = ?, last_reviewed = ?, review_count = review_count + 1
+                SET familiarity_score = ?, is_archived = ?, last_reviewed = ?, review_count = review_count + 1,
+                    due_at = ?, interval_days = ?, ease = ?, repetitions = ?
                 WHERE id = ?
-            ''', (new_score, is_archived, time.time(), record_id))
+            ''', (
+                new_score, is_archived, now,
+                schedule['due_at'], schedule['interval_days'], schedule['ease'], schedule['repetitions'],
+                record_id
+            ))
+            if row['book_id'] is not None:
+                record_review_event(
+                    cursor, now, row['book_id'], row['question_type'],
+                    reviews=1, correct=1 if is_correct else 0, archived=1 if is_archived and not row['is_archived'] else 0
+                )
             
             return new_score, bool(is_archived)
     
@@ -470,29 +868,99 @@ class QuestionDB:
             cursor = conn.cursor()
             
             # Get current state
-            cursor.execute('SELECT is_archived FROM questions WHERE id = ?', (record_id,))
+            cursor.execute('SELECT is_archived, book_id, question_type FROM questions WHERE id = ?', (record_id,))
             row = cursor.fetchone()
             
             if row:
                 new_archived = 0 if row['is_archived'] else 1
-                new_score = 2 if new_archived == 0 else None  # Reset score if unarchiving
+                new_score = 2 if new_archived == 0 else None  # Reset score and schedule if unarchiving
                 
                 if new_score is not None:
                     cursor.execute('''
-                        UPDATE questions SET is_archived = ?, familiarity_score = ? WHERE id = ?
-                    ''', (new_archived, new_score, record_id))
+                        UPDATE questions SET is_archived = ?, familiarity_score = ?, due_at = ?, interval_days = 0, repetitions = 0
+                        WHERE id = ?
+                    ''', (new_archived, new_score, time.time(), record_id))
                 else:
                     cursor.execute('''
                         UPDATE questions SET is_archived = ? WHERE id = ?
                     ''', (new_archived, record_id))
+                    if row['book_id'] is not None:
+                        record_review_event(cursor, time.time(), row['book_id'], row['question_type'], archived=1)
     
+    @staticmethod
+    def _update_ids(cursor, sql, record_ids, params=()):
+        """Run `sql` (containing an {ids} placeholder) over record_ids in chunks, return rows affected."""
+        record_ids = list(dict.fromkeys(record_ids))
+        affected = 0
+        # Chunked to stay under SQLite's bound-parameter limit
+        for start in range(0, len(record_ids), 500):
+            chunk = record_ids[start:start + 500]
+            cursor.execute(sql.format(ids=', '.join('?' * len(chunk))), list(params) + chunk)
+            affected += cursor.rowcount
+        return affected
+
+    def bulk_set_archived(self, record_ids, archived=True):
+        """批量归档/取消归档（取消归档时陌生分数重置为 2、复习计划重新开始，与 toggle_archive 一致），返回影响的题目数"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            if archived:
+                # 归档数计入学习统计，需先读出实际由未归档变为归档的题目
+                archived_counts = {}
+                record_ids = list(dict.fromkeys(record_ids))
+                for start in range(0, len(record_ids), 500):
+                    chunk = record_ids[start:start + 500]
+                    cursor.execute(
+                        f"SELECT book_id, question_type FROM questions WHERE is_archived = 0 AND id IN ({', '.join('?' * len(chunk))})",
+                        chunk
+                    )
+                    for row in cursor.fetchall():
+                        if row['book_id'] is not None:
+                            key = (row['book_id'], row['question_type'])
+                            archived_counts[key] = archived_counts.get(key, 0) + 1
+                affected = self._update_ids(cursor, 'UPDATE questions SET is_archived = 1 WHERE is_archived = 0 AND id IN ({ids})', record_ids)
+                now = time.time()
+                for (book_id, question_type), count in archived_counts.items():
+                    record_review_event(cursor, now, book_id, question_type, archived=count)
+                return affected
+            return self._update_ids(
+                cursor,
+                'UPDATE questions SET is_archived = 0, familiarity_score = 2, due_at = ?, interval_days = 0, repetitions = 0 '
+                'WHERE is_archived = 1 AND id IN ({ids})',
+                record_ids, (time.time(),)
+            )
+
+    def bulk_delete(self, record_ids):
+        """批量从错题本中删除题目，返回删除数量"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            return self._update_ids(cursor, 'DELETE FROM questions WHERE id IN ({ids})', record_ids)
+
+    def bulk_move(self, record_ids, target_book):
+        """批量移动题目到另一个错题本（不存在时自动创建），返回移动数量"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            book_id = self._get_book_id(target_book, cursor)
+            return self._update_ids(
+                cursor, 'UPDATE questions SET book_id = ? WHERE book_id != ? AND id IN ({ids})', record_ids, (book_id, book_id)
+            )
+
+    def bulk_reset_score(self, record_ids, score=2):
+        """批量设置陌生分数，返回影响的题目数"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            return self._update_ids(cursor, 'UPDATE questions SET familiarity_score = ? WHERE id IN ({ids})', record_ids, (score,))
+
+    def set_familiarity_score(self, record_id, score, mistake_book=None):
+        """手动设置单道错题的陌生分数"""
+        return self.bulk_reset_score([record_id], score) > 0
+
     def get_archived_questions(self, mistake_book=None):
         """获取归档的错题
         
         Args:
             mistake_book: 错题本名称，如果不指定则返回默认错题本的归档题目
         """
-        with get_connection() as conn:
+        with get_read_connection() as conn:
             cursor = conn.cursor()
             
             if mistake_book is None:
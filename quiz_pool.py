@@ -0,0 +1,75 @@
+"""
+Pre-generated Quiz Pool.
+
+Questions are generated ahead of time in the background and stored in SQLite,
+keyed by (kb_name, question_format, q_type, variant), where variant is the
+option count for multiple choice and the blank count for fill-in-blank.
+Each row records the fingerprint of the knowledge base it was generated
+from; rows whose fingerprint no longer matches are discarded on read.
+"""
+import time
+from typing import Any, Dict, List
+
+from database import get_connection, get_read_connection, init_db, serialize_question_data, deserialize_question_data
+
+
+def pool_variant(question_format: str, num_options: int, num_blanks: int) -> int:
+    """选择题按选项数、填空题按空格数区分池子"""
+    return num_blanks if question_format == "fill_in_blank" else num_options
+
+
+class QuizPool:
+    def __init__(self):
+        init_db()
+
+    def add_questions(self, kb_name: str, question_format: str, q_type: str, variant: int, questions: List[Dict[str, Any]], kb_fingerprint: str) -> int:
+        """写入一批预生成题目，返回写入数量"""
+        now = time.time()
+        rows = [
+            (kb_name, question_format, q_type, variant, serialize_question_data(q), kb_fingerprint, now)
+            for q in questions if q
+        ]
+        if not rows:
+            return 0
+        with get_connection() as conn:
+            conn.executemany('''
+                INSERT INTO quiz_pool (kb_name, question_format, q_type, variant, question_data, kb_fingerprint, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+        return len(rows)
+
+    def take(self, kb_name: str, question_format: str, q_type: str, variant: int, count: int, kb_fingerprint: str) -> List[Dict[str, Any]]:
+        """取出（并移除）至多 count 道与当前知识库指纹一致的题目，先生成的先取"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            self._purge_stale(cursor, kb_name, kb_fingerprint)
+            cursor.execute('''
+                SELECT id, question_data FROM quiz_pool
+                WHERE kb_name = ? AND question_format = ? AND q_type = ? AND variant = ?
+                ORDER BY id
+                LIMIT ?
+            ''', (kb_name, question_format, q_type, variant, count))
+            rows = cursor.fetchall()
+            if rows:
+                cursor.executemany('DELETE FROM quiz_pool WHERE id = ?', [(row['id'],) for row in rows])
+        return [deserialize_question_data(row['question_data']) for row in rows]
+
+    def depth(self, kb_name: str, question_format: str, q_type: str, variant: int, kb_fingerprint: str) -> int:
+        """当前可用的题目数量（不含已失效的题目）"""
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT COUNT(*) FROM quiz_pool
+                WHERE kb_name = ? AND question_format = ? AND q_type = ? AND variant = ? AND kb_fingerprint = ?
+            ''', (kb_name, question_format, q_type, variant, kb_fingerprint))
+            return cursor.fetchone()[0]
+
+    def invalidate(self, kb_name: str) -> int:
+        """清空某个知识库的题目池（知识库索引变化时调用），返回删除数量"""
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM quiz_pool WHERE kb_name = ?', (kb_name,))
+            return cursor.rowcount
+
+    def _purge_stale(self, cursor, kb_name: str, kb_fingerprint: str) -> None:
+        cursor.execute('DELETE FROM quiz_pool WHERE kb_name = ? AND kb_fingerprint != ?', (kb_name, kb_fingerprint))
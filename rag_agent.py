@@ -1,4 +1,4 @@
-from typing import List, Dict, Optional, Tuple, Any
+from typing import List, Dict, Optional, Tuple, Any, Iterator
 import json
 from openai import OpenAI
 from config import (
@@ -8,16 +8,30 @@ from config import (
     VL_MODEL_NAME,
     TOP_K,
     EXERCISE_TOP_K,
-    MEMORY_WINDOW_SIZE,
     COLLECTION_NAME,
     MAX_TOKENS,
     QUIZ_CONTEXT_LENGTH,
+    QUIZ_QUESTIONS_PER_CALL,
+    CHAT_CONTEXT_TOKENS,
+    CONTEXT_NEIGHBOR_WINDOW,
+    ENABLE_ANSWER_CACHE,
     get_openai_client,
 )
 from vector_store import VectorStore
+from context_packer import merge_passages, pack_passages, format_passages
+from conversation_memory import ConversationMemory
+from answer_cache import AnswerCache, source_fingerprint
+from latex_normalizer import LatexNormalizer, normalize_latex
+from image_preprocess import image_data_url
 import re
 import random
+import time
 import concurrent.futures
+import threading
+
+# 并行出题时累计统计数据用的锁
+_quiz_stats_lock = threading.Lock()
+
 
 class RAGAgent:
     def __init__(
@@ -32,6 +46,10 @@ class RAGAgent:
         self.client = get_openai_client(api_key=OPENAI_API_KEY, base_url=OPENAI_API_BASE)
         # 初始化 VectorStore 时指定 collection_name
         self.vector_store = VectorStore(collection_name=kb_name)
+        # 对话记忆：较早的对话在后台压缩为摘要
+        self.memory = ConversationMemory(self.client, self.model)
+        # 可选的语义问答缓存：同一知识库中相似的问题直接复用已有回答
+        self.answer_cache = AnswerCache() if ENABLE_ANSWER_CACHE else None
 
         self.system_prompt = """你是一位专业、亲切的计算机课程助教。
 任务：结合【课程资料】与【对话历史】回答学生问题。
@@ -52,124 +70,118 @@ class RAGAgent:
 """
 
     def retrieve_context(
-        self, query: str, top_k: int = TOP_K
+        self, query: str, top_k: int = TOP_K, token_budget: Optional[int] = CHAT_CONTEXT_TOKENS,
+        neighbor_window: int = CONTEXT_NEIGHBOR_WINDOW
     ) -> Tuple[str, List[Dict]]:
-        """检索相关上下文"""
+        """检索相关上下文
+
+        Args:
+            token_budget: 资料部分的 token 预算，None 表示不限制（例如出题时先取整个候选池）
+            neighbor_window: 每个命中块向前、向后各补充多少个相邻块（按 id 直接读取，不增加检索量）
+        """
         if not query:
             return "", []
 
         results = self.vector_store.search(query, top_k=top_k)
-        
-        formatted_context = ""
-        retrieved_docs = []
+        return self._format_search_results(results, token_budget, neighbor_window)
+
+    def _format_search_results(self, results: Dict, token_budget: Optional[int] = None, neighbor_window: int = 0) -> Tuple[str, List[Dict]]:
+        """将 VectorStore.search 的结果整理为 (上下文字符串, 段落列表)
 
+        命中块先按 neighbor_window 补上相邻块，同一页中相邻或重叠的文档块合并为一段、
+        重复片段去掉，再按检索排名在 token_budget 内装箱。
+        """
         if not results['documents'] or not results['documents'][0]:
             return "", []
 
         documents = results['documents'][0]
         metadatas = results['metadatas'][0]
         distances = results['distances'][0]
+        ids = results['ids'][0] if results.get('ids') else [""] * len(documents)
 
-        for i, (doc, meta, dist) in enumerate(zip(documents, metadatas, distances)):
-            filename = meta.get('filename', '未知文件')
-            page_num = meta.get('page_number', '?')
-            source_label = f"{filename} (第 {page_num} 页)"
-            formatted_context += f"【资料 {i+1}】({source_label}):\n{doc}\n\n"
+        retrieved_docs = []
+        for doc_id, doc, meta, dist in zip(ids, documents, metadatas, distances):
             retrieved_docs.append({
+                "id": doc_id,
                 "content": doc,
                 "metadata": meta,
                 "score": dist,
-                "source_label": source_label
+                "source_label": self._source_label(meta)
             })
 
-        return formatted_context, retrieved_docs
+        if neighbor_window > 0:
+            retrieved_docs = self._expand_with_neighbors(retrieved_docs, neighbor_window)
+
+        passages = pack_passages(merge_passages(retrieved_docs), token_budget)
+        return format_passages(passages), passages
+
+    def _source_label(self, meta: Dict) -> str:
+        filename = meta.get('filename', '未知文件')
+        page_num = meta.get('page_number', '?')
+        return f"{filename} (第 {page_num} 页)"
+
+    def _expand_with_neighbors(self, docs: List[Dict], window: int) -> List[Dict]:
+        """把每个命中块前后 window 个相邻块插到该命中块之后（排名紧随命中块）
+
+        相邻关系来自切分时记录的 prev_id/next_id，每一圈只做一次按 id 的批量读取。
+        """
+        seen = {d["id"] for d in docs if d.get("id")}
+        neighbors: Dict[int, List[Dict]] = {}
+        frontier = [(i, d["id"], d["metadata"]) for i, d in enumerate(docs) if d.get("id")]
+
+        for _ in range(window):
+            wanted = {}
+            for hit_idx, doc_id, meta in frontier:
+                for neighbor_id in self.vector_store.neighbor_ids(doc_id, meta):
+                    if neighbor_id not in seen and neighbor_id not in wanted:
+                        wanted[neighbor_id] = hit_idx
+            if not wanted:
+                break
+
+            fetched = self.vector_store.get_chunks_by_ids(list(wanted))
+            frontier = []
+            for neighbor_id, hit_idx in wanted.items():
+                chunk = fetched.get(neighbor_id)
+                if chunk is None:
+                    continue
+                seen.add(neighbor_id)
+                neighbors.setdefault(hit_idx, []).append({
+                    "id": neighbor_id,
+                    "content": chunk["content"],
+                    "metadata": chunk["metadata"],
+                    "score": docs[hit_idx]["score"],
+                    "source_label": self._source_label(chunk["metadata"])
+                })
+                frontier.append((hit_idx, neighbor_id, chunk["metadata"]))
+
+        expanded = []
+        for i, doc in enumerate(docs):
+            expanded.append(doc)
+            expanded.extend(neighbors.get(i, []))
+        return expanded
 
     def fix_latex_format(self, text: str) -> str:
-        """修复LaTeX格式：将代码块中的LaTeX转换为美元符号格式"""
-        # 1. 匹配 ```...``` 代码块中的LaTeX公式
-        def replace_code_block(match):
-            code_content = match.group(1)
-            # 检查是否是LaTeX公式（包含常见的LaTeX命令）
-            if any(cmd in code_content for cmd in ['\\sum', '\\frac', '\\int', '\\sqrt', '\\left', '\\right', '=', '^', '_']):
-                cleaned = code_content.strip()
-                # 单行用单美元符号，多行用双美元符号
-                if '\n' in cleaned:
-                    return f"$${cleaned}$$"
-                else:
-                    return f"${cleaned}$"
-            return match.group(0)
-        
-        # 匹配 ```latex、```math 或普通 ``` 代码块
-        text = re.sub(r'```(?:latex|math)?\n?(.*?)```', replace_code_block, text, flags=re.DOTALL)
-        
-        # 2. 匹配行内代码 `...` 中的LaTeX
-        def replace_inline_code(match):
-            code_content = match.group(1)
-            if any(cmd in code_content for cmd in ['\\sum', '\\frac', '\\int', '\\sqrt', '\\left', '\\right', '=', '^', '_']):
-                return f"${code_content}$"
-            return match.group(0)
-        
-        text = re.sub(r'`([^`]+)`', replace_inline_code, text)
-        
-        # 3. 修复选择题选项中的LaTeX（A. D(n) = n! \sum... 格式）
-        # 匹配选项行，查找未用美元符号包裹的LaTeX公式
-        lines = text.split('\n')
-        fixed_lines = []
-        for line in lines:
-            # 匹配选项格式：A. 或 B. 等开头
-            if re.match(r'^[A-D][\.\)]\s*', line):
-                # 查找选项字母后的内容
-                option_match = re.match(r'^([A-D][\.\)])\s*(.+)', line)
-                if option_match:
-                    prefix = option_match.group(1)
-                    content = option_match.group(2)
-                    
-                    # 如果内容中包含LaTeX命令但不在美元符号中，需要包裹
-                    # 查找包含反斜杠但不在$...$中的部分
-                    if '\\' in content and '$' not in content:
-                        # 整个内容作为公式包裹
-                        line = f"{prefix} ${content}$"
-                    elif '\\' in content:
-                        # 已经有部分美元符号，需要更精细处理
-                        # 查找未包裹的LaTeX片段
-                        parts = re.split(r'(\$[^$]+\$)', content)
-                        fixed_parts = []
-                        for part in parts:
-                            if part.startswith('$') and part.endswith('$'):
-                                fixed_parts.append(part)  # 已经是包裹的
-                            elif '\\' in part:
-                                fixed_parts.append(f"${part}$")  # 需要包裹
-                            else:
-                                fixed_parts.append(part)  # 普通文本
-                        line = f"{prefix} {''.join(fixed_parts)}"
-            
-            fixed_lines.append(line)
-        
-        return '\n'.join(fixed_lines)
+        """修复LaTeX格式：将代码块中的LaTeX转换为美元符号格式，详见 latex_normalizer"""
+        return normalize_latex(text)
 
-    def generate_response(
+    def is_choice_answer(self, query: str) -> bool:
+        """判断用户输入是否为对上一轮选择题的简单作答（如 "A"、"我选B"）"""
+        return len(query) < 10 and bool(re.match(r'^(我?选|答案是)?[a-dA-D\s]+$', query.strip()))
+
+    def _build_messages(
         self,
         query: str,
         context: str,
         chat_history: Optional[List[Dict]] = None,
         image_data: Optional[str] = None,
         is_quiz: bool = False,
-        skip_retrieval: bool = False 
-    ) -> str:
-        """生成回答"""
-        
+        skip_retrieval: bool = False
+    ) -> Tuple[List[Dict], str]:
+        """构建对话消息，返回 (messages, 使用的模型名)"""
         messages = [{"role": "system", "content": self.system_prompt}]
 
-        # [关键修复] 处理历史记录，防止图片数据污染历史导致报错
-        if chat_history:
-            clean_history = []
-            for msg in chat_history[-MEMORY_WINDOW_SIZE:]: # 只取最近 N 条
-                # 如果历史消息里有 image_base64 字段，我们只取 content 文本
-                # 这样可以避免把巨大的 Base64 字符串重复发给 API，节省 Token 并防止报错
-                content = msg.get("content", "")
-                role = msg.get("role", "user")
-                clean_history.append({"role": role, "content": content})
-            messages.extend(clean_history)
+        # 历史记录：较早对话的摘要 + 最近几条原文（只取文本，不重复发送图片），总量受 token 上限约束
+        messages.extend(self.memory.build_history(chat_history))
 
         # 构建 User Prompt
         if skip_retrieval:
@@ -214,7 +226,7 @@ class RAGAgent:
                 {"type": "text", "text": user_text},
                 {
                     "type": "image_url",
-                    "image_url": {"url": f"data:image/jpeg;base64,{image_data}"}
+                    "image_url": {"url": image_data_url(image_data)}
                 }
             ]
             current_model = self.vl_model 
@@ -232,6 +244,21 @@ class RAGAgent:
         
         new_user_msg = {"role": "user", "content": content_payload}
         messages.append(new_user_msg)
+        return messages, current_model
+
+    def generate_response(
+        self,
+        query: str,
+        context: str,
+        chat_history: Optional[List[Dict]] = None,
+        image_data: Optional[str] = None,
+        is_quiz: bool = False,
+        skip_retrieval: bool = False 
+    ) -> str:
+        """生成回答"""
+        messages, current_model = self._build_messages(
+            query, context, chat_history, image_data=image_data, is_quiz=is_quiz, skip_retrieval=skip_retrieval
+        )
 
         # Determine temperature
         # Quiz generation uses a dedicated function, so this generate_response is mostly for chat.
@@ -254,19 +281,237 @@ class RAGAgent:
         except Exception as e:
             return f"生成回答时出错: {str(e)}"
 
+    def _stream_tokens(self, model: str, messages: List[Dict], temperature: float = 0.3, max_tokens: int = 1500) -> Iterator[str]:
+        """流式调用 API，逐个产出原始 token 文本"""
+        stream = self.client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True  # 启用流式输出
+        )
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta is not None:
+                yield delta
+
+    def _iter_latex_fixed(self, tokens: Iterator[str]) -> Iterator[str]:
+        """对流式 token 增量应用 fix_latex_format，详见 LatexNormalizer"""
+        normalizer = LatexNormalizer()
+        for token in tokens:
+            piece = normalizer.feed(token)
+            if piece:
+                yield piece
+        tail = normalizer.flush()
+        if tail:
+            yield tail
+
+    def generate_response_stream(
+        self,
+        query: str,
+        context: str,
+        chat_history: Optional[List[Dict]] = None,
+        image_data: Optional[str] = None,
+        is_quiz: bool = False,
+        skip_retrieval: bool = False,
+        stats: Optional[Dict[str, Any]] = None
+    ) -> Iterator[str]:
+        """流式生成回答（generate_response 的生成器版本）
+
+        Args:
+            stats: 可选字典，生成结束后写入 ttft（首 token 延迟，秒）、total_latency（总耗时，秒）和 chars（输出字符数）
+        """
+        messages, current_model = self._build_messages(
+            query, context, chat_history, image_data=image_data, is_quiz=is_quiz, skip_retrieval=skip_retrieval
+        )
+        temp_value = 0.7 if is_quiz else 0.3
+        if stats is None:
+            stats = {}
+
+        start = time.perf_counter()
+        ttft = None
+        chars = 0
+        try:
+            for piece in self._iter_latex_fixed(self._stream_tokens(current_model, messages, temperature=temp_value)):
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                chars += len(piece)
+                yield piece
+        except Exception as e:
+            stats["error"] = str(e)
+            yield f"生成回答时出错: {str(e)}"
+        finally:
+            stats["ttft"] = ttft
+            stats["total_latency"] = time.perf_counter() - start
+            stats["chars"] = chars
+            ttft_str = f"{ttft:.2f}s" if ttft is not None else "N/A"
+            print(f" [系统] 流式回答完成: 首 token {ttft_str}, 总耗时 {stats['total_latency']:.2f}s, {chars} 字符")
+
+    def chat_turn(
+        self,
+        query: str,
+        chat_history: Optional[List[Dict]] = None,
+        top_k: int = TOP_K,
+        image_data: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """单轮对话：只检索一次，同时返回上下文、参考资料和流式 token 迭代器
+
+        Returns:
+            {"context": str, "sources": List[Dict], "stream": Iterator[str], "stats": Dict}
+            stream 产出已修复 LaTeX 格式的文本片段，stats 在 stream 耗尽后填充延迟数据；
+            命中问答缓存时 stream 直接产出缓存的回答，stats 中 cache_hit 为 True。
+        """
+        skip_retrieval = self.is_choice_answer(query)
+        cache_key = None
+        if skip_retrieval:
+            context, sources = "", []
+        elif self._cacheable(image_data, chat_history):
+            context, sources, embedding, hit = self._retrieve_with_cache(query, top_k)
+            if hit:
+                stats = {"cache_hit": True, "similarity": hit["similarity"], "ttft": 0.0, "total_latency": 0.0, "chars": len(hit["answer"])}
+                return {
+                    "context": context,
+                    "sources": sources,
+                    "stream": self._remember_stream(iter([hit["answer"]]), chat_history, query),
+                    "stats": stats,
+                }
+            cache_key = (embedding, sources)
+        else:
+            context, sources = self.retrieve_context(query, top_k=top_k)
+
+        stats: Dict[str, Any] = {}
+        stream = self.generate_response_stream(
+            query, context, chat_history, image_data=image_data, skip_retrieval=skip_retrieval, stats=stats
+        )
+        return {
+            "context": context,
+            "sources": sources,
+            "stream": self._remember_stream(stream, chat_history, query, cache_key=cache_key, stats=stats),
+            "stats": stats,
+        }
+
+    def _remember_stream(
+        self,
+        stream: Iterator[str],
+        chat_history: Optional[List[Dict]],
+        query: str,
+        cache_key: Optional[Tuple[List[float], List[Dict]]] = None,
+        stats: Optional[Dict[str, Any]] = None
+    ) -> Iterator[str]:
+        """原样转发 stream，耗尽后把这一轮对话交给记忆组件（后台更新摘要），并按需写入问答缓存"""
+        pieces = []
+        for piece in stream:
+            pieces.append(piece)
+            yield piece
+        answer = "".join(pieces)
+        self.memory.remember_turn(chat_history, query, answer)
+        if cache_key is not None and not (stats or {}).get("error"):
+            self._store_answer(query, cache_key, answer)
+
+    def _cacheable(self, image_data: Optional[str], chat_history: Optional[List[Dict]] = None) -> bool:
+        """是否查询 / 写入问答缓存
+
+        带图片的提问依赖图片内容；对话中已有提问（或已有摘要）时，追问（如"举个例子"）的回答依赖上文，
+        检索只看当前问题，资料指纹无法区分，因此都不走缓存。
+        """
+        if self.answer_cache is None or image_data:
+            return False
+        if self.memory.summary:
+            return False
+        return not any(msg.get("role") == "user" for msg in chat_history or [])
+
+    def _retrieve_with_cache(self, query: str, top_k: int = TOP_K) -> Tuple[str, List[Dict], List[float], Optional[Dict]]:
+        """检索并查询问答缓存，查询向量只计算一次
+
+        缓存条目需同时满足：查询向量相似度超过阈值，且当前检索到的资料与生成该回答时一致。
+        Returns:
+            (context, sources, embedding, 命中的缓存条目或 None)
+        """
+        embedding = self.vector_store.get_embedding(query)
+        results = self.vector_store.search(query, top_k=top_k, embedding=embedding)
+        context, sources = self._format_search_results(results, CHAT_CONTEXT_TOKENS, CONTEXT_NEIGHBOR_WINDOW)
+        hit = None
+        try:
+            entry = self.answer_cache.lookup(self.kb_name, embedding)
+            if entry and sources and entry["source_fingerprint"] == source_fingerprint(sources):
+                self.answer_cache.record_hit(entry["id"])
+                hit = entry
+                print(f" [系统] 命中问答缓存 (相似度 {entry['similarity']:.3f}): {entry['query']}")
+        except Exception as e:
+            print(f"查询问答缓存失败: {e}")
+        return context, sources, embedding, hit
+
+    def _store_answer(self, query: str, cache_key: Tuple[List[float], List[Dict]], answer: str) -> None:
+        embedding, sources = cache_key
+        if not sources or not answer:
+            return
+        try:
+            self.answer_cache.store(self.kb_name, query, embedding, answer, sources)
+        except Exception as e:
+            print(f"写入问答缓存失败: {e}")
+
     def answer_question(self, query: str, chat_history: Optional[List[Dict]] = None, top_k: int = TOP_K, image_data: Optional[str] = None) -> str:
         """命令行入口"""
-        if len(query) < 10 and re.match(r'^(我?选|答案是)?[a-dA-D\s]+$', query.strip()):
-            return self.generate_response(query, "", chat_history, skip_retrieval=True, image_data=image_data)
-        
-        context, _ = self.retrieve_context(query, top_k=top_k)
-        
-        # If no context is found, but we have an image, we should still proceed.
-        # Only return "No relevant data" if neither context nor image exists.
-        if not context and not image_data: 
-            return "无相关资料。"
-            
-        return self.generate_response(query, context, chat_history, image_data=image_data)
+        if self.is_choice_answer(query):
+            answer = self.generate_response(query, "", chat_history, skip_retrieval=True, image_data=image_data)
+        else:
+            cache_key = None
+            if self._cacheable(image_data, chat_history):
+                context, sources, embedding, hit = self._retrieve_with_cache(query, top_k)
+                if hit:
+                    self.memory.remember_turn(chat_history, query, hit["answer"])
+                    return hit["answer"]
+                cache_key = (embedding, sources)
+            else:
+                context, _ = self.retrieve_context(query, top_k=top_k)
+
+            # If no context is found, but we have an image, we should still proceed.
+            # Only return "No relevant data" if neither context nor image exists.
+            if not context and not image_data:
+                return "无相关资料。"
+
+            answer = self.generate_response(query, context, chat_history, image_data=image_data)
+            if cache_key is not None and not answer.startswith("生成回答时出错"):
+                self._store_answer(query, cache_key, answer)
+
+        self.memory.remember_turn(chat_history, query, answer)
+        return answer
+
+    def answer_question_stream(
+        self,
+        query: str,
+        chat_history: Optional[List[Dict]] = None,
+        top_k: int = TOP_K,
+        image_data: Optional[str] = None,
+        stats: Optional[Dict[str, Any]] = None
+    ) -> Iterator[str]:
+        """answer_question 的流式版本，逐段产出回答文本；命中问答缓存时直接产出缓存的回答"""
+        if stats is None:
+            stats = {}
+        if self.is_choice_answer(query):
+            stream = self.generate_response_stream(query, "", chat_history, skip_retrieval=True, image_data=image_data, stats=stats)
+            yield from self._remember_stream(stream, chat_history, query)
+            return
+
+        cache_key = None
+        if self._cacheable(image_data, chat_history):
+            context, sources, embedding, hit = self._retrieve_with_cache(query, top_k)
+            if hit:
+                stats.update({"cache_hit": True, "similarity": hit["similarity"], "ttft": 0.0, "total_latency": 0.0, "chars": len(hit["answer"])})
+                yield from self._remember_stream(iter([hit["answer"]]), chat_history, query)
+                return
+            cache_key = (embedding, sources)
+        else:
+            context, _ = self.retrieve_context(query, top_k=top_k)
+
+        if not context and not image_data:
+            yield "无相关资料。"
+            return
+
+        stream = self.generate_response_stream(query, context, chat_history, image_data=image_data, stats=stats)
+        yield from self._remember_stream(stream, chat_history, query, cache_key=cache_key, stats=stats)
 
     def generate_quiz(self, topic: str, q_type: str, question_format: str = "multiple_choice", num_options: int = 4, num_blanks: int = 3, randomize_context: bool = False, pool_size: int = EXERCISE_TOP_K) -> Dict[str, Any]:
         """生成一道题，返回 JSON 格式
@@ -284,27 +529,110 @@ class RAGAgent:
         # 检索上下文
         if randomize_context:
             # 扩大召回范围，从中随机采样，以增加题目多样性
-            context_str, docs = self.retrieve_context(topic, top_k=pool_size)
-            
+            context, docs = self.retrieve_context(topic, top_k=pool_size, token_budget=None, neighbor_window=0)
             if docs:
-                # 随机采样，数量也稍微增加一点，比如 8 个块，确保信息量
-                sample_size = min(8, len(docs))
-                sampled_docs = random.sample(docs, sample_size)
-                
-                # 重新构建 context 字符串
-                formatted_context = ""
-                for i, doc_info in enumerate(sampled_docs):
-                    formatted_context += f"【资料 {i+1}】({doc_info['source_label']}):\n{doc_info['content']}\n\n"
-                context = formatted_context
+                context = self._sample_quiz_context(docs)
         else:
-            context, _ = self.retrieve_context(topic)
+            context, _ = self.retrieve_context(topic, token_budget=QUIZ_CONTEXT_LENGTH)
         
+        return self._generate_quiz_from_context(context, q_type, question_format, num_options, num_blanks)
+
+    def _generate_quiz_from_context(self, context: str, q_type: str, question_format: str = "multiple_choice", num_options: int = 4, num_blanks: int = 3, stats: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """根据已准备好的上下文出一道题"""
+        messages = self._build_quiz_messages(context, q_type, question_format, num_options, num_blanks)
+
+        try:
+            start = time.perf_counter()
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=0.9, # High temperature for variety
+                response_format={ "type": "json_object" }
+            )
+            self._record_quiz_usage(stats, response, time.perf_counter() - start)
+            return self._parse_quiz_response(response.choices[0].message.content, question_format)
+        except Exception as e:
+            print(f"出题失败: {e}")
+            return {}
+
+    def _generate_quiz_group(self, context: str, k: int, q_type: str, question_format: str = "multiple_choice", num_options: int = 4, num_blanks: int = 3, stats: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """一次请求生成 k 道题；不合格或缺失的题目按单题模式逐道补生成"""
+        if k <= 1:
+            quiz = self._generate_quiz_from_context(context, q_type, question_format, num_options, num_blanks, stats=stats)
+            return [quiz] if quiz else []
+
+        messages = self._build_quiz_group_messages(context, k, q_type, question_format, num_options, num_blanks)
+        questions = []
+        try:
+            start = time.perf_counter()
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=0.9,
+                response_format={ "type": "json_object" }
+            )
+            self._record_quiz_usage(stats, response, time.perf_counter() - start)
+            questions = self._parse_quiz_group_response(response.choices[0].message.content, k, question_format, num_options, num_blanks)
+        except Exception as e:
+            print(f"批量出题失败: {e}")
+
+        missing = k - len(questions)
+        if missing:
+            print(f"批量出题返回 {len(questions)}/{k} 道合格题目，补生成 {missing} 道")
+            if stats is not None:
+                with _quiz_stats_lock:
+                    stats["retried"] = stats.get("retried", 0) + missing
+            for _ in range(missing):
+                quiz = self._generate_quiz_from_context(context, q_type, question_format, num_options, num_blanks, stats=stats)
+                if quiz:
+                    questions.append(quiz)
+        return questions
+
+    def _record_quiz_usage(self, stats: Optional[Dict[str, Any]], response: Any, latency: float) -> None:
+        """累计出题请求的次数、耗时和 token 用量（供 benchmark 使用）"""
+        if stats is None:
+            return
+        usage = getattr(response, "usage", None)
+        with _quiz_stats_lock:
+            stats["calls"] = stats.get("calls", 0) + 1
+            stats["call_latency"] = stats.get("call_latency", 0.0) + latency
+            stats["prompt_tokens"] = stats.get("prompt_tokens", 0) + (getattr(usage, "prompt_tokens", 0) or 0)
+            stats["completion_tokens"] = stats.get("completion_tokens", 0) + (getattr(usage, "completion_tokens", 0) or 0)
+
+    def _sample_quiz_context(self, docs: List[Dict], sample_size: int = 8) -> str:
+        """从候选池中随机采样若干文档块并重新构建 context 字符串"""
+        # 随机采样，数量也稍微增加一点，比如 8 个块，确保信息量
+        sampled_docs = random.sample(docs, min(sample_size, len(docs)))
+        return self._format_quiz_docs(sampled_docs)
+
+    def _format_quiz_docs(self, docs: List[Dict], token_budget: int = QUIZ_CONTEXT_LENGTH) -> str:
+        """按采样顺序在出题的 token 预算内拼接资料"""
+        return format_passages(pack_passages(merge_passages(docs), token_budget))
+
+    def _partition_quiz_contexts(self, docs: List[Dict], count: int, sample_size: int = 8, token_budget: int = QUIZ_CONTEXT_LENGTH) -> List[str]:
+        """把同一个候选池分给 count 道题，每道题 sample_size 个文档块
+
+        候选池打乱后按顺序循环切片：池子足够大时各题的资料互不重叠，
+        不够大时每个文档块被使用的次数也尽量均匀，从而覆盖整个候选池。
+        """
+        if not docs:
+            return [""] * count
+        shuffled = random.sample(docs, len(docs))
+        n = len(shuffled)
+        per_question = min(sample_size, n)
+        return [
+            self._format_quiz_docs([shuffled[(i * per_question + j) % n] for j in range(per_question)], token_budget)
+            for i in range(count)
+        ]
+
+    def _build_quiz_messages(self, context: str, q_type: str, question_format: str, num_options: int, num_blanks: int) -> List[Dict]:
+        """构建出题提示词"""
         # 根据题目格式生成不同的提示词
         if question_format == "fill_in_blank":
             prompt = f"""
 你是一个专业的出题老师。请根据以下资料出一道【{q_type}】类型的填空题。
 资料：
-{context[:QUIZ_CONTEXT_LENGTH]}
+{context}
 
 要求：
 1. 题目类型：{q_type} (偏概念/偏应用)
@@ -334,7 +662,7 @@ JSON格式模板：
             prompt = f"""
 你是一个专业的出题老师。请根据以下资料出一道【{q_type}】类型的单选题。
 资料：
-{context[:QUIZ_CONTEXT_LENGTH]}
+{context}
 
 要求：
 1. 题目类型：{q_type} (偏概念/偏应用)
@@ -352,73 +680,165 @@ JSON格式模板：
 }}
 """
         
-        messages = [
+        return [
             {"role": "system", "content": "你是一个严谨的出题系统，只输出JSON。"},
             {"role": "user", "content": prompt}
         ]
 
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.9, # High temperature for variety
-                response_format={ "type": "json_object" }
-            )
-            content = response.choices[0].message.content
-            quiz_data = json.loads(content)
-            
-            # 确保包含 question_type 字段
-            if "question_type" not in quiz_data:
-                quiz_data["question_type"] = question_format
-            
-            # 修复 JSON 中所有文本字段的 LaTeX 格式
-            if "question" in quiz_data:
-                quiz_data["question"] = self.fix_latex_format(quiz_data["question"])
-            
-            if question_format == "fill_in_blank":
-                if "answers" in quiz_data and isinstance(quiz_data["answers"], list):
-                    quiz_data["answers"] = [self.fix_latex_format(ans) for ans in quiz_data["answers"]]
-            else:  # multiple_choice
-                if "options" in quiz_data and isinstance(quiz_data["options"], list):
-                    quiz_data["options"] = [self.fix_latex_format(opt) for opt in quiz_data["options"]]
-                if "correct_answer" in quiz_data:
-                    quiz_data["correct_answer"] = self.fix_latex_format(quiz_data["correct_answer"])
-            
-            if "explanation" in quiz_data:
-                quiz_data["explanation"] = self.fix_latex_format(quiz_data["explanation"])
-            
-            return quiz_data
-        except Exception as e:
-            print(f"出题失败: {e}")
-            return {}
+    def _build_quiz_group_messages(self, context: str, k: int, q_type: str, question_format: str, num_options: int, num_blanks: int) -> List[Dict]:
+        """构建一次生成 k 道题的提示词（资料的 token 预算已在组装上下文时按题数等比放大）"""
+        if question_format == "fill_in_blank":
+            format_name = "填空题"
+            requirement = f"每道题空格数量：{num_blanks}个，在题目中使用 _____ 表示需要填空的位置"
+            item_template = """{
+            "question_type": "fill_in_blank",
+            "question": "题目内容，使用 _____ 表示空格",
+            "answers": ["第一个空的答案", "第二个空的答案", ...],
+            "explanation": "解析",
+            "summary": "不超过20个字的题目摘要"
+        }"""
+        else:  # multiple_choice
+            format_name = "单选题"
+            requirement = f"每道题选项数量：{num_options}个，correct_answer 必须与 options 中的某一项完全一致"
+            item_template = """{
+            "question_type": "multiple_choice",
+            "question": "题目内容",
+            "options": ["选项1", "选项2", ...],
+            "correct_answer": "正确选项的内容",
+            "explanation": "解析",
+            "summary": "不超过20个字的题目摘要"
+        }"""
+
+        prompt = f"""
+你是一个专业的出题老师。请根据以下资料出 {k} 道【{q_type}】类型的{format_name}。
+资料：
+{context}
+
+要求：
+1. 题目类型：{q_type} (偏概念/偏应用)
+2. {requirement}
+3. {k} 道题应考查资料中不同的知识点，互不重复
+4. 输出格式：必须是严格的JSON对象，questions 字段是恰好包含 {k} 个元素的数组。
+
+JSON格式模板：
+{{
+    "questions": [
+        {item_template},
+        ...
+    ]
+}}
+"""
+        return [
+            {"role": "system", "content": "你是一个严谨的出题系统，只输出JSON。"},
+            {"role": "user", "content": prompt}
+        ]
+
+    def _parse_quiz_group_response(self, content: str, k: int, question_format: str, num_options: int, num_blanks: int) -> List[Dict[str, Any]]:
+        """解析批量出题结果，只保留结构合格的题目（最多 k 道）"""
+        data = json.loads(content)
+        items = data.get("questions", []) if isinstance(data, dict) else data
+        if not isinstance(items, list):
+            return []
+
+        questions = []
+        for item in items[:k]:
+            if self._is_valid_quiz(item, question_format, num_options, num_blanks):
+                questions.append(self._fix_quiz_fields(item, question_format))
+        return questions
 
-    def generate_quiz_batch(self, count: int, topic: str, q_type: str, question_format: str = "multiple_choice", num_options: int = 4, num_blanks: int = 3, pool_size: int = EXERCISE_TOP_K) -> List[Dict[str, Any]]:
-        """并行生成多道题目"""
+    def _is_valid_quiz(self, quiz: Any, question_format: str, num_options: int, num_blanks: int) -> bool:
+        """检查单道题的结构是否完整可用，空格数 / 选项数须与要求一致"""
+        if not isinstance(quiz, dict):
+            return False
+        if not isinstance(quiz.get("question"), str) or not quiz["question"].strip():
+            return False
+        if question_format == "fill_in_blank":
+            answers = quiz.get("answers")
+            return isinstance(answers, list) and len(answers) == num_blanks and all(isinstance(a, str) for a in answers)
+        options = quiz.get("options")
+        if not isinstance(options, list) or len(options) != num_options or not all(isinstance(o, str) for o in options):
+            return False
+        return quiz.get("correct_answer") in options
+
+    def _parse_quiz_response(self, content: str, question_format: str) -> Dict[str, Any]:
+        """解析出题结果 JSON 并修复各字段的 LaTeX 格式"""
+        return self._fix_quiz_fields(json.loads(content), question_format)
+
+    def _fix_quiz_fields(self, quiz_data: Dict[str, Any], question_format: str) -> Dict[str, Any]:
+        """补全 question_type 并修复各文本字段的 LaTeX 格式"""
+        # 确保包含 question_type 字段
+        if "question_type" not in quiz_data:
+            quiz_data["question_type"] = question_format
+        
+        # 修复 JSON 中所有文本字段的 LaTeX 格式
+        if "question" in quiz_data:
+            quiz_data["question"] = self.fix_latex_format(quiz_data["question"])
+        
+        if question_format == "fill_in_blank":
+            if "answers" in quiz_data and isinstance(quiz_data["answers"], list):
+                quiz_data["answers"] = [self.fix_latex_format(ans) for ans in quiz_data["answers"]]
+        else:  # multiple_choice
+            if "options" in quiz_data and isinstance(quiz_data["options"], list):
+                quiz_data["options"] = [self.fix_latex_format(opt) for opt in quiz_data["options"]]
+            if "correct_answer" in quiz_data:
+                quiz_data["correct_answer"] = self.fix_latex_format(quiz_data["correct_answer"])
+        
+        if "explanation" in quiz_data:
+            quiz_data["explanation"] = self.fix_latex_format(quiz_data["explanation"])
+        
+        return quiz_data
+
+    def generate_quiz_batch(self, count: int, topic: str, q_type: str, question_format: str = "multiple_choice", num_options: int = 4, num_blanks: int = 3, pool_size: int = EXERCISE_TOP_K, questions_per_call: Optional[int] = None, stats: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """并行生成多道题目（整批只检索一次候选池，再分给各题）
+
+        Args:
+            questions_per_call: 每次 LLM 请求生成的题目数 K，默认取 QUIZ_QUESTIONS_PER_CALL；
+                K > 1 时题目以 JSON 数组返回，不合格的题目单独补生成
+            stats: 可选字典，写入请求次数、token 用量等统计
+        """
         print(f"开始并行生成 {count} 道题目...")
         questions = []
+        if count <= 0:
+            return questions
+
+        k = max(1, min(questions_per_call or QUIZ_QUESTIONS_PER_CALL, count))
+        _, docs = self.retrieve_context(topic, top_k=pool_size, token_budget=None, neighbor_window=0)
+        # 每次请求分到 K 道题的资料量，请求数为 ceil(count / K)
+        group_sizes = [min(k, count - i) for i in range(0, count, k)]
+        contexts = self._partition_quiz_contexts(docs, len(group_sizes), sample_size=8 * k, token_budget=QUIZ_CONTEXT_LENGTH * k)
         
         # 使用 ThreadPoolExecutor 并行调用
         # 注意：OpenAI 客户端是线程安全的
-        with concurrent.futures.ThreadPoolExecutor(max_workers=min(count, 5)) as executor:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(group_sizes), 5)) as executor:
             # 提交任务
             futures = [
-                executor.submit(self.generate_quiz, topic, q_type, question_format, num_options, num_blanks, randomize_context=True, pool_size=pool_size) 
-                for _ in range(count)
+                executor.submit(self._generate_quiz_group, context, size, q_type, question_format, num_options, num_blanks, stats) 
+                for context, size in zip(contexts, group_sizes)
             ]
             
             # 获取结果
             for future in concurrent.futures.as_completed(futures):
                 try:
-                    q = future.result()
-                    if q:
-                        questions.append(q)
+                    questions.extend(future.result())
                 except Exception as e:
                     print(f"并行任务出错: {e}")
                     
         return questions
 
-    def generate_outline(self) -> str:
-        """根据知识库生成复习大纲"""
+    def generate_outline(self, progress_callback=None) -> str:
+        """根据知识库生成复习大纲（map-reduce：逐文件摘要后合并，覆盖整个知识库）
+
+        Args:
+            progress_callback: 可选，接收进度描述文本的回调
+        """
+        from outline_engine import OutlineEngine
+        try:
+            return OutlineEngine(self, progress_callback=progress_callback).generate()
+        except Exception as e:
+            return f"生成大纲失败: {e}"
+
+    def _outline_max_tokens(self) -> int:
+        """根据知识库文件总大小计算最终大纲的 max_tokens"""
         # 导入 KBManager 获取文件大小
         from kb_manager import KBManager
         kb_manager = KBManager()
@@ -427,48 +847,13 @@ JSON格式模板：
         total_size_bytes = kb_manager.get_kb_total_size(self.kb_name)
         total_size_mb = total_size_bytes / (1024 * 1024)  # 转换为 MB
         
-        # 计算知识库文档数量（用于 top_k）
-        total_docs = self.vector_store.get_collection_count()
-        # 动态调整 top_k，至少20，最多100
-        dynamic_top_k = min(max(20, total_docs // 2), 10000)
-        
         # 动态调整 max_tokens，与文件总大小成正比
         # 基础值：2000 tokens
         # 每 1 MB 增加 200 tokens
         # 最小 2000，最大 8000
         base_tokens = 2000
         extra_tokens = int(total_size_mb * 200)
-        dynamic_max_tokens = min(max(base_tokens, base_tokens + extra_tokens), 8000)
-        
-        # 检索更多上下文
-        context, _ = self.retrieve_context("目录 章节 大纲 核心概念 重点 Summary", top_k=dynamic_top_k)
-        
-        prompt = f"""
-请根据以下检索到的课程资料片段，整理生成一份**非常详细**的复习大纲。
-资料片段（共检索到 {dynamic_top_k} 个相关片段）：
-{context[:15000]} 
-
-要求：
-1. 使用 Markdown 格式。
-2. 结构清晰，分章节或知识模块。
-3. **内容详实**：包含核心概念、定义、定理和重点公式（如有）。不要只列标题。
-4. 篇幅应与资料量相匹配，尽可能覆盖所有重要知识点。
-"""
-        messages = [
-            {"role": "system", "content": "你是一个课程助教，擅长总结大纲。"},
-            {"role": "user", "content": prompt}
-        ]
-        
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.5,
-                max_tokens=dynamic_max_tokens
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            return f"生成大纲失败: {e}"
+        return min(max(base_tokens, base_tokens + extra_tokens), 8000)
 
     def refine_outline(self, current_outline: str, user_feedback: str) -> str:
         """根据用户反馈修改大纲"""
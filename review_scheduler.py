@@ -0,0 +1,101 @@
+"""
+Spaced-Repetition Scheduling for Mistake Review.
+
+SM-2 style: every question keeps an ease factor, its current interval and the
+number of consecutive correct reviews. Each answer yields the next state and
+the time the question is due again, stored on the question row (due_at,
+interval_days, ease, repetitions) so the review queue is a plain indexed
+query (QuestionDB.get_due_questions) instead of sorting whole books in Python.
+
+Answers are graded on the SM-2 scale 0-5; the practice UI only knows right or
+wrong, which map to GRADE_CORRECT and GRADE_WRONG. A wrong answer restarts the
+interval ladder and brings the question back after RELEARN_MINUTES.
+"""
+import math
+import time
+from typing import Any, Dict, Optional
+
+DEFAULT_EASE = 2.5
+MIN_EASE = 1.3
+MAX_EASE = 3.0
+# 连续答对第 1、2 次后的间隔（天），之后按 ease 倍增
+FIRST_INTERVALS = (1.0, 6.0)
+MAX_INTERVAL_DAYS = 365.0
+# 答错后多久再次到期（分钟）
+RELEARN_MINUTES = 10
+
+GRADE_CORRECT = 4
+GRADE_WRONG = 2
+# 低于该分数视为没有掌握
+PASSING_GRADE = 3
+
+DAY_SECONDS = 86400
+
+
+def initial_state(now: Optional[float] = None) -> Dict[str, Any]:
+    """新错题的调度状态：立即到期"""
+    return {
+        "due_at": time.time() if now is None else now,
+        "interval_days": 0.0,
+        "ease": DEFAULT_EASE,
+        "repetitions": 0,
+    }
+
+
+def next_state(
+    interval_days: Optional[float],
+    ease: Optional[float],
+    repetitions: Optional[int],
+    grade: int,
+    now: Optional[float] = None
+) -> Dict[str, Any]:
+    """根据本次作答评分（0-5）计算下一次的调度状态 {"due_at", "interval_days", "ease", "repetitions"}
+
+    旧数据中为 NULL 的字段按新题处理。
+    """
+    now = time.time() if now is None else now
+    interval_days = interval_days or 0.0
+    ease = ease or DEFAULT_EASE
+    repetitions = repetitions or 0
+    grade = min(max(grade, 0), 5)
+
+    ease += 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02)
+    ease = min(max(ease, MIN_EASE), MAX_EASE)
+
+    if grade < PASSING_GRADE:
+        return {
+            "due_at": now + RELEARN_MINUTES * 60,
+            "interval_days": 0.0,
+            "ease": ease,
+            "repetitions": 0,
+        }
+
+    if repetitions < len(FIRST_INTERVALS):
+        interval_days = FIRST_INTERVALS[repetitions]
+    else:
+        interval_days = float(math.ceil(max(interval_days, 1.0) * ease))
+    interval_days = min(interval_days, MAX_INTERVAL_DAYS)
+    return {
+        "due_at": now + interval_days * DAY_SECONDS,
+        "interval_days": interval_days,
+        "ease": ease,
+        "repetitions": repetitions + 1,
+    }
+
+
+def grade_for(is_correct: bool) -> int:
+    return GRADE_CORRECT if is_correct else GRADE_WRONG
+
+
+def describe_due(due_at: Optional[float], now: Optional[float] = None) -> str:
+    """到期时间的简短描述，用于界面显示"""
+    if due_at is None:
+        return "现在"
+    seconds = due_at - (time.time() if now is None else now)
+    if seconds <= 0:
+        return "现在"
+    if seconds < 3600:
+        return f"{math.ceil(seconds / 60)} 分钟后"
+    if seconds < DAY_SECONDS:
+        return f"{int(seconds // 3600)} 小时后"
+    return f"{int(round(seconds / DAY_SECONDS))} 天后"
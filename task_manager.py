@@ -134,6 +134,64 @@ def start_rebuild_task(kb_name, kb_manager_cls):
     t.start()
     return task_id
 
+def start_quiz_pool_refill_task(kb_name, question_format, q_type, num_options, num_blanks, target_depth, topic="Core Concepts and Key Principles"):
+    """
+    Start a background thread that tops the quiz pool for this key up to target_depth.
+    Only one refill per (kb, format, type, variant) runs at a time.
+    """
+    from quiz_pool import QuizPool, pool_variant
+    variant = pool_variant(question_format, num_options, num_blanks)
+    pool_key = (kb_name, question_format, q_type, variant)
+
+    for existing_id, task in list(TASKS.items()):
+        if task["type"] == "quiz_pool" and task.get("pool_key") == pool_key and task["status"] == "running":
+            return existing_id
+
+    task_id = f"quiz_pool_{kb_name}_{question_format}_{q_type}_{variant}_{int(time.time())}"
+    TASKS[task_id] = {
+        "type": "quiz_pool",
+        "status": "running",
+        "message": "正在预生成题目...",
+        "progress": 0.0,
+        "kb_name": kb_name,
+        "pool_key": pool_key
+    }
+
+    def worker():
+        try:
+            from kb_manager import KBManager
+            from rag_agent import RAGAgent
+            from config import EXERCISE_TOP_K
+
+            pool = QuizPool()
+            fingerprint = KBManager().get_kb_fingerprint(kb_name)
+            needed = target_depth - pool.depth(kb_name, question_format, q_type, variant, fingerprint)
+            if needed > 0:
+                agent = RAGAgent(kb_name=kb_name)
+                if agent.vector_store.get_collection_count() > 0:
+                    questions = agent.generate_quiz_batch(
+                        count=needed,
+                        topic=topic,
+                        q_type=q_type,
+                        question_format=question_format,
+                        num_options=num_options,
+                        num_blanks=num_blanks,
+                        pool_size=EXERCISE_TOP_K
+                    )
+                    added = pool.add_questions(kb_name, question_format, q_type, variant, questions, fingerprint)
+                    TASKS[task_id]["message"] = f"已预生成 {added} 道题目"
+
+            TASKS[task_id]["status"] = "completed"
+            TASKS[task_id]["progress"] = 1.0
+        except Exception as e:
+            TASKS[task_id]["status"] = "failed"
+            TASKS[task_id]["message"] = f"预生成失败: {str(e)}"
+            print(f"Quiz pool refill failed: {e}")
+
+    t = threading.Thread(target=worker, daemon=True)
+    t.start()
+    return task_id
+
 def clear_completed_tasks():
     to_remove = [k for k, v in TASKS.items() if v["status"] in ["completed", "failed"]]
     for k in to_remove:
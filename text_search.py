@@ -0,0 +1,56 @@
+"""
+Tokenization for SQLite FTS5 Full-Text Search.
+
+FTS5's built-in tokenizers do not segment Chinese, so text is tokenized in
+Python and stored as space-separated tokens. `search_tokens` is registered as
+a SQL function on every connection (see database.py) and used by the triggers
+that keep the FTS tables in sync; queries go through `build_match_query`.
+
+Chinese runs are indexed as character unigrams and bigrams rather than
+dictionary words (jieba), so any substring of the original text can be found
+regardless of how a segmenter would have split it: a query is the set of its
+bigrams (or the single character), all of which must match. Other text is
+split into lowercased words.
+"""
+import re
+from typing import List, Optional
+
+_CJK = '㐀-鿿豈-﫿'
+_RUN_RE = re.compile(rf'[{_CJK}]+|[^\W{_CJK}]+')
+_CJK_RE = re.compile(rf'[{_CJK}]')
+
+
+def _runs(text: str):
+    """(run, is_cjk) for each maximal run of Chinese characters or of other word characters."""
+    for run in _RUN_RE.findall(text.lower()):
+        yield run, _CJK_RE.match(run) is not None
+
+
+def search_tokens(text: Optional[str]) -> str:
+    """Space-separated tokens to store in an FTS5 column (SQL function)."""
+    if not text:
+        return ''
+    tokens: List[str] = []
+    for run, is_cjk in _runs(text):
+        if is_cjk:
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return ' '.join(tokens)
+
+
+def build_match_query(query: str) -> Optional[str]:
+    """FTS5 MATCH expression requiring every query token, or None if nothing is searchable.
+
+    Other words match as prefixes, so a partially typed word already finds results.
+    """
+    terms: List[str] = []
+    for run, is_cjk in _runs(query):
+        if is_cjk and len(run) > 1:
+            terms.extend(f'"{run[i:i + 2]}"' for i in range(len(run) - 1))
+        elif is_cjk:
+            terms.append(f'"{run}"')
+        else:
+            terms.append(f'"{run}"*')
+    return ' '.join(dict.fromkeys(terms)) or None
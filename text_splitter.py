@@ -1,7 +1,14 @@
-from typing import List, Dict
+import hashlib
+from typing import List, Dict, Tuple
 from tqdm import tqdm
 
 
+def make_chunk_id(filename: str, filepath: str, page_number, chunk_id) -> str:
+    """文档块在向量库中的 id：文件名 + 路径哈希（解决同名文件冲突）+ 页码 + 块序号"""
+    path_hash = hashlib.md5(filepath.encode('utf-8')).hexdigest()[:6]
+    return f"{filename}_{path_hash}_p{page_number}_c{chunk_id}"
+
+
 class TextSplitter:
     def __init__(self, chunk_size: int, chunk_overlap: int, size_error: int, overlap_error: int):
         self.chunk_size = chunk_size
@@ -19,9 +26,13 @@ class TextSplitter:
         3. 尽量在句子边界处切分（查找句子结束符：。！？.!?\n\n）
         4. 返回切分后的文本块列表
         """
+        return [text[start:end] for start, end in self.split_spans(text)]
+
+    def split_spans(self, text: str) -> List[Tuple[int, int]]:
+        """切分逻辑同 split_text，返回每个块在原文中的字符区间 [start, end)"""
         if not text:
             return []
-        chunks = []
+        spans = []
         text_len = len(text)
         start_idx = 0
         
@@ -75,10 +86,9 @@ class TextSplitter:
                             chunk_end = i + 2
                             break
             
-            # 提取chunk
-            chunk = text[chunk_start:chunk_end]
-            if chunk:  # 确保chunk不为空
-                chunks.append(chunk)
+            # 记录chunk区间
+            if chunk_end > chunk_start:  # 确保chunk不为空
+                spans.append((chunk_start, chunk_end))
             
             # 更新下一个chunk的开始点（当前chunk的结束点）
             start_idx = chunk_end
@@ -87,7 +97,7 @@ class TextSplitter:
             if start_idx == chunk_start:
                 start_idx += 1
 
-        return chunks
+        return spans
 
     def split_by_markdown_headers(self, text: str) -> List[str]:
         """按照markdown标题切分文本
@@ -136,6 +146,10 @@ class TextSplitter:
         """切分多个文档。
         对于PDF和PPT，已经按页/幻灯片分割，不再进行二次切分
         对于DOCX和TXT，进行文本切分
+
+        每个块记录在所属页（或整个文档）中的字符区间 char_start/char_end，
+        以及同一文件中前后相邻块的 id（prev_id/next_id，跨页相连，没有则为空串），
+        检索时可据此直接取出命中块的上下文。
         """
         chunks_with_metadata = []
 
@@ -148,9 +162,10 @@ class TextSplitter:
                 # 对于 PDF/PPTX，如果单页内容超过 chunk_size，也会被切分
                 # 同时保留页码信息
                 page_num = doc.get("page_number", 0)
-                chunks = self.split_text(content)
+                spans = self.split_spans(content)
                 
-                for i, chunk in enumerate(chunks):
+                for i, (start, end) in enumerate(spans):
+                    chunk = content[start:end]
                     if not chunk.strip():
                         continue
                         
@@ -161,6 +176,8 @@ class TextSplitter:
                         "filetype": filetype,
                         "page_number": page_num,
                         "chunk_id": i,
+                        "char_start": start,
+                        "char_end": end,
                         "images": doc.get("images", []),
                     }
                     chunks_with_metadata.append(chunk_data)
@@ -169,21 +186,43 @@ class TextSplitter:
                 # 先按照markdown标题切分
                 sections = self.split_by_markdown_headers(content)
                 chunk_id = 0
+                cursor = 0
                 for section in sections:
+                    # section 在原文中的起点，用于换算块的字符区间
+                    section_start = content.find(section, cursor)
+                    if section_start == -1:
+                        section_start = cursor
+                    cursor = section_start + len(section)
                     # 对每个section再调用split_text进行切分
-                    section_chunks = self.split_text(section)
-                    for chunk in section_chunks:
+                    for start, end in self.split_spans(section):
                         chunk_data = {
-                            "content": chunk,
+                            "content": section[start:end],
                             "filename": doc.get("filename", "unknown"),
                             "filepath": doc.get("filepath", ""),
                             "filetype": filetype,
                             "page_number": 0,
                             "chunk_id": chunk_id,
+                            "char_start": section_start + start,
+                            "char_end": section_start + end,
                             "images": [],
                         }
                         chunks_with_metadata.append(chunk_data)
                         chunk_id += 1
 
+        self._link_neighbors(chunks_with_metadata)
         print(f"\n文档处理完成，共 {len(chunks_with_metadata)} 个块")
         return chunks_with_metadata
+
+    def _link_neighbors(self, chunks: List[Dict]) -> None:
+        """为每个块分配 id，并把同一文件中按顺序相邻的块互相链接"""
+        last_by_file = {}
+        for chunk in chunks:
+            chunk["id"] = make_chunk_id(chunk["filename"], chunk["filepath"], chunk["page_number"], chunk["chunk_id"])
+            chunk["prev_id"] = ""
+            chunk["next_id"] = ""
+            file_key = (chunk["filename"], chunk["filepath"])
+            prev = last_by_file.get(file_key)
+            if prev is not None:
+                prev["next_id"] = chunk["id"]
+                chunk["prev_id"] = prev["id"]
+            last_by_file[file_key] = chunk
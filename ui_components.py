@@ -114,8 +114,23 @@ def settings_dialog():
         new_settings["TOP_K"] = st.text_input("单次检索文档数 (TOP_K，默认6)", value=get_val("TOP_K", "6"), key="s_top_k")
         new_settings["EXERCISE_TOP_K"] = st.text_input("随机出题候选池 (默认100)", value=get_val("EXERCISE_TOP_K", "100"), help="未指定主题时，从多少个相关文档中采样。", key="s_ex_top_k")
         new_settings["EXERCISE_TOP_K_TOPIC"] = st.text_input("指定主题候选池 (默认30)", value=get_val("EXERCISE_TOP_K_TOPIC", "30"), help="指定主题时，从多少个最相关的文档中采样（越小越聚焦）。", key="s_ex_top_k_topic")
-        new_settings["QUIZ_CONTEXT_LENGTH"] = st.text_input("出题上下文长度 (默认2000)", value=get_val("QUIZ_CONTEXT_LENGTH", "2000"), help="截取多少字符发给 AI 用于出题。太短可能导致信息不足，太长可能导致Token消耗过大。", key="s_quiz_ctx_len")
-        new_settings["MEMORY_WINDOW_SIZE"] = st.text_input("对话记忆轮数（默认10）", value=get_val("MEMORY_WINDOW_SIZE", "10"), key="s_mem_win")
+        new_settings["CONTEXT_NEIGHBOR_WINDOW"] = st.text_input("相邻块扩展 (默认1)", value=get_val("CONTEXT_NEIGHBOR_WINDOW", "1"), help="每个检索命中的文档块前后各补充几个相邻块，让资料上下文连贯，比调大 TOP_K 更省 token。0 表示关闭；需重建索引后才能跨页扩展。", key="s_ctx_neighbor")
+        new_settings["CHAT_CONTEXT_TOKENS"] = st.text_input("问答资料 Token 预算 (默认6000)", value=get_val("CHAT_CONTEXT_TOKENS", "6000"), help="检索结果合并相邻/重叠片段、去重后，按相关度装入不超过该 token 数的资料。", key="s_chat_ctx_tok")
+        new_settings["QUIZ_CONTEXT_LENGTH"] = st.text_input("出题资料 Token 预算 (默认2000)", value=get_val("QUIZ_CONTEXT_LENGTH", "2000"), help="每道题发给 AI 的资料 token 数（中文约 1 字 1 token）。太少可能导致信息不足，太多可能导致Token消耗过大。", key="s_quiz_ctx_len")
+        new_settings["QUIZ_QUESTIONS_PER_CALL"] = st.text_input("每次请求生成题数 (默认1)", value=get_val("QUIZ_QUESTIONS_PER_CALL", "1"), help="批量出题时每次 AI 请求生成几道题。调大可减少请求次数和重复的提示词开销，不合格的题目会单独补生成。", key="s_quiz_per_call")
+        enable_quiz_pool = get_val("ENABLE_QUIZ_POOL", "True").lower() == "true"
+        new_settings["ENABLE_QUIZ_POOL"] = str(st.checkbox("后台预生成题目", value=enable_quiz_pool, help="未指定主题时直接从预生成的题目池取题，并在后台自动补充。知识库文件变化后题目池自动失效。", key="s_quiz_pool"))
+        new_settings["QUIZ_POOL_TARGET_DEPTH"] = st.text_input("预生成题目数 (默认10)", value=get_val("QUIZ_POOL_TARGET_DEPTH", "10"), help="每个知识库、题目格式与类型组合保留的预生成题目数。", key="s_quiz_pool_depth")
+        new_settings["MEMORY_WINDOW_SIZE"] = st.text_input("对话记忆轮数（默认10）", value=get_val("MEMORY_WINDOW_SIZE", "10"), help="最多保留原文的最近消息条数，同时受对话历史 Token 上限约束。", key="s_mem_win")
+        new_settings["CHAT_HISTORY_TOKENS"] = st.text_input("对话历史 Token 上限 (默认2000)", value=get_val("CHAT_HISTORY_TOKENS", "2000"), help="每次提问时随附的历史（摘要 + 最近原文）不超过该 token 数。", key="s_chat_hist_tok")
+        enable_mem_summary = get_val("ENABLE_MEMORY_SUMMARY", "True").lower() == "true"
+        new_settings["ENABLE_MEMORY_SUMMARY"] = str(st.checkbox("压缩较早的对话为摘要", value=enable_mem_summary, help="每轮回答后在后台把较早的对话合并为摘要，长对话的提示词不再随轮数增长。", key="s_mem_summary"))
+        enable_answer_cache = get_val("ENABLE_ANSWER_CACHE", "False").lower() == "true"
+        new_settings["ENABLE_ANSWER_CACHE"] = str(st.checkbox("语义问答缓存", value=enable_answer_cache, help="同一知识库中与已回答问题足够相似、且检索到的资料相同的提问直接复用已有回答；对话中的追问依赖上文，不使用缓存。知识库文件变化后缓存自动失效。", key="s_answer_cache"))
+        new_settings["ANSWER_CACHE_THRESHOLD"] = st.text_input("问答缓存相似度阈值 (0~1，默认0.95)", value=get_val("ANSWER_CACHE_THRESHOLD", "0.95"), key="s_answer_cache_th")
+        new_settings["ANSWER_CACHE_TTL_HOURS"] = st.text_input("问答缓存有效期 (小时，默认168)", value=get_val("ANSWER_CACHE_TTL_HOURS", "168"), key="s_answer_cache_ttl")
+        new_settings["ANSWER_CACHE_MAX_ENTRIES"] = st.text_input("每个知识库缓存回答数 (默认500)", value=get_val("ANSWER_CACHE_MAX_ENTRIES", "500"), help="超出后淘汰最久未命中的回答。", key="s_answer_cache_max")
+        new_settings["OUTLINE_MAP_CONCURRENCY"] = st.text_input("大纲摘要并发数 (默认4)", value=get_val("OUTLINE_MAP_CONCURRENCY", "4"), help="生成大纲时同时为多少个文件片段生成摘要。", key="s_outline_conc")
 
     with t_txt:
         st.subheader("知识库切分参数")
@@ -166,7 +181,111 @@ def settings_dialog():
                 st.error(f"❌ 未找到命令: {path_to_test}\n请检查路径是否正确，或是否已安装 Pandoc。")
             except Exception as e:
                 st.error(f"❌ 测试出错: {e}")
-        
+
+        st.divider()
+        st.subheader("网络连接池")
+        st.caption("所有模型 API 调用按 Base URL 共享连接池，复用 TLS 握手与长连接。HTTP/2 需要额外安装 h2 包。")
+        new_settings["HTTP_MAX_CONNECTIONS"] = st.text_input("最大连接数 (默认200)", value=get_val("HTTP_MAX_CONNECTIONS", "200"), key="s_http_max_conn")
+        new_settings["HTTP_MAX_KEEPALIVE_CONNECTIONS"] = st.text_input("最大空闲长连接数 (默认50)", value=get_val("HTTP_MAX_KEEPALIVE_CONNECTIONS", "50"), key="s_http_keepalive")
+        new_settings["HTTP_KEEPALIVE_EXPIRY"] = st.text_input("空闲连接保留秒数 (默认60)", value=get_val("HTTP_KEEPALIVE_EXPIRY", "60"), key="s_http_keepalive_exp")
+        new_settings["HTTP_TIMEOUT"] = st.text_input("请求超时秒数 (默认600)", value=get_val("HTTP_TIMEOUT", "600"), key="s_http_timeout")
+        new_settings["HTTP_CONNECT_TIMEOUT"] = st.text_input("建连超时秒数 (默认10)", value=get_val("HTTP_CONNECT_TIMEOUT", "10"), key="s_http_conn_timeout")
+        http2_enabled = get_val("HTTP2_ENABLED", "True").lower() == "true"
+        new_settings["HTTP2_ENABLED"] = str(st.checkbox("启用 HTTP/2", value=http2_enabled, key="s_http2"))
+
+        import http_pool
+        pool_stats = http_pool.get_pool_stats()
+        if pool_stats:
+            st.markdown("##### 连接池统计")
+            st.dataframe(
+                [
+                    {
+                        "Base URL": s["base_url"] or "(默认)",
+                        "请求数": s["requests"],
+                        "新建连接": s["new_connections"],
+                        "复用连接": s["reused_connections"],
+                        "复用率": f"{s['reuse_rate']:.0%}",
+                        "平均延迟(s)": round(s["avg_latency"], 3),
+                        "最大延迟(s)": round(s["max_latency"], 3),
+                        "协议": ", ".join(s["http_versions"]),
+                    }
+                    for s in pool_stats
+                ],
+                use_container_width=True,
+                hide_index=True
+            )
+
+        st.divider()
+        st.subheader("后台任务")
+        st.caption("错题识别等耗时处理由固定数量的后台线程依次执行，失败后自动重试，应用重启后继续处理未完成的任务。")
+        new_settings["JOB_WORKERS"] = st.text_input("后台并发数 (默认2)", value=get_val("JOB_WORKERS", "2"), help="同时处理的任务数，重启应用后生效。", key="s_job_workers")
+        new_settings["JOB_MAX_ATTEMPTS"] = st.text_input("最多尝试次数 (默认3)", value=get_val("JOB_MAX_ATTEMPTS", "3"), key="s_job_attempts")
+        new_settings["JOB_RETRY_BASE_SECONDS"] = st.text_input("首次重试等待秒数 (默认5)", value=get_val("JOB_RETRY_BASE_SECONDS", "5"), help="之后每次重试等待时间翻倍。", key="s_job_retry_base")
+        pipeline_modes = ["combined", "staged"]
+        pipeline_mode = get_val("MISTAKE_PIPELINE", "combined")
+        new_settings["MISTAKE_PIPELINE"] = st.selectbox(
+            "错题识别流程",
+            pipeline_modes,
+            index=pipeline_modes.index(pipeline_mode) if pipeline_mode in pipeline_modes else 0,
+            format_func=lambda m: {"combined": "合并 (识别时同时判断题型，文字题优先用本地规则)", "staged": "分步 (识别、判断题型、解题各调用一次)"}[m],
+            help="合并模式每道错题通常少一次模型调用。两种模式的耗时与 token 用量可在错题整理页的“各阶段耗时”中对比。",
+            key="s_mistake_pipeline"
+        )
+
+        st.divider()
+        st.subheader("答题记录归档")
+        st.caption("超过保留天数的答题记录定期移入压缩归档文件并整理数据库，统计数据不受影响，导出时仍会包含归档的记录。")
+        new_settings["HISTORY_RETENTION_DAYS"] = st.text_input("数据库中保留的天数 (默认365，0 表示不归档)", value=get_val("HISTORY_RETENTION_DAYS", "365"), key="s_history_retention")
+        new_settings["HISTORY_MAINTENANCE_HOURS"] = st.text_input("归档间隔小时数 (默认24)", value=get_val("HISTORY_MAINTENANCE_HOURS", "24"), help="修改后从下一次归档起生效。", key="s_history_interval")
+
+        import history_archive
+        storage = history_archive.get_storage_stats()
+        c_live, c_arch, c_db = st.columns(3)
+        c_live.metric("数据库中的记录", storage["live_rows"])
+        c_arch.metric("已归档记录", storage["archived_rows"], help=f"{storage['segments']} 个归档文件，共 {storage['archive_bytes'] / 1024:.0f} KB")
+        c_db.metric("数据库大小", f"{storage['db_bytes'] / 1024 / 1024:.1f} MB", help=f"空闲页 {storage['free_ratio']:.0%}")
+        if st.button("🗜️ 立即归档并整理数据库", key="s_history_run_now"):
+            history_archive.run_now(force_vacuum=True)
+            st.toast("已加入后台任务", icon="🗜️")
+
+        st.divider()
+        st.subheader("图片预处理")
+        st.caption("错题识别、对话图片和课件图片描述在发送给视觉模型前统一旋正、缩放并重新压缩，保存后立即生效。")
+        new_settings["IMAGE_MAX_SIDE"] = st.text_input("最长边像素 (默认1600，0 表示不缩放)", value=get_val("IMAGE_MAX_SIDE", "1600"), key="s_image_max_side")
+        image_formats = ["jpeg", "webp"]
+        image_format = get_val("IMAGE_FORMAT", "jpeg")
+        new_settings["IMAGE_FORMAT"] = st.selectbox(
+            "编码格式",
+            image_formats,
+            index=image_formats.index(image_format) if image_format in image_formats else 0,
+            format_func=lambda f: {"jpeg": "JPEG (兼容性最好)", "webp": "WebP (体积更小，需模型服务支持)"}[f],
+            key="s_image_format"
+        )
+        new_settings["IMAGE_QUALITY"] = st.text_input("编码质量 (1~100，默认85)", value=get_val("IMAGE_QUALITY", "85"), key="s_image_quality")
+        auto_crop = get_val("IMAGE_AUTO_CROP", "False").lower() == "true"
+        new_settings["IMAGE_AUTO_CROP"] = str(st.checkbox("自动裁掉四周空白", value=auto_crop, help="只保留有文字的区域，适合留白较多的拍照题目。", key="s_image_auto_crop"))
+
+        import image_preprocess
+        image_stats = image_preprocess.get_image_stats()
+        if image_stats:
+            st.markdown("##### 预处理统计")
+            purpose_names = {"ocr": "错题识别", "attachment": "错题配图", "chat": "对话图片", "caption": "课件图片描述"}
+            st.dataframe(
+                [
+                    {
+                        "用途": purpose_names.get(s["purpose"], s["purpose"]),
+                        "图片数": s["images"],
+                        "原始大小(KB)": round(s["bytes_in"] / 1024, 1),
+                        "处理后(KB)": round(s["bytes_out"] / 1024, 1),
+                        "节省": f"{s['saved_ratio']:.0%}",
+                        "平均耗时(s)": round(s["avg_seconds"], 3),
+                    }
+                    for s in image_stats
+                ],
+                use_container_width=True,
+                hide_index=True
+            )
+
     st.divider()
     if st.button("💾 保存并应用配置", type="primary", use_container_width=True):
         current.update(new_settings)
@@ -182,6 +301,10 @@ def settings_dialog():
         st.rerun()
 
 def render_sidebar():
+    # 启动后台任务线程（每个进程一次），恢复上次退出时未完成的错题处理
+    import mistake_processor
+    mistake_processor.ensure_workers()
+
     # 注入 Javascript 强制移动 Logo 到侧栏最顶部 (比 CSS order 更可靠)
     # 同时处理 "Link Button" 的样式
     # 注入 CSS Hack 将 "app" 改名为 "首页"
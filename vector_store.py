@@ -1,5 +1,6 @@
 import os
-from typing import List, Dict
+import asyncio
+from typing import List, Dict, Optional
 
 import chromadb
 from chromadb.config import Settings
@@ -15,7 +16,9 @@ from config import (
     HYBRID_SEARCH_ALPHA,
     EMBEDDING_API_KEY,
     EMBEDDING_API_BASE,
-    get_openai_client
+    ASYNC_EMBEDDING_CONCURRENCY,
+    get_openai_client,
+    get_async_openai_client
 )
 import hashlib
 from rank_bm25 import BM25Okapi
@@ -23,6 +26,7 @@ import jieba
 from chromadb.utils import embedding_functions
 from datetime import datetime
 from settings_utils import get_user_data_dir
+from text_splitter import make_chunk_id
 
 class VectorStore:
 
@@ -35,6 +39,9 @@ class VectorStore:
 
         # 初始化OpenAI客户端
         self.client = get_openai_client(api_key=EMBEDDING_API_KEY, base_url=EMBEDDING_API_BASE)
+        # 异步客户端与并发信号量在首次异步调用时创建（需绑定到调用方的事件循环）
+        self._async_client = None
+        self._embedding_semaphore = None
 
         # 初始化ChromaDB
         self.chroma_client = chromadb.PersistentClient(
@@ -69,6 +76,7 @@ class VectorStore:
         self.doc_ids = []
         self.doc_contents = []
         self.doc_metadatas = []
+        self.id_to_idx = {}
         
         if self.enable_hybrid:
             self._build_bm25_index()
@@ -87,6 +95,7 @@ class VectorStore:
             self.doc_ids = all_docs["ids"]
             self.doc_contents = all_docs["documents"]
             self.doc_metadatas = all_docs["metadatas"]
+            self.id_to_idx = {did: i for i, did in enumerate(self.doc_ids)}
             
             # 分词
             tokenized_corpus = [list(jieba.cut(doc)) for doc in self.doc_contents]
@@ -123,6 +132,33 @@ class VectorStore:
                     # 最后一次尝试也失败，抛出异常
                     raise e
 
+    async def aget_embedding(self, text: str) -> List[float]:
+        """get_embedding 的异步版本，并发数受 ASYNC_EMBEDDING_CONCURRENCY 限制"""
+        if self._async_client is None:
+            self._async_client = get_async_openai_client(api_key=EMBEDDING_API_KEY, base_url=EMBEDDING_API_BASE)
+            self._embedding_semaphore = asyncio.Semaphore(ASYNC_EMBEDDING_CONCURRENCY)
+        
+        max_retries = 3
+        current_timeout = 60.0
+        
+        for attempt in range(max_retries):
+            try:
+                async with self._embedding_semaphore:
+                    response = await self._async_client.embeddings.create(
+                        model=OPENAI_EMBEDDING_MODEL,
+                        input=text,
+                        timeout=current_timeout
+                    )
+                return response.data[0].embedding
+            except Exception as e:
+                if attempt < max_retries - 1:
+                    wait_time = 2 * (attempt + 1)
+                    print(f"Embedding API 请求失败 (尝试 {attempt+1}/{max_retries}): {e}。等待 {wait_time} 秒后重试...")
+                    # 等待期间释放信号量，不占用并发名额
+                    await asyncio.sleep(wait_time)
+                else:
+                    raise e
+
     def add_documents(self, chunks: List[Dict[str, str]]) -> None:
         """添加文档块到向量数据库
         TODO: 实现文档块添加到向量数据库
@@ -153,18 +189,20 @@ class VectorStore:
                 "filetype": chunk.get("filetype", ""),
                 "page_number": str(chunk.get("page_number", 0)),
                 "chunk_id": str(chunk.get("chunk_id", 0)),
+                # 字符区间与相邻块 id 由 TextSplitter.split_documents 记录，用于邻近块扩展
+                "char_start": int(chunk.get("char_start", -1)),
+                "char_end": int(chunk.get("char_end", -1)),
+                "prev_id": chunk.get("prev_id", ""),
+                "next_id": chunk.get("next_id", ""),
             }
 
-            # === 修改开始 ===
-            chunk_id = chunk.get("chunk_id", 0)
-            page_number = chunk.get("page_number", 0)
-            filename = chunk.get("filename", "unknown")
-            filepath = chunk.get("filepath", "")
-            
             # 使用文件路径生成哈希，解决同名文件冲突问题
-            path_hash = hashlib.md5(filepath.encode('utf-8')).hexdigest()[:6]
-            unique_id = f"{filename}_{path_hash}_p{page_number}_c{chunk_id}"
-            # === 修改结束 ===
+            unique_id = chunk.get("id") or make_chunk_id(
+                chunk.get("filename", "unknown"),
+                chunk.get("filepath", ""),
+                chunk.get("page_number", 0),
+                chunk.get("chunk_id", 0)
+            )
 
             embedding = self.get_embedding(content)
 
@@ -187,11 +225,22 @@ class VectorStore:
                 print("正在更新 BM25 索引...")
                 self._build_bm25_index()
 
-    def search(self, query: str, top_k: int = TOP_K) -> Dict:
-        """搜索相关文档 (支持混合检索)"""
+    def search(self, query: str, top_k: int = TOP_K, embedding: Optional[List[float]] = None) -> Dict:
+        """搜索相关文档 (支持混合检索)；已有查询向量时通过 embedding 传入，避免重复请求"""
+        if embedding is None:
+            embedding = self.get_embedding(query)
+        return self._search_with_embedding(query, embedding, top_k)
+
+    async def asearch(self, query: str, top_k: int = TOP_K, embedding: Optional[List[float]] = None) -> Dict:
+        """search 的异步版本：Embedding 走异步客户端，本地的 Chroma/BM25 检索放到线程池中执行"""
+        if embedding is None:
+            embedding = await self.aget_embedding(query)
+        return await asyncio.to_thread(self._search_with_embedding, query, embedding, top_k)
+
+    def _search_with_embedding(self, query: str, embedding: List[float], top_k: int = TOP_K) -> Dict:
+        """使用已计算好的查询向量执行检索"""
         if not self.enable_hybrid or not self.bm25:
             # 仅使用向量检索
-            embedding = self.get_embedding(query)
             results = self.collection.query(
                 query_embeddings=embedding,
                 n_results=top_k,
@@ -201,7 +250,6 @@ class VectorStore:
         
         # 混合检索策略：Weighted Reciprocal Rank Fusion (Weighted RRF)
         # 1. 向量检索召回
-        embedding = self.get_embedding(query)
         # 扩大召回数量以便重排序
         fetch_k = min(top_k * 2, len(self.doc_ids)) if len(self.doc_ids) > 0 else top_k
         if fetch_k == 0: return {"documents": [[]], "metadatas": [[]], "distances": [[]]}
@@ -258,12 +306,9 @@ class VectorStore:
         res_metas = []
         res_scores = []
         
-        # 为了快速查找 content 和 metadata，建立索引映射
-        id_to_idx = {did: i for i, did in enumerate(self.doc_ids)}
-        
         for doc_id, score in top_results:
-            if doc_id in id_to_idx:
-                idx = id_to_idx[doc_id]
+            if doc_id in self.id_to_idx:
+                idx = self.id_to_idx[doc_id]
                 res_ids.append(doc_id)
                 res_docs.append(self.doc_contents[idx])
                 res_metas.append(self.doc_metadatas[idx])
@@ -276,6 +321,48 @@ class VectorStore:
             "distances": [res_scores] # 兼容 agent 逻辑，虽然名字叫 distance 但这里是 score
         }
 
+    def get_chunks_by_ids(self, ids: List[str]) -> Dict[str, Dict]:
+        """按 id 直接取出文档块（不做向量检索），返回 {id: {"content", "metadata"}}，不存在的 id 忽略"""
+        if not ids:
+            return {}
+        found = {}
+        missing = []
+        for doc_id in ids:
+            idx = self.id_to_idx.get(doc_id)
+            if idx is not None:
+                found[doc_id] = {"content": self.doc_contents[idx], "metadata": self.doc_metadatas[idx]}
+            else:
+                missing.append(doc_id)
+        if missing:
+            # 未开启混合检索时没有内存中的文档副本，直接查询 Chroma
+            try:
+                res = self.collection.get(ids=missing, include=["documents", "metadatas"])
+                for doc_id, content, meta in zip(res["ids"], res["documents"], res["metadatas"]):
+                    found[doc_id] = {"content": content, "metadata": meta}
+            except Exception as e:
+                print(f"按 id 读取文档块失败: {e}")
+        return found
+
+    def neighbor_ids(self, doc_id: str, meta: Dict) -> List[str]:
+        """命中块的前后相邻块 id
+
+        新建的索引在元数据中记录了 prev_id/next_id（可跨页）；
+        旧索引没有这两个字段，退化为同一页中块序号 ±1 的 id。
+        """
+        if "prev_id" in meta or "next_id" in meta:
+            return [i for i in (meta.get("prev_id"), meta.get("next_id")) if i]
+        try:
+            chunk_id = int(meta.get("chunk_id", 0))
+        except (TypeError, ValueError):
+            return []
+        filename = meta.get("filename", "unknown")
+        filepath = meta.get("filepath", "")
+        page_number = meta.get("page_number", 0)
+        return [
+            make_chunk_id(filename, filepath, page_number, c)
+            for c in (chunk_id - 1, chunk_id + 1) if c >= 0
+        ]
+
     def delete_collection(self, collection_name: str) -> None:
         """删除指定的collection"""
         # 同样需要进行哈希转换
@@ -367,6 +454,27 @@ class VectorStore:
             print(f"Error deleting by filepath: {e}")
             return 0
 
+    def get_documents_by_file(self) -> Dict[str, List[Dict]]:
+        """按文件分组返回所有文档块，组内按页码、块序号排序
+
+        Returns:
+            {filepath: [{"content", "filename", "page_number", "chunk_id"}, ...]}
+        """
+        all_docs = self.collection.get(include=["documents", "metadatas"])
+        grouped = {}
+        for content, meta in zip(all_docs["documents"] or [], all_docs["metadatas"] or []):
+            meta = meta or {}
+            key = meta.get("filepath") or meta.get("filename", "unknown")
+            grouped.setdefault(key, []).append({
+                "content": content,
+                "filename": meta.get("filename", "unknown"),
+                "page_number": int(meta.get("page_number", 0) or 0),
+                "chunk_id": int(meta.get("chunk_id", 0) or 0),
+            })
+        for chunks in grouped.values():
+            chunks.sort(key=lambda c: (c["page_number"], c["chunk_id"]))
+        return grouped
+
     def get_existing_files(self) -> set:
         """获取数据库中已存在的所有文件的路径 (filepath)"""
         try: